@@ -0,0 +1,206 @@
+"""
+Pre-aggregated analytics for tracks and sellers.
+
+Events (likes, downloads, purchases, revenue, listing views) are counted in
+memory and flushed every few seconds as `$inc` upserts on daily buckets in
+`analytics_rollups`:
+
+    {scope: "track" | "seller", key, granularity: "day", period: "2026-10-18",
+     metrics: {likes, downloads, purchases, revenue, listing_views}}
+
+A nightly compaction folds the day buckets since the last compacted month
+into "week" (period = Monday) and "month" (period = 1st) buckets. Queries split
+the requested range into whole compacted months and weeks plus leftover days,
+so any range reads a few dozen pre-aggregated documents at most.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("likes", "downloads", "purchases", "revenue", "listing_views")
+COMPACTION_STATE_ID = "analytics_compaction"
+
+
+def _month_end(day: date) -> date:
+    next_month = day.replace(day=28) + timedelta(days=4)
+    return next_month - timedelta(days=next_month.day)
+
+
+def _split_weeks(start: date, end: date, limit: Optional[date], buckets: Dict[str, List[str]]):
+    cursor = start
+    while cursor <= end:
+        if limit and cursor.weekday() == 0 and cursor + timedelta(days=6) <= min(end, limit):
+            buckets["week"].append(cursor.isoformat())
+            cursor += timedelta(days=7)
+        else:
+            buckets["day"].append(cursor.isoformat())
+            cursor += timedelta(days=1)
+
+
+def plan_buckets(start: date, end: date, compacted_through: Optional[date]) -> Dict[str, List[str]]:
+    """Split [start, end] into compacted months, then compacted weeks, then single days"""
+    buckets = {"month": [], "week": [], "day": []}
+    limit = min(end, compacted_through) if compacted_through else None
+    segment_start = cursor = start
+    while cursor <= end:
+        if limit and cursor.day == 1 and _month_end(cursor) <= limit:
+            _split_weeks(segment_start, cursor - timedelta(days=1), limit, buckets)
+            buckets["month"].append(cursor.isoformat())
+            segment_start = cursor = _month_end(cursor) + timedelta(days=1)
+        else:
+            cursor += timedelta(days=1)
+    _split_weeks(segment_start, end, limit, buckets)
+    return buckets
+
+
+class AnalyticsService:
+    """Buffered event counters, compaction and range queries over rollups"""
+
+    def __init__(self, db):
+        self.db = db
+        self.rollups = db.analytics_rollups
+        self._buffer: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    # ----- Recording -----
+
+    def record(self, scope: str, key: str, metrics: Dict[str, float], when: Optional[datetime] = None):
+        if not key:
+            return
+        day = (when or datetime.now(timezone.utc)).date().isoformat()
+        counters = self._buffer[(scope, key, day)]
+        for metric, amount in metrics.items():
+            counters[metric] += amount
+
+    def record_track(self, track_id: str, seller_id: Optional[str], metrics: Dict[str, float]):
+        """Count an event for a track and for the seller who owns it"""
+        self.record("track", track_id, metrics)
+        if seller_id:
+            self.record("seller", seller_id, metrics)
+
+    async def flush(self):
+        """Write buffered counters as one bulk of daily `$inc` upserts"""
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, defaultdict(lambda: defaultdict(float))
+        updates = [
+            UpdateOne(
+                {"scope": scope, "key": key, "granularity": "day", "period": day},
+                {"$inc": {f"metrics.{metric}": amount for metric, amount in counters.items()}},
+                upsert=True
+            )
+            for (scope, key, day), counters in buffer.items()
+        ]
+        try:
+            await self.rollups.bulk_write(updates, ordered=False)
+        except Exception:
+            # Put the counters back so the next flush retries them
+            for bucket, counters in buffer.items():
+                for metric, amount in counters.items():
+                    self._buffer[bucket][metric] += amount
+            raise
+
+    # ----- Compaction -----
+
+    async def compact(self, today: Optional[date] = None):
+        """Rebuild week and month buckets from day buckets.
+
+        Each run recomputes from the month holding the last compacted day (and
+        the weeks overlapping it), so months missed by skipped runs are built
+        too; the first run compacts the whole history.
+        """
+        today = today or datetime.now(timezone.utc).date()
+        last_closed_day = today - timedelta(days=1)
+        state = await self.db.job_state.find_one({"_id": COMPACTION_STATE_ID})
+
+        compacted_through = date.fromisoformat(state["compacted_through"]) if state else last_closed_day
+        month_start = min(compacted_through, last_closed_day).replace(day=1)
+        windows = {
+            "month": month_start,
+            # Weeks straddling the month start need their earlier days too
+            "week": month_start - timedelta(days=month_start.weekday())
+        }
+
+        sums = {metric: {"$sum": f"$metrics.{metric}"} for metric in METRICS}
+        period_date = {"$dateFromString": {"dateString": "$period", "format": "%Y-%m-%d"}}
+        for granularity, window_start in windows.items():
+            period_range = {"$lte": last_closed_day.isoformat()}
+            if state:
+                period_range["$gte"] = window_start.isoformat()
+            await self.rollups.aggregate([
+                {"$match": {"granularity": "day", "period": period_range}},
+                {
+                    "$group": {
+                        "_id": {
+                            "scope": "$scope",
+                            "key": "$key",
+                            "period": {"$dateToString": {
+                                "format": "%Y-%m-%d",
+                                "date": {"$dateTrunc": {"date": period_date, "unit": granularity, "startOfWeek": "monday"}}
+                            }}
+                        },
+                        **sums
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "scope": "$_id.scope",
+                        "key": "$_id.key",
+                        "granularity": granularity,
+                        "period": "$_id.period",
+                        "metrics": {metric: f"${metric}" for metric in METRICS}
+                    }
+                },
+                {
+                    "$merge": {
+                        "into": "analytics_rollups",
+                        "on": ["scope", "key", "granularity", "period"],
+                        "whenMatched": "replace",
+                        "whenNotMatched": "insert"
+                    }
+                }
+            ], allowDiskUse=True).to_list(None)
+
+        await self.db.job_state.update_one(
+            {"_id": COMPACTION_STATE_ID},
+            {"$set": {"compacted_through": last_closed_day.isoformat()}},
+            upsert=True
+        )
+        logger.info(f"Analytics compacted through {last_closed_day.isoformat()}")
+
+    # ----- Queries -----
+
+    async def query(self, scope: str, key: str, start: date, end: date) -> Dict:
+        state = await self.db.job_state.find_one({"_id": COMPACTION_STATE_ID})
+        compacted_through = date.fromisoformat(state["compacted_through"]) if state else None
+        buckets = plan_buckets(start, end, compacted_through)
+
+        clauses = [
+            {"granularity": granularity, "period": {"$in": periods}}
+            for granularity, periods in buckets.items() if periods
+        ]
+        documents = await self.rollups.find(
+            {"scope": scope, "key": key, "$or": clauses},
+            {"_id": 0, "granularity": 1, "period": 1, "metrics": 1}
+        ).to_list(None)
+
+        totals = {metric: 0 for metric in METRICS}
+        for document in documents:
+            for metric in METRICS:
+                totals[metric] += document.get("metrics", {}).get(metric, 0)
+        totals["revenue"] = round(totals["revenue"], 2)
+        documents.sort(key=lambda document: document["period"])
+        return {
+            "scope": scope,
+            "key": key,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "totals": totals,
+            "buckets": documents
+        }
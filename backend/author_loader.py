@@ -0,0 +1,163 @@
+"""
+Batched author lookups for the community and solidarity endpoints.
+
+An AuthorLoader lives for one request. Every user id requested while a page is
+rendered is collected and resolved with a single $in query on `users` and a
+single $in query on `musician_profiles`. Resolved snapshots are kept in an
+AuthorSnapshotCache shared by all requests for a short TTL.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+USER_PROJECTION = {"_id": 0, "id": 1, "username": 1}
+PROFILE_PROJECTION = {"_id": 0, "user_id": 1, "stage_name": 1, "profile_image": 1}
+
+
+class AuthorSnapshotCache:
+    """Short-TTL, process-wide cache of author snapshots keyed by user id"""
+
+    def __init__(self, ttl_seconds: float = 30, max_entries: int = 50000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[str, tuple] = {}
+
+    def get_many(self, user_ids: Iterable[str]) -> tuple:
+        """Return (snapshots found, ids missing or expired)"""
+        now = time.monotonic()
+        found, missing = {}, []
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                found[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+        return found, missing
+
+    def set_many(self, snapshots: Dict[str, Optional[Dict]]):
+        if len(self._entries) + len(snapshots) > self.max_entries:
+            self._evict_expired()
+        expires_at = time.monotonic() + self.ttl_seconds
+        for user_id, snapshot in snapshots.items():
+            self._entries[user_id] = (expires_at, snapshot)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+        # Still full: drop the oldest half rather than growing without bound
+        if len(self._entries) >= self.max_entries:
+            ordered = sorted(self._entries.items(), key=lambda item: item[1][0])
+            self._entries = dict(ordered[len(ordered) // 2:])
+
+
+class AuthorLoader:
+    """DataLoader-style batch loader for author snapshots.
+
+    Snapshots are dicts with `id`, `username`, `stage_name` and `profile_image`;
+    unknown users resolve to None. Calls to `load` made in the same event loop
+    tick are coalesced into one batch.
+    """
+
+    def __init__(self, db, cache: AuthorSnapshotCache):
+        self.db = db
+        self.cache = cache
+        self._resolved: Dict[str, Optional[Dict]] = {}
+        self._queue: Dict[str, asyncio.Future] = {}
+        self._dispatch_scheduled = False
+
+    async def load(self, user_id: str) -> Optional[Dict]:
+        if user_id in self._resolved:
+            return self._resolved[user_id]
+        future = self._queue.get(user_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._queue[user_id] = future
+            self._schedule_dispatch()
+        return await future
+
+    async def load_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        unique_ids = list(dict.fromkeys(uid for uid in user_ids if uid))
+        snapshots = await asyncio.gather(*(self.load(uid) for uid in unique_ids))
+        return dict(zip(unique_ids, snapshots))
+
+    async def attach(
+        self,
+        items: List[Dict],
+        id_key: str,
+        target_key: str,
+        fields: Iterable[str] = ("username", "stage_name", "profile_image"),
+        drop_missing: bool = False
+    ) -> List[Dict]:
+        """Embed `fields` of each item's author under `target_key`.
+
+        Items are paginated before their authors are loaded, so an item whose
+        author no longer exists keeps its place with a placeholder author (all
+        fields None but `id`) and pages stay full. With `drop_missing` such
+        items are removed instead.
+        """
+        fields = tuple(fields)
+        authors = await self.load_many(item.get(id_key) for item in items)
+        result = []
+        for item in items:
+            author = authors.get(item.get(id_key))
+            if author is None:
+                if drop_missing:
+                    continue
+                author = {"id": item.get(id_key)}
+            item[target_key] = {field: author.get(field) for field in fields}
+            result.append(item)
+        return result
+
+    def _schedule_dispatch(self):
+        if not self._dispatch_scheduled:
+            self._dispatch_scheduled = True
+            asyncio.get_running_loop().call_soon(
+                lambda: asyncio.ensure_future(self._dispatch())
+            )
+
+    async def _dispatch(self):
+        self._dispatch_scheduled = False
+        batch, self._queue = self._queue, {}
+        try:
+            snapshots = await self._resolve(list(batch))
+        except Exception as e:
+            logger.error(f"Error loading authors: {e}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for user_id, future in batch.items():
+            self._resolved[user_id] = snapshots.get(user_id)
+            if not future.done():
+                future.set_result(snapshots.get(user_id))
+
+    async def _resolve(self, user_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        snapshots, missing = self.cache.get_many(user_ids)
+        if not missing:
+            return snapshots
+
+        users, profiles = await asyncio.gather(
+            self.db.users.find({"id": {"$in": missing}}, USER_PROJECTION).to_list(None),
+            self.db.musician_profiles.find({"user_id": {"$in": missing}}, PROFILE_PROJECTION).to_list(None)
+        )
+        profiles_by_user = {profile["user_id"]: profile for profile in profiles}
+
+        fetched: Dict[str, Optional[Dict]] = {user_id: None for user_id in missing}
+        for user in users:
+            profile = profiles_by_user.get(user["id"], {})
+            fetched[user["id"]] = {
+                "id": user["id"],
+                "username": user.get("username"),
+                "stage_name": profile.get("stage_name"),
+                "profile_image": profile.get("profile_image")
+            }
+        self.cache.set_many(fetched)
+        snapshots.update(fetched)
+        return snapshots
@@ -0,0 +1,140 @@
+"""
+Momentum ranking of active solidarity campaigns.
+
+Every donation is added to an hourly bucket of its campaign in
+`campaign_donation_buckets` ({campaign_id, hour, hour_start, amount, count});
+a TTL index drops buckets a day after they leave the ranking window. The ranking is
+rebuilt periodically from the active campaigns and the recent buckets, and
+the top N campaigns per (region, project_type) are kept in memory, so
+trending queries never scan donations.
+
+A campaign's score combines:
+  - velocity: donations of the window, decayed by age (half-life of a day)
+    and relative to the campaign goal, normalized against the fastest campaign
+  - progress: share of the goal already reached
+  - urgency: how close the deadline is (last two weeks)
+"""
+
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ANY = "all"
+
+DEFAULT_WEIGHTS = {"velocity": 0.5, "progress": 0.3, "urgency": 0.2}
+
+WINDOW_HOURS = 72
+# Buckets are kept one day past the window so a late rebuild still sees all of it
+BUCKET_TTL_SECONDS = (WINDOW_HOURS + 24) * 3600
+
+CAMPAIGN_FIELDS = {
+    "_id": 0, "id": 1, "creator_id": 1, "title": 1, "description": 1, "project_type": 1, "region": 1,
+    "music_style": 1, "goal_amount": 1, "current_amount": 1, "donors_count": 1, "currency": 1,
+    "deadline": 1, "image_url": 1, "featured": 1, "status": 1, "created_at": 1
+}
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value if isinstance(value, datetime) else None
+
+
+class CampaignRanking:
+    """Hourly donation buckets and an in-memory trending leaderboard"""
+
+    def __init__(
+        self,
+        db,
+        window_hours: int = WINDOW_HOURS,
+        half_life_hours: float = 24,
+        urgency_days: int = 14,
+        top_n: int = 50,
+        weights: Optional[Dict[str, float]] = None
+    ):
+        self.db = db
+        self.buckets = db.campaign_donation_buckets
+        self.window_hours = window_hours
+        self.half_life_hours = half_life_hours
+        self.urgency_days = urgency_days
+        self.top_n = top_n
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.leaderboards: Dict[tuple, List[Dict]] = {}
+
+    async def record_donation(self, campaign_id: str, amount: float, when: Optional[datetime] = None):
+        hour_start = (when or datetime.now(timezone.utc)).replace(minute=0, second=0, microsecond=0)
+        await self.buckets.update_one(
+            {"campaign_id": campaign_id, "hour": hour_start.strftime("%Y-%m-%dT%H")},
+            {"$inc": {"amount": amount, "count": 1}, "$setOnInsert": {"hour_start": hour_start}},
+            upsert=True
+        )
+
+    async def rebuild(self):
+        """Score all active campaigns and swap in fresh leaderboards"""
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        window_start = now - timedelta(hours=self.window_hours)
+
+        decayed = defaultdict(float)
+        recent = defaultdict(float)
+        async for bucket in self.buckets.find(
+            {"hour_start": {"$gte": window_start}},
+            {"_id": 0, "campaign_id": 1, "hour_start": 1, "amount": 1}
+        ):
+            age_hours = (now - _as_datetime(bucket["hour_start"])).total_seconds() / 3600
+            decayed[bucket["campaign_id"]] += bucket["amount"] * 0.5 ** (age_hours / self.half_life_hours)
+            recent[bucket["campaign_id"]] += bucket["amount"]
+
+        campaigns = []
+        async for campaign in self.db.musician_campaigns.find({"status": "active"}, CAMPAIGN_FIELDS):
+            deadline = _as_datetime(campaign.get("deadline"))
+            if deadline and deadline <= now:
+                continue
+            goal = campaign.get("goal_amount") or 0
+            campaign["_velocity"] = decayed[campaign["id"]] / goal if goal > 0 else 0
+            campaign["_deadline"] = deadline
+            campaigns.append(campaign)
+
+        fastest = max((campaign["_velocity"] for campaign in campaigns), default=0)
+        ranked = []
+        for campaign in campaigns:
+            ranked.append(self._score(campaign, fastest, now, recent[campaign["id"]]))
+        ranked.sort(key=lambda campaign: campaign["trending_score"], reverse=True)
+
+        leaderboards = defaultdict(list)
+        for campaign in ranked:
+            region, project_type = campaign.get("region"), campaign.get("project_type")
+            for key in {(ANY, ANY), (region, ANY), (ANY, project_type), (region, project_type)}:
+                if len(leaderboards[key]) < self.top_n:
+                    leaderboards[key].append(campaign)
+        self.leaderboards = dict(leaderboards)
+        logger.info(f"Campaign ranking rebuilt over {len(ranked)} campaigns in {time.perf_counter() - started:.2f}s")
+
+    def _score(self, campaign: Dict, fastest: float, now: datetime, recent_amount: float) -> Dict:
+        velocity = campaign.pop("_velocity") / fastest if fastest > 0 else 0
+        deadline = campaign.pop("_deadline")
+        goal = campaign.get("goal_amount") or 0
+        progress = min(campaign.get("current_amount", 0) / goal, 1) if goal > 0 else 0
+        urgency = 0.0
+        if deadline:
+            days_left = (deadline - now).total_seconds() / 86400
+            urgency = max(0.0, 1 - days_left / self.urgency_days)
+
+        breakdown = {"velocity": velocity, "progress": progress, "urgency": urgency}
+        score = sum(self.weights[name] * value for name, value in breakdown.items())
+        campaign.update(
+            trending_score=round(score, 4),
+            score_breakdown={name: round(value, 3) for name, value in breakdown.items()},
+            recent_amount=round(recent_amount, 2),
+            progress_percentage=round(progress * 100, 2)
+        )
+        return campaign
+
+    def trending(self, region: Optional[str] = None, project_type: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        return self.leaderboards.get((region or ANY, project_type or ANY), [])[:limit]
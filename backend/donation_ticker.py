@@ -0,0 +1,135 @@
+"""
+Live donation ticker for Server-Sent Events.
+
+Completed donations are published on the realtime hub, on the global
+`donations` channel and on `campaign:<id>` for campaign donations, so they
+reach every worker through the Redis backplane. Each worker listens to the
+global channel and keeps the latest events in ring buffers (one global, one
+per recently active campaign): a client that connects, or reconnects with
+Last-Event-ID, is backfilled from memory, and streaming clients never query
+MongoDB.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from realtime import BroadcastHub, encode_event
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_CHANNEL = "donations"
+
+
+def campaign_channel(campaign_id: str) -> str:
+    return f"campaign:{campaign_id}"
+
+
+def public_donation(donation: Dict, source: str) -> Dict:
+    """Fields of a donation that may be shown publicly"""
+    anonymous = donation.get("is_anonymous", False)
+    created_at = donation.get("created_at")
+    return {
+        "id": donation["id"],
+        "source": source,
+        "campaign_id": donation.get("campaign_id"),
+        "donor_name": "Anonyme" if anonymous else (donation.get("donor_name") or "Anonyme"),
+        "amount": donation.get("amount", 0),
+        "currency": donation.get("currency", "EUR"),
+        "message": None if anonymous else donation.get("message"),
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at
+    }
+
+
+def sse_message(event: Dict) -> str:
+    """Format a ticker event as one SSE message (id = donation id)"""
+    return f"id: {event['donation']['id']}\nevent: {event['type']}\ndata: {encode_event(event)}\n\n"
+
+
+class DonationTicker:
+    """Publishes donation events and keeps the latest ones for backfill"""
+
+    def __init__(self, hub: BroadcastHub, global_size: int = 50, campaign_size: int = 20, max_campaigns: int = 2000):
+        self.hub = hub
+        self.campaign_size = campaign_size
+        self.max_campaigns = max_campaigns
+        self.recent_events: Deque[Dict] = deque(maxlen=global_size)
+        self.campaign_events: "OrderedDict[str, Deque[Dict]]" = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+
+    async def publish(self, donation: Dict, source: str, campaign: Optional[Dict] = None):
+        event = {"type": "donation.new", "donation": public_donation(donation, source), "campaign": campaign}
+        if event["donation"]["campaign_id"]:
+            await self.hub.publish(campaign_channel(event["donation"]["campaign_id"]), event)
+        # Ring buffers are filled by the listener, on every worker alike
+        await self.hub.publish(GLOBAL_CHANNEL, event)
+
+    def remember(self, event: Dict):
+        self.recent_events.append(event)
+        campaign_id = event["donation"].get("campaign_id")
+        if campaign_id:
+            events = self.campaign_events.get(campaign_id)
+            if events is None:
+                if len(self.campaign_events) >= self.max_campaigns:
+                    self.campaign_events.popitem(last=False)
+                events = self.campaign_events[campaign_id] = deque(maxlen=self.campaign_size)
+            else:
+                self.campaign_events.move_to_end(campaign_id)
+            events.append(event)
+
+    def backfill(self, campaign_id: Optional[str] = None, last_event_id: Optional[str] = None) -> List[Dict]:
+        """Buffered events, oldest first; only those after `last_event_id` when it is still buffered"""
+        events = list(self.campaign_events.get(campaign_id, ()) if campaign_id else self.recent_events)
+        if last_event_id:
+            for position, event in enumerate(events):
+                if event["donation"]["id"] == last_event_id:
+                    return events[position + 1:]
+        return events
+
+    async def warm(self, db):
+        """Fill the ring buffers with the latest completed donations (once, at startup)"""
+        limit = self.recent_events.maxlen
+        campaign_donations = await db.donations.find(
+            {"campaign_id": {"$exists": True}, "payment_status": "completed"}, {"_id": 0}
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+        platform_donations = await db.donations.find(
+            {"status": "completed"}, {"_id": 0}
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+
+        events = [
+            {"type": "donation.new", "donation": public_donation(donation, source), "campaign": None}
+            for source, donations in (("campaign", campaign_donations), ("platform", platform_donations))
+            for donation in donations
+        ]
+        events.sort(key=lambda event: event["donation"]["created_at"] or "")
+        for event in events[-limit:]:
+            self.remember(event)
+
+    def start(self):
+        subscription = self.hub.subscribe([GLOBAL_CHANNEL], max_queue=1024)
+        self._listener = asyncio.ensure_future(self._listen(subscription))
+
+    async def _listen(self, subscription):
+        try:
+            while True:
+                _, event = await subscription.get()
+                if subscription.overflowed:
+                    logger.warning("Donation ticker fell behind, some events were not buffered")
+                    subscription.overflowed = False
+                try:
+                    self.remember(event)
+                except Exception as e:
+                    logger.warning(f"Could not buffer donation event: {e}")
+        finally:
+            self.hub.unsubscribe(subscription)
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
@@ -0,0 +1,276 @@
+"""
+Bucketed storage for group chat history.
+
+Messages of a group are stored in `group_message_buckets` documents holding
+up to `bucket_size` messages of the same UTC day, each with a snapshot of its
+sender taken when it was sent. Each group has at most one open bucket
+(`open: true`, enforced by a partial unique index); appending is a single
+upserting `$push` on it, and a full bucket (or a new day) is closed and rolls
+over to a new one. A page of history reads the newest one or two buckets
+before the cursor.
+
+Messages written to the legacy `group_messages` collection are converted by
+`migrate_legacy`, run on one worker at a time under a job lease; until it has
+completed, pages also read the legacy messages not moved yet. The migration is
+also available from the command line:
+
+    python group_chat_store.py migrate
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from author_loader import AuthorLoader, AuthorSnapshotCache
+from job_scheduler import JobLeases
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_NAME = "group_chat_buckets"
+
+SENDER_FIELDS = ("id", "username", "stage_name")
+MESSAGE_FIELDS = ("id", "content", "message_type", "media_url", "reply_to_message_id", "created_at", "edited_at")
+
+
+class GroupChatStore:
+    """Append and page group messages stored in day/size-bounded buckets"""
+
+    def __init__(self, db, author_cache: AuthorSnapshotCache, bucket_size: int = 100):
+        self.db = db
+        self.author_cache = author_cache
+        self.bucket_size = bucket_size
+        self.buckets = db.group_message_buckets
+        self.legacy_migrated = False
+
+    @staticmethod
+    def _entry(message: Dict, sender: Optional[Dict]) -> Dict:
+        entry = {field: message.get(field) for field in MESSAGE_FIELDS}
+        entry["sender"] = {field: (sender or {}).get(field) for field in SENDER_FIELDS}
+        entry["is_deleted"] = bool(message.get("is_deleted", False))
+        return entry
+
+    async def append(self, group_id: str, message: Dict) -> Dict:
+        """Store a message (with ISO `created_at`) and return it as served to clients"""
+        sender = await AuthorLoader(self.db, self.author_cache).load(message["sender_id"])
+        entry = self._entry(message, sender)
+        created_at = entry["created_at"]
+        day = created_at[:10]
+        push = {
+            "$push": {"messages": entry},
+            "$inc": {"count": 1},
+            "$max": {"last_at": created_at},
+            "$min": {"first_at": created_at}
+        }
+        while True:
+            # Only one open bucket per group can exist: racing appends either
+            # push into it or fail the upsert on the unique index and retry
+            try:
+                await self.buckets.update_one(
+                    {"group_id": group_id, "open": True, "day": day, "count": {"$lt": self.bucket_size}},
+                    {**push, "$setOnInsert": {"id": str(uuid.uuid4())}},
+                    upsert=True
+                )
+                return self._public(entry)
+            except DuplicateKeyError:
+                # The open bucket is full or from another day: close it and roll over
+                await self.buckets.update_one(
+                    {
+                        "group_id": group_id,
+                        "open": True,
+                        "$or": [{"day": {"$ne": day}}, {"count": {"$gte": self.bucket_size}}]
+                    },
+                    {"$set": {"open": False}}
+                )
+
+    async def page(self, group_id: str, limit: int, before: Optional[str] = None, skip: int = 0) -> List[Dict]:
+        """Newest messages first, older than `before` when given"""
+        if not await self.is_migrated():
+            return await self._page_with_legacy(group_id, limit, before, skip)
+        
+        wanted = skip + limit
+        query = {"group_id": group_id}
+        if before:
+            query["first_at"] = {"$lt": before}
+
+        messages = []
+        cursor = self.buckets.find(query, {"_id": 0, "messages": 1}).sort("first_at", -1).batch_size(2)
+        async for bucket in cursor:
+            messages.extend(
+                message for message in bucket["messages"]
+                if not message.get("is_deleted") and (before is None or message["created_at"] < before)
+            )
+            if len(messages) >= wanted:
+                break
+
+        messages.sort(key=lambda message: message["created_at"], reverse=True)
+        return [self._public(message) for message in messages[skip:wanted]]
+
+    async def since(self, group_ids: List[str], created_at: str, limit: int) -> List[Dict]:
+        """Messages of several groups newer than `created_at`, oldest first"""
+        if not group_ids:
+            return []
+        buckets = await self.buckets.find(
+            {"group_id": {"$in": group_ids}, "last_at": {"$gt": created_at}},
+            {"_id": 0, "group_id": 1, "messages": 1}
+        ).sort("first_at", 1).to_list(limit)
+
+        messages = []
+        for bucket in buckets:
+            for message in bucket["messages"]:
+                if not message.get("is_deleted") and message["created_at"] > created_at:
+                    messages.append((bucket["group_id"], self._public(message)))
+        messages.sort(key=lambda item: item[1]["created_at"])
+        return messages[:limit]
+
+    async def find_created_at(self, message_id: str) -> Optional[str]:
+        bucket = await self.buckets.find_one({"messages.id": message_id}, {"_id": 0, "messages.$": 1})
+        if bucket:
+            return bucket["messages"][0]["created_at"]
+        if not await self.is_migrated():
+            message = await self.db.group_messages.find_one({"id": message_id}, {"_id": 0, "created_at": 1})
+            return str(message["created_at"]) if message else None
+        return None
+
+    @staticmethod
+    def _public(message: Dict) -> Dict:
+        return {key: value for key, value in message.items() if key != "is_deleted"}
+
+    # ----- Migration from one document per message -----
+
+    async def is_migrated(self) -> bool:
+        if not self.legacy_migrated:
+            self.legacy_migrated = await self.db.migrations.find_one({"_id": MIGRATION_NAME}) is not None
+        return self.legacy_migrated
+
+    async def _page_with_legacy(self, group_id: str, limit: int, before: Optional[str], skip: int) -> List[Dict]:
+        """page() while the migration runs: buckets merged with legacy messages not moved yet"""
+        wanted = skip + limit
+        query = {"group_id": group_id}
+        if before:
+            query["first_at"] = {"$lt": before}
+        messages = {}
+        cursor = self.buckets.find(query, {"_id": 0, "messages": 1}).sort("first_at", -1).batch_size(2)
+        async for bucket in cursor:
+            for message in bucket["messages"]:
+                if not message.get("is_deleted") and (before is None or message["created_at"] < before):
+                    messages[message["id"]] = message
+            if len(messages) >= wanted:
+                break
+
+        legacy_query = {"group_id": group_id, "is_deleted": False, "bucketed": {"$exists": False}}
+        if before:
+            legacy_query["created_at"] = {"$lt": before}
+        legacy = await self.db.group_messages.find(legacy_query, {"_id": 0}).sort("created_at", -1).to_list(wanted)
+        senders = await AuthorLoader(self.db, self.author_cache).load_many(m["sender_id"] for m in legacy)
+        for message in legacy:
+            message["created_at"] = str(message["created_at"])
+            messages.setdefault(message["id"], self._entry(message, senders.get(message["sender_id"])))
+
+        ordered = sorted(messages.values(), key=lambda message: message["created_at"], reverse=True)
+        return [self._public(message) for message in ordered[skip:wanted]]
+
+    async def run_migration(self, leases: JobLeases, lease_seconds: float = 300, retry_seconds: float = 30):
+        """Run migrate_legacy on the worker holding the lease; the others wait for it to complete"""
+        while not await self.is_migrated():
+            try:
+                if await leases.acquire(MIGRATION_NAME, lease_seconds):
+                    await self.migrate_legacy(lambda: leases.acquire(MIGRATION_NAME, lease_seconds))
+                    continue
+            except Exception as e:
+                logger.error(f"Group chat migration failed, retrying: {e}")
+            await asyncio.sleep(retry_seconds)
+
+    async def migrate_legacy(self, renew_lease=None) -> int:
+        """Copy legacy `group_messages` documents into buckets and record the migration as done.
+
+        Messages of a group are cut into buckets in (`created_at`, `id`) order,
+        deleted ones included, so every run cuts the same ranges; each bucket
+        id is derived from the group and its first message. A bucket already
+        written is not written again, so an interrupted run can be restarted.
+        `renew_lease` is awaited between groups to keep the job lease; once it
+        returns False another worker owns the migration and this run stops
+        without recording it as done.
+        """
+        migrated = 0
+        for group_id in await self.db.group_messages.distinct("group_id", {"bucketed": {"$exists": False}}):
+            if renew_lease and not await renew_lease():
+                logger.warning("Group chat migration lease lost, leaving the rest to its new holder")
+                return migrated
+            cursor = self.db.group_messages.find({"group_id": group_id}, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+            chunk = []
+            async for message in cursor:
+                created_at = str(message["created_at"])
+                if chunk and (len(chunk) >= self.bucket_size or chunk[0]["created_at"][:10] != created_at[:10]):
+                    migrated += await self._write_legacy_bucket(group_id, chunk)
+                    chunk = []
+                message["created_at"] = created_at
+                chunk.append(message)
+            if chunk:
+                migrated += await self._write_legacy_bucket(group_id, chunk)
+
+        await self.db.migrations.update_one(
+            {"_id": MIGRATION_NAME},
+            {"$setOnInsert": {"completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        self.legacy_migrated = True
+        if migrated:
+            logger.info(f"Moved {migrated} group messages into buckets")
+        return migrated
+
+    async def _write_legacy_bucket(self, group_id: str, chunk: List[Dict]) -> int:
+        """Write the bucket of one legacy range unless already done; returns the messages moved"""
+        pending = [message["id"] for message in chunk if not message.get("bucketed")]
+        if not pending:
+            return 0
+        senders = await AuthorLoader(self.db, self.author_cache).load_many(m["sender_id"] for m in chunk)
+        entries = [self._entry(message, senders.get(message["sender_id"])) for message in chunk]
+        await self.buckets.update_one(
+            {"id": f"legacy:{group_id}:{chunk[0]['id']}"},
+            {"$setOnInsert": {
+                "group_id": group_id,
+                "day": entries[0]["created_at"][:10],
+                # Legacy buckets are closed: live appends go to their own buckets
+                "count": self.bucket_size,
+                "open": False,
+                "first_at": entries[0]["created_at"],
+                "last_at": entries[-1]["created_at"],
+                "messages": entries
+            }},
+            upsert=True
+        )
+        await self.db.group_messages.bulk_write([
+            UpdateOne({"id": message_id}, {"$set": {"bucketed": True}}) for message_id in pending
+        ], ordered=False)
+        return len(pending)
+
+
+async def _main(command: str):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        store = GroupChatStore(client[os.environ['DB_NAME']], AuthorSnapshotCache())
+        if command == "migrate":
+            print(f"Migrated {await store.migrate_legacy()} group messages")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2 or sys.argv[1] != "migrate":
+        print("Usage: python group_chat_store.py migrate")
+        sys.exit(2)
+    asyncio.run(_main(sys.argv[1]))
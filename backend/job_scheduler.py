@@ -0,0 +1,101 @@
+"""
+Periodic background jobs for the API process.
+
+Jobs are plain coroutines run on a fixed interval in the event loop. A failing
+run is logged and retried at the next interval; it never stops the schedule.
+
+Jobs that must run once across all workers (settlements, state transitions)
+are scheduled with a lease: before each run the worker takes a time-limited
+lease in the `job_leases` collection and skips the run if another worker
+holds it. The lease is kept until it expires, so with a lease about as long
+as the interval the job runs once per interval across all workers, and
+another worker takes over within one lease period if the holder dies.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class JobLeases:
+    """Time-limited, per-job locks shared by all workers through MongoDB"""
+
+    def __init__(self, db, owner: Optional[str] = None):
+        self.collection = db.job_leases
+        self.owner = owner or str(uuid.uuid4())
+
+    async def acquire(self, name: str, ttl_seconds: float) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await self.collection.find_one_and_update(
+                {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "acquired_at": now, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held by another worker
+            return False
+        return lease is not None and lease["owner"] == self.owner
+
+
+class PeriodicJobs:
+    """Registry of named jobs running on fixed intervals"""
+
+    def __init__(self, leases: Optional[JobLeases] = None):
+        self.leases = leases
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def schedule(
+        self,
+        name: str,
+        interval_seconds: float,
+        job: Callable[[], Awaitable],
+        run_immediately: bool = False,
+        lease_seconds: Optional[float] = None
+    ):
+        """Run `job` every `interval_seconds`.
+
+        With `lease_seconds`, a run only happens on the worker holding the
+        job's lease. It should be close to the interval and longer than the
+        longest expected run.
+        """
+        if name in self._tasks:
+            raise ValueError(f"Job {name} is already scheduled")
+        if lease_seconds and not self.leases:
+            raise ValueError(f"Job {name} needs leases but none are configured")
+        self._tasks[name] = asyncio.ensure_future(
+            self._run(name, interval_seconds, job, run_immediately, lease_seconds)
+        )
+
+    async def _run(self, name: str, interval_seconds: float, job, run_immediately: bool, lease_seconds):
+        if not run_immediately:
+            await asyncio.sleep(interval_seconds)
+        while True:
+            try:
+                if not lease_seconds:
+                    await job()
+                elif await self.leases.acquire(name, lease_seconds):
+                    await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Periodic job {name} failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        for task in self._tasks.values():
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
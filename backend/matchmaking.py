@@ -0,0 +1,228 @@
+"""
+Musician matchmaking: compatibility ranking over all active musician profiles.
+
+Profiles are kept in a compact, array-backed snapshot (multi-hot matrices for
+instruments, genres and looking_for, integer codes for region, city and
+experience level). Ranking a user against every profile is a handful of
+vectorized NumPy operations, so tens of thousands of profiles are scored in
+a few milliseconds.
+
+The snapshot is rebuilt from MongoDB at startup and periodically, and updated
+in place whenever a profile is saved on this worker.
+"""
+
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EXPERIENCE_LEVELS = {"débutant": 0, "intermédiaire": 1, "avancé": 2, "professionnel": 3}
+
+DEFAULT_WEIGHTS = {
+    "instruments": 0.30,  # candidate plays what the user does not
+    "genres": 0.30,       # shared genres (Jaccard)
+    "looking_for": 0.15,  # same intents (collaboration, jam session, ...)
+    "proximity": 0.15,    # same city, else same region
+    "experience": 0.10    # close experience levels
+}
+
+PROFILE_FIELDS = {"_id": 0, "user_id": 1, "instruments": 1, "genres": 1, "looking_for": 1,
+                  "region": 1, "city": 1, "experience_level": 1, "is_active": 1}
+
+
+def _normalize(value: Optional[str]) -> str:
+    return (value or "").strip().lower()
+
+
+class _Vocabulary:
+    """Maps normalized terms to dense column ids"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+
+    def encode(self, values: Iterable[str]) -> List[int]:
+        result = []
+        for value in values or []:
+            term = _normalize(value)
+            if term:
+                result.append(self.ids.setdefault(term, len(self.ids)))
+        return result
+
+    def encode_one(self, value: Optional[str]) -> int:
+        term = _normalize(value)
+        return self.ids.setdefault(term, len(self.ids)) if term else -1
+
+
+class _MultiHot:
+    """Growable (rows x terms) 0/1 float32 matrix"""
+
+    def __init__(self, rows: int, columns: int = 32):
+        self.matrix = np.zeros((rows, columns), dtype=np.float32)
+
+    def grow_rows(self, rows: int):
+        grown = np.zeros((rows, self.matrix.shape[1]), dtype=np.float32)
+        grown[:self.matrix.shape[0]] = self.matrix
+        self.matrix = grown
+
+    def set_row(self, row: int, column_ids: List[int]):
+        if column_ids and max(column_ids) >= self.matrix.shape[1]:
+            columns = max(self.matrix.shape[1] * 2, max(column_ids) + 1)
+            grown = np.zeros((self.matrix.shape[0], columns), dtype=np.float32)
+            grown[:, :self.matrix.shape[1]] = self.matrix
+            self.matrix = grown
+        self.matrix[row] = 0
+        self.matrix[row, column_ids] = 1
+
+    def vector(self, column_ids: List[int]) -> np.ndarray:
+        vector = np.zeros(self.matrix.shape[1], dtype=np.float32)
+        vector[[c for c in column_ids if c < len(vector)]] = 1
+        return vector
+
+
+class MatchIndex:
+    """Array-backed snapshot of musician profiles with vectorized scoring"""
+
+    def __init__(self, capacity: int = 1024, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.instrument_terms = _Vocabulary()
+        self.genre_terms = _Vocabulary()
+        self.intent_terms = _Vocabulary()
+        self.places = _Vocabulary()
+        self.user_ids: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        self.instruments = _MultiHot(capacity)
+        self.genres = _MultiHot(capacity)
+        self.intents = _MultiHot(capacity)
+        self.region = np.full(capacity, -1, dtype=np.int32)
+        self.city = np.full(capacity, -1, dtype=np.int32)
+        self.experience = np.ones(capacity, dtype=np.float32)
+        self.active = np.zeros(capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return int(self.active.sum())
+
+    def _grow(self):
+        capacity = len(self.active) * 2
+        for multi_hot in (self.instruments, self.genres, self.intents):
+            multi_hot.grow_rows(capacity)
+        self.region = np.concatenate([self.region, np.full(capacity - len(self.region), -1, dtype=np.int32)])
+        self.city = np.concatenate([self.city, np.full(capacity - len(self.city), -1, dtype=np.int32)])
+        self.experience = np.concatenate([self.experience, np.ones(capacity - len(self.experience), dtype=np.float32)])
+        self.active = np.concatenate([self.active, np.zeros(capacity - len(self.active), dtype=bool)])
+
+    def upsert(self, profile: Dict):
+        """Add or refresh one profile (a musician_profiles document)"""
+        user_id = profile["user_id"]
+        row = self.row_of.get(user_id)
+        if row is None:
+            if len(self.user_ids) == len(self.active):
+                self._grow()
+            row = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.row_of[user_id] = row
+
+        self.instruments.set_row(row, self.instrument_terms.encode(profile.get("instruments")))
+        self.genres.set_row(row, self.genre_terms.encode(profile.get("genres")))
+        self.intents.set_row(row, self.intent_terms.encode(profile.get("looking_for")))
+        self.region[row] = self.places.encode_one(profile.get("region"))
+        self.city[row] = self.places.encode_one(profile.get("city"))
+        self.experience[row] = EXPERIENCE_LEVELS.get(_normalize(profile.get("experience_level")), 1)
+        self.active[row] = profile.get("is_active", True)
+
+    def remove(self, user_id: str):
+        row = self.row_of.get(user_id)
+        if row is not None:
+            self.active[row] = False
+
+    def rank(self, user_id: str, limit: int, skip: int = 0) -> List[Tuple[str, float, Dict[str, float]]]:
+        """Best matches for an indexed user: (user_id, score, per-criterion scores)"""
+        me = self.row_of[user_id]
+        n = len(self.user_ids)
+
+        instruments = self.instruments.matrix[:n]
+        my_instruments = instruments[me]
+        instrument_counts = instruments.sum(axis=1)
+        # Share of the candidate's instruments the user does not play
+        complementary = (instruments @ (1 - my_instruments)) / np.maximum(instrument_counts, 1)
+
+        genres = self.genres.matrix[:n]
+        my_genres = genres[me]
+        shared = genres @ my_genres
+        genre_union = genres.sum(axis=1) + my_genres.sum() - shared
+        genre_score = shared / np.maximum(genre_union, 1)
+
+        intents = self.intents.matrix[:n]
+        my_intents = intents[me]
+        intent_score = (intents @ my_intents) / max(my_intents.sum(), 1)
+
+        city, region = self.city[:n], self.region[:n]
+        same_city = (city == city[me]) & (city[me] >= 0)
+        same_region = (region == region[me]) & (region[me] >= 0)
+        proximity = np.where(same_city, 1.0, np.where(same_region, 0.6, 0.0)).astype(np.float32)
+
+        experience = 1 - np.abs(self.experience[:n] - self.experience[me]) / 3
+
+        criteria = {
+            "instruments": complementary,
+            "genres": genre_score,
+            "looking_for": intent_score,
+            "proximity": proximity,
+            "experience": experience
+        }
+        scores = sum(self.weights[name] * values for name, values in criteria.items())
+        scores = np.where(self.active[:n], scores, -np.inf)
+        scores[me] = -np.inf
+
+        wanted = min(skip + limit, int(np.isfinite(scores).sum()))
+        if wanted <= skip:
+            return []
+        # Every candidate scoring at least the wanted-th best score, so ties at
+        # the cut are all kept; ties are ordered by user id for stable pages
+        cutoff = -np.partition(-scores, wanted - 1)[wanted - 1]
+        top = np.flatnonzero(scores >= cutoff)
+        user_ids = np.array([self.user_ids[row] for row in top])
+        top = top[np.lexsort((user_ids, -scores[top]))][skip:wanted]
+        return [
+            (
+                self.user_ids[row],
+                round(float(scores[row]), 4),
+                {name: round(float(values[row]), 3) for name, values in criteria.items()}
+            )
+            for row in top
+        ]
+
+
+class MatchmakingService:
+    """Holds the live MatchIndex and keeps it in step with MongoDB"""
+
+    def __init__(self, db):
+        self.db = db
+        self.index = MatchIndex()
+
+    async def rebuild(self):
+        """Build a fresh snapshot of all active profiles and swap it in"""
+        started = time.perf_counter()
+        index = MatchIndex(weights=self.index.weights)
+        async for profile in self.db.musician_profiles.find({"is_active": True}, PROFILE_FIELDS):
+            index.upsert(profile)
+        self.index = index
+        logger.info(f"Matchmaking index rebuilt with {len(index)} profiles in {time.perf_counter() - started:.2f}s")
+
+    def upsert(self, profile: Dict):
+        self.index.upsert(profile)
+
+    async def matches(self, user_id: str, limit: int, skip: int = 0) -> Optional[List[Tuple[str, float, Dict[str, float]]]]:
+        """Ranked matches for a user, or None if the user has no active profile"""
+        if user_id not in self.index.row_of or not self.index.active[self.index.row_of[user_id]]:
+            # Profile saved on another worker since the last rebuild
+            profile = await self.db.musician_profiles.find_one({"user_id": user_id, "is_active": True}, PROFILE_FIELDS)
+            if not profile:
+                return None
+            self.index.upsert(profile)
+        return self.index.rank(user_id, limit, skip)
@@ -0,0 +1,115 @@
+"""
+In-memory subscription plan catalog and per-user entitlement snapshots.
+
+Plans change only when they are seeded or edited, so the whole catalog is
+loaded at startup and refreshed periodically. Each user's entitlements (the
+active subscription, its plan limits and the usage counters the gates compare
+against) are cached as one snapshot, so subscription gates are memory lookups.
+Snapshots are dropped on subscribe/cancel, and never outlive the end of the
+subscription period they were built from.
+"""
+
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Limits of users without an active subscription
+FREE_LIMITS = {
+    "max_uploads_per_month": 0,
+    "max_groups": 1,
+    "can_sell_music": False,
+    "can_create_events": False,
+    "priority_support": False,
+    "analytics_access": False
+}
+
+SUBSCRIPTION_FIELDS = {
+    "_id": 0, "id": 1, "plan_id": 1, "status": 1, "billing_cycle": 1, "current_period_start": 1,
+    "current_period_end": 1, "cancel_at_period_end": 1, "stripe_subscription_id": 1, "created_at": 1
+}
+
+
+class PlanCatalog:
+    """All subscription plans, keyed by id"""
+
+    def __init__(self, db):
+        self.db = db
+        self.plans: Dict[str, Dict] = {}
+
+    async def refresh(self):
+        plans = await self.db.subscription_plans.find({}, {"_id": 0}).to_list(None)
+        self.plans = {plan["id"]: plan for plan in plans}
+
+    def get(self, plan_id: str) -> Optional[Dict]:
+        return self.plans.get(plan_id)
+
+    def active_plans(self) -> List[Dict]:
+        return [plan for plan in self.plans.values() if plan.get("is_active", True)]
+
+
+def _period_end_timestamp(subscription: Optional[Dict]) -> Optional[float]:
+    end = (subscription or {}).get("current_period_end")
+    if isinstance(end, str):
+        end = datetime.fromisoformat(end)
+    if isinstance(end, datetime):
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        return end.timestamp()
+    return None
+
+
+class EntitlementCache:
+    """Per-user snapshot of the active subscription, plan limits and usage"""
+
+    def __init__(self, db, catalog: PlanCatalog, ttl_seconds: float = 60, max_entries: int = 50000):
+        self.db = db
+        self.catalog = catalog
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._snapshots: Dict[str, tuple] = {}
+
+    async def get(self, user_id: str) -> Dict:
+        entry = self._snapshots.get(user_id)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        snapshot = await self._load(user_id)
+
+        expires_at = time.time() + self.ttl_seconds
+        period_end = _period_end_timestamp(snapshot["subscription"])
+        if period_end is not None:
+            expires_at = min(expires_at, period_end)
+        if len(self._snapshots) >= self.max_entries:
+            now = time.time()
+            self._snapshots = {k: v for k, v in self._snapshots.items() if v[0] > now}
+        self._snapshots[user_id] = (expires_at, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id: str):
+        self._snapshots.pop(user_id, None)
+
+    def clear(self):
+        self._snapshots.clear()
+
+    def adjust_usage(self, user_id: str, counter: str, delta: int):
+        """Keep a cached usage counter in step after a successful write"""
+        entry = self._snapshots.get(user_id)
+        if entry:
+            usage = entry[1]["usage"]
+            usage[counter] = usage.get(counter, 0) + delta
+
+    async def _load(self, user_id: str) -> Dict:
+        subscription = await self.db.user_subscriptions.find_one(
+            {"user_id": user_id, "status": "active"}, SUBSCRIPTION_FIELDS
+        )
+        plan = self.catalog.get(subscription["plan_id"]) if subscription else None
+        limits = {key: plan.get(key, default) for key, default in FREE_LIMITS.items()} if plan else dict(FREE_LIMITS)
+        groups_created = await self.db.community_groups.count_documents({"admin_id": user_id, "is_active": True})
+        return {
+            "subscription": subscription,
+            "plan": plan,
+            "limits": limits,
+            "usage": {"groups_created": groups_created}
+        }
@@ -0,0 +1,100 @@
+"""
+Online presence for musicians.
+
+A user is online while heartbeats keep arriving within `ttl_seconds`. State
+lives in an in-memory TTL map, or in Redis keys with an expiry when several
+workers serve the API. Heartbeats never touch MongoDB.
+"""
+
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryPresenceStore:
+    """Per-process presence map: user_id -> (online until, last seen)"""
+
+    def __init__(self, ttl_seconds: int, last_seen_seconds: int, max_entries: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.last_seen_seconds = last_seen_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[str, tuple] = {}
+
+    async def touch(self, user_id: str, seen_at: str):
+        if user_id not in self._entries and len(self._entries) >= self.max_entries:
+            self._sweep()
+        self._entries[user_id] = (time.monotonic(), seen_at)
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict]:
+        now = time.monotonic()
+        result = {}
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry and now - entry[0] < self.last_seen_seconds:
+                result[user_id] = {"online": now - entry[0] < self.ttl_seconds, "last_seen": entry[1]}
+        return result
+
+    def _sweep(self):
+        now = time.monotonic()
+        self._entries = {k: v for k, v in self._entries.items() if now - v[0] < self.last_seen_seconds}
+
+
+class RedisPresenceStore:
+    """Presence shared by all workers: one expiring key per online user"""
+
+    def __init__(self, redis_client, ttl_seconds: int, last_seen_seconds: int):
+        self.redis = redis_client
+        self.ttl_seconds = ttl_seconds
+        self.last_seen_seconds = last_seen_seconds
+
+    async def touch(self, user_id: str, seen_at: str):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(f"presence:online:{user_id}", seen_at, ex=self.ttl_seconds)
+        pipe.set(f"presence:seen:{user_id}", seen_at, ex=self.last_seen_seconds)
+        await pipe.execute()
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict]:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        online = await self.redis.mget([f"presence:online:{user_id}" for user_id in user_ids])
+        seen = await self.redis.mget([f"presence:seen:{user_id}" for user_id in user_ids])
+        result = {}
+        for user_id, online_at, seen_at in zip(user_ids, online, seen):
+            if seen_at is not None:
+                seen_at = seen_at.decode() if isinstance(seen_at, bytes) else seen_at
+                result[user_id] = {"online": online_at is not None, "last_seen": seen_at}
+        return result
+
+
+class PresenceService:
+    """Heartbeat-driven online status with last-seen timestamps"""
+
+    def __init__(self, ttl_seconds: int = 60, last_seen_seconds: int = 7 * 86400):
+        self.ttl_seconds = ttl_seconds
+        self.last_seen_seconds = last_seen_seconds
+        self.store = InMemoryPresenceStore(ttl_seconds, last_seen_seconds)
+
+    def use_redis(self, redis_client):
+        self.store = RedisPresenceStore(redis_client, self.ttl_seconds, self.last_seen_seconds)
+        logger.info("Presence stored in Redis")
+
+    async def heartbeat(self, user_id: str):
+        try:
+            await self.store.touch(user_id, datetime.now(timezone.utc).isoformat())
+        except Exception as e:
+            logger.warning(f"Presence heartbeat failed for {user_id}: {e}")
+
+    async def statuses(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, Optional[object]]]:
+        """{user_id: {"online": bool, "last_seen": iso or None}} for every requested id"""
+        user_ids = list(dict.fromkeys(user_ids))
+        try:
+            known = await self.store.get_many(user_ids)
+        except Exception as e:
+            logger.warning(f"Presence lookup failed: {e}")
+            known = {}
+        offline = {"online": False, "last_seen": None}
+        return {user_id: known.get(user_id, offline) for user_id in user_ids}
@@ -0,0 +1,134 @@
+"""
+In-process publish/subscribe hub for real-time delivery.
+
+Connections subscribe to named channels (e.g. `user:<id>`, `group:<id>`) and
+receive events through a bounded per-connection queue. A connection whose
+queue fills up is flagged as overflowed so its transport can drop it; the
+client then reconnects and resumes from the last event it saw.
+
+With a Redis backplane, events published on one worker are relayed to the
+hubs of every other worker through Redis pub/sub.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def encode_event(event: Dict) -> str:
+    """Serialize an event to JSON, with datetimes as ISO strings"""
+    def default(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+    return json.dumps(event, default=default)
+
+
+class Subscription:
+    """One consumer (e.g. a WebSocket) of a set of hub channels"""
+
+    def __init__(self, channels: Iterable[str], max_queue: int):
+        self.channels: Set[str] = set(channels)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def offer(self, channel: str, event: Dict):
+        try:
+            self.queue.put_nowait((channel, event))
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class BroadcastHub:
+    """Channel-based fan-out to local subscriptions, optionally relayed via Redis"""
+
+    def __init__(self, max_queue: int = 256, redis_prefix: str = "usexplo:rt:"):
+        self.max_queue = max_queue
+        self.redis_prefix = redis_prefix
+        self.worker_id = str(uuid.uuid4())
+        self.redis = None
+        self._channels: Dict[str, Set[Subscription]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    def subscribe(self, channels: Iterable[str], max_queue: Optional[int] = None) -> Subscription:
+        subscription = Subscription(channels, max_queue or self.max_queue)
+        for channel in subscription.channels:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def add_channels(self, subscription: Subscription, channels: Iterable[str]):
+        for channel in channels:
+            subscription.channels.add(channel)
+            self._channels.setdefault(channel, set()).add(subscription)
+
+    def unsubscribe(self, subscription: Subscription):
+        for channel in subscription.channels:
+            subscribers = self._channels.get(channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[channel]
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self._channels.get(channel, ()))
+
+    async def publish(self, channel: str, event: Dict):
+        """Deliver an event to local subscribers and relay it to other workers"""
+        self._deliver(channel, event)
+        if self.redis is not None:
+            try:
+                await self.redis.publish(
+                    f"{self.redis_prefix}{channel}",
+                    encode_event({"origin": self.worker_id, "event": event})
+                )
+            except Exception as e:
+                logger.warning(f"Realtime backplane publish failed: {e}")
+
+    def _deliver(self, channel: str, event: Dict):
+        for subscription in list(self._channels.get(channel, ())):
+            subscription.offer(channel, event)
+
+    async def use_redis(self, redis_client):
+        """Relay events between workers through Redis pub/sub"""
+        self.redis = redis_client
+        pubsub = redis_client.pubsub()
+        await pubsub.psubscribe(f"{self.redis_prefix}*")
+        self._listener = asyncio.ensure_future(self._listen(pubsub))
+        logger.info("Realtime hub using Redis backplane")
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if not message:
+                    continue
+                payload = json.loads(message["data"])
+                if payload.get("origin") == self.worker_id:
+                    continue
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                self._deliver(channel[len(self.redis_prefix):], payload["event"])
+            except asyncio.CancelledError:
+                await pubsub.close()
+                raise
+            except Exception as e:
+                logger.warning(f"Realtime backplane receive failed: {e}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
@@ -1,18 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Depends, UploadFile, File, Form, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Depends, UploadFile, File, Form, Header, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import asyncio
+import functools
+import hashlib
+import hmac
+import json
 import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import time
 import jwt
+import stripe
 from passlib.context import CryptContext
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -26,6 +37,19 @@ from translation_service import (
     LanguageDetectionRequest,
     LanguageDetectionResponse
 )
+from author_loader import AuthorLoader, AuthorSnapshotCache
+from timeline_service import TimelineService
+from realtime import BroadcastHub, encode_event
+from job_scheduler import JobLeases, PeriodicJobs
+from group_chat_store import GroupChatStore
+from matchmaking import MatchmakingService
+from presence import PresenceService
+from plan_catalog import PlanCatalog, EntitlementCache
+from analytics import AnalyticsService
+from webhook_inbox import WebhookInbox
+from stats_snapshot import StatsSnapshot
+from campaign_ranking import BUCKET_TTL_SECONDS, CampaignRanking
+from donation_ticker import DonationTicker, GLOBAL_CHANNEL, campaign_channel, sse_message
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -57,8 +81,43 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 AUDIO_DIR.mkdir(exist_ok=True)
 IMAGES_DIR.mkdir(exist_ok=True)
 
-# Mount static files for serving uploaded content
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+# Mount static files for serving uploaded content. Only images are public:
+# full audio files are served through signed, expiring URLs (previews stay public)
+app.mount("/uploads/images", StaticFiles(directory=str(IMAGES_DIR)), name="uploads_images")
+
+MEDIA_URL_TTL = 300
+MEDIA_SIGNING_KEY = os.environ.get('MEDIA_SIGNING_KEY', SECRET_KEY).encode()
+PUBLIC_AUDIO_PREFIX = "preview_"
+
+def media_signature(path: str, expires: int) -> str:
+    return hmac.new(MEDIA_SIGNING_KEY, f"{path}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+def is_protected_audio(url: Optional[str]) -> bool:
+    """Uploaded full tracks are protected; previews and external URLs are public"""
+    return bool(url) and url.startswith("/uploads/audio/") and not url.rsplit("/", 1)[-1].startswith(PUBLIC_AUDIO_PREFIX)
+
+def signed_media_url(url: str, ttl: int = MEDIA_URL_TTL) -> str:
+    """Short-lived URL for a protected uploaded audio file; other URLs are returned unchanged"""
+    if not is_protected_audio(url):
+        return url
+    expires = int(time.time()) + ttl
+    return f"{url}?expires={expires}&signature={media_signature(url, expires)}"
+
+@app.get("/uploads/audio/{filename}")
+async def serve_audio_file(filename: str, expires: Optional[int] = None, signature: Optional[str] = None):
+    """Serve an uploaded audio file; full tracks need a valid signature (no database access)"""
+    path = f"/uploads/audio/{filename}"
+    if not filename.startswith(PUBLIC_AUDIO_PREFIX):
+        if (
+            expires is None or not signature or expires < time.time()
+            or not hmac.compare_digest(signature, media_signature(path, expires))
+        ):
+            raise HTTPException(status_code=403, detail="Invalid or expired download link")
+    
+    file_path = AUDIO_DIR / filename
+    if file_path.resolve().parent != AUDIO_DIR.resolve() or not file_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(file_path)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -140,6 +199,7 @@ class PostLike(BaseModel):
 
 class MusicianMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    conversation_id: Optional[str] = None
     sender_id: str
     recipient_id: str
     subject: Optional[str] = None
@@ -183,6 +243,7 @@ class SubscriptionPlan(BaseModel):
     features: List[str] = []
     max_uploads_per_month: int = 5
     max_groups: int = 3
+    commission_rate: float = 0.15  # marketplace commission on the member's sales
     can_sell_music: bool = False
     can_create_events: bool = False
     priority_support: bool = False
@@ -199,6 +260,7 @@ class UserSubscription(BaseModel):
     billing_cycle: str = "monthly"  # monthly, yearly
     current_period_start: datetime
     current_period_end: datetime
+    cancel_at_period_end: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -213,8 +275,12 @@ class MusicListing(BaseModel):
     license_terms: Optional[str] = None  # commercial, non-commercial, etc.
     royalty_percentage: float = 0.0  # for ongoing royalties
     is_exclusive: bool = False
-    status: str = "active"  # active, sold, suspended
+    status: str = "active"  # active, reserved, sold, suspended
+    reserved_by_sale: Optional[str] = None  # sale holding an exclusive listing during checkout
+    reserved_until: Optional[datetime] = None
     commission_rate: float = 0.15  # US EXPLO commission (15%)
+    track: Optional[Dict] = None  # copy of the track fields shown in listings
+    seller: Optional[Dict] = None  # copy of the seller's username and stage_name
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -225,10 +291,29 @@ class MusicSale(BaseModel):
     seller_id: str
     sale_type: str  # purchase, license
     amount: float
+    commission_rate: float  # seller's plan rate at the time of the sale
     commission_amount: float
     seller_earnings: float
     stripe_payment_intent_id: Optional[str] = None
-    status: str = "pending"  # pending, completed, refunded
+    stripe_session_id: Optional[str] = None
+    status: str = "pending"  # pending, completed, settling, settled, refunded
+    completed_at: Optional[datetime] = None
+    settlement_id: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class PayoutLedgerEntry(BaseModel):
+    id: str  # settlement_id:seller_id
+    settlement_id: str
+    seller_id: str
+    plan_name: Optional[str] = None
+    sales_count: int
+    gross_amount: float
+    commission_rate: float
+    commission_amount: float
+    net_amount: float
+    period_start: datetime
+    period_end: datetime
+    status: str = "pending"  # pending, paid
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Community Groups Models
@@ -239,6 +324,7 @@ class CommunityGroup(BaseModel):
     group_type: str = "public"  # public, private, family, friends
     admin_id: str  # creator/admin user_id
     max_members: int = 50
+    member_count: int = 1  # active members, kept in step with group_members
     tags: List[str] = []
     group_image: Optional[str] = None
     is_active: bool = True
@@ -346,6 +432,7 @@ class MusicianCampaign(BaseModel):
     project_type: str = "album"  # album, concert, equipment, studio, emergency
     goal_amount: float
     current_amount: float = 0.0
+    donors_count: int = 0
     currency: str = "EUR"
     deadline: datetime
     story: str
@@ -356,7 +443,8 @@ class MusicianCampaign(BaseModel):
     featured: bool = False
     image_url: Optional[str] = None
     video_url: Optional[str] = None
-    updates: List[Dict] = []
+    latest_update: Optional[Dict] = None  # Preview of the newest entry in campaign_updates
+    updates_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -372,6 +460,15 @@ class Donation(BaseModel):
     payment_status: str = "pending"  # pending, completed, failed
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class CampaignUpdate(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    campaign_id: str
+    author_id: str
+    title: str
+    content: str
+    image_url: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 class SupportAdvice(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     advisor_id: str
@@ -410,6 +507,11 @@ class CampaignCreateRequest(BaseModel):
     image_url: Optional[str] = None
     video_url: Optional[str] = None
 
+class CampaignUpdateRequest(BaseModel):
+    title: str
+    content: str
+    image_url: Optional[str] = None
+
 class DonationCreateRequest(BaseModel):
     campaign_id: str
     amount: float
@@ -464,6 +566,10 @@ class MusicListingCreate(BaseModel):
     royalty_percentage: float = 0.0
     is_exclusive: bool = False
 
+class MarketplacePurchaseRequest(BaseModel):
+    host_url: str
+    sale_type: str = "purchase"  # purchase, license
+
 class GroupCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -494,7 +600,7 @@ class Track(BaseModel):
     duration: int  # in seconds
     bpm: Optional[int] = None
     mood: Optional[str] = None
-    audio_url: str
+    audio_url: Optional[str] = None  # None in public responses for uploaded tracks
     preview_url: Optional[str] = None  # 30-second preview
     artwork_url: str
     price: float
@@ -543,11 +649,14 @@ class PaymentTransaction(BaseModel):
     user_id: Optional[str] = None
     user_email: Optional[str] = None
     track_ids: List[str]
+    track_prices: Optional[Dict[str, float]] = None  # price of each track at checkout
     amount: float
     currency: str = "eur"
     payment_status: str = "pending"  # pending, completed, failed, cancelled
     stripe_status: str = "initiated"
     metadata: Optional[Dict] = {}
+    checkout_url: Optional[str] = None
+    idempotency_key: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -633,10 +742,17 @@ def prepare_from_mongo(item):
                 item[key] = [prepare_from_mongo(v) if isinstance(v, dict) else v for v in value]
     return item
 
+def public_track(track: Dict) -> Dict:
+    """Track document as served publicly: a protected audio file is only reachable
+    through GET /tracks/{id}/download, so its unsigned URL is left out"""
+    if is_protected_audio(track.get("audio_url")):
+        track["audio_url"] = None
+    return track
+
 def serialize_track(track):
     """Serialize track data for API response"""
     if isinstance(track, dict):
-        return prepare_from_mongo(track)
+        return prepare_from_mongo(public_track(track))
     else:
         return track.dict() if hasattr(track, 'dict') else track
 
@@ -678,7 +794,7 @@ async def get_current_user_optional(authorization: str = Header(None)) -> Option
         user_id: str = payload.get("sub")
         if user_id is None:
             return None
-    except jwt.JWTError:
+    except jwt.PyJWTError:
         return None
     
     user = await db.users.find_one({"id": user_id})
@@ -687,6 +803,81 @@ async def get_current_user_optional(authorization: str = Header(None)) -> Option
     
     return User(**parse_from_mongo(user))
 
+# Long-lived Stripe checkout clients, one per webhook URL
+stripe_clients: Dict[str, StripeCheckout] = {}
+MAX_STRIPE_CLIENTS = 32
+
+def get_stripe_checkout(webhook_url: str = "") -> StripeCheckout:
+    """Shared StripeCheckout client for a webhook URL"""
+    stripe_checkout = stripe_clients.get(webhook_url)
+    if stripe_checkout is None:
+        if len(stripe_clients) >= MAX_STRIPE_CLIENTS:
+            # host_url comes from clients: never let the registry grow unbounded
+            stripe_clients.pop(next(iter(stripe_clients)))
+        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+        stripe_clients[webhook_url] = stripe_checkout
+    return stripe_checkout
+
+# Author snapshots (username, stage_name, profile_image) shared across requests
+author_cache = AuthorSnapshotCache(ttl_seconds=30)
+
+def get_author_loader() -> AuthorLoader:
+    """Request-scoped batch loader for post, comment and listing authors"""
+    return AuthorLoader(db, author_cache)
+
+# Follow graph and fan-out-on-write home timelines
+timeline_service = TimelineService(db)
+
+# Group chat history, stored in per-group message buckets
+group_chat = GroupChatStore(db, author_cache)
+
+# In-memory compatibility index over all active musician profiles
+matchmaking = MatchmakingService(db)
+
+# Heartbeat-driven online status, never persisted to MongoDB
+presence = PresenceService(ttl_seconds=60)
+
+# Subscription plans and per-user entitlements, served from memory
+plan_catalog = PlanCatalog(db)
+entitlements = EntitlementCache(db, plan_catalog, ttl_seconds=60)
+
+# Pre-aggregated track and seller analytics
+analytics = AnalyticsService(db)
+
+# Trending solidarity campaigns, ranked in memory from hourly donation buckets
+campaign_ranking = CampaignRanking(db)
+
+# Stripe webhook events, acknowledged on receipt and processed in the background
+webhook_inbox = WebhookInbox(db)
+
+# Background maintenance jobs (counter reconciliation, ...)
+periodic_jobs = PeriodicJobs(leases=JobLeases(db))
+
+# Real-time delivery of private and group messages over WebSockets
+realtime_hub = BroadcastHub(max_queue=256)
+
+# Live donation feed (SSE), fanned out through the realtime hub
+donation_ticker = DonationTicker(realtime_hub)
+
+def user_id_from_token(token: str) -> Optional[str]:
+    """Return the user id of a valid access token, or None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return payload.get("sub")
+
+async def create_async_redis(redis_url: str):
+    """Connect an asyncio Redis client, or return None if Redis is unreachable"""
+    try:
+        import redis.asyncio as aioredis
+        redis_client = aioredis.from_url(redis_url)
+        await redis_client.ping()
+        return redis_client
+    except Exception as e:
+        logger.warning(f"Async Redis unavailable at {redis_url}: {e}")
+        return None
+
 # Routes
 
 # Original routes
@@ -770,7 +961,7 @@ async def get_tracks(
         query["is_featured"] = featured
     
     tracks = await db.tracks.find(query).skip(offset).limit(limit).to_list(limit)
-    return [Track(**parse_from_mongo(track)) for track in tracks]
+    return [Track(**parse_from_mongo(public_track(track))) for track in tracks]
 
 @api_router.get("/tracks/{track_id}", response_model=Track)
 async def get_track(track_id: str):
@@ -778,7 +969,7 @@ async def get_track(track_id: str):
     track = await db.tracks.find_one({"id": track_id})
     if not track:
         raise HTTPException(status_code=404, detail="Track not found")
-    return Track(**parse_from_mongo(track))
+    return Track(**parse_from_mongo(public_track(track)))
 
 @api_router.post("/tracks", response_model=Track)
 async def create_track(track_data: TrackCreate):
@@ -790,25 +981,43 @@ async def create_track(track_data: TrackCreate):
 @api_router.put("/tracks/{track_id}/like")
 async def like_track(track_id: str):
     """Increment track likes"""
-    result = await db.tracks.update_one(
+    track = await db.tracks.find_one_and_update(
         {"id": track_id},
-        {"$inc": {"likes": 1}}
+        {"$inc": {"likes": 1}},
+        projection={"_id": 0, "user_id": 1}
     )
-    if result.matched_count == 0:
+    if track is None:
         raise HTTPException(status_code=404, detail="Track not found")
+    analytics.record_track(track_id, track.get("user_id"), {"likes": 1})
     return {"message": "Track liked successfully"}
 
 @api_router.put("/tracks/{track_id}/download")
 async def download_track(track_id: str):
     """Increment track downloads"""
-    result = await db.tracks.update_one(
+    track = await db.tracks.find_one_and_update(
         {"id": track_id},
-        {"$inc": {"downloads": 1}}
+        {"$inc": {"downloads": 1}},
+        projection={"_id": 0, "user_id": 1}
     )
-    if result.matched_count == 0:
+    if track is None:
         raise HTTPException(status_code=404, detail="Track not found")
+    analytics.record_track(track_id, track.get("user_id"), {"downloads": 1})
     return {"message": "Download recorded successfully"}
 
+@api_router.get("/tracks/{track_id}/download")
+async def get_track_download_url(track_id: str, current_user: User = Depends(get_current_user)):
+    """Short-lived download URL for a track the user bought (or uploaded)"""
+    track = await db.tracks.find_one({"id": track_id}, {"_id": 0, "user_id": 1, "audio_url": 1})
+    if not track:
+        raise HTTPException(status_code=404, detail="Track not found")
+    
+    if track.get("user_id") != current_user.id:
+        owned = await db.entitlements.find_one({"user_id": current_user.id, "track_id": track_id}, {"_id": 1})
+        if not owned:
+            raise HTTPException(status_code=403, detail="Purchase this track to download it")
+    
+    return {"download_url": signed_media_url(track["audio_url"]), "expires_in": MEDIA_URL_TTL}
+
 # Collection Routes
 @api_router.get("/collections", response_model=List[Collection])
 async def get_collections(featured: Optional[bool] = Query(None, description="Filter by featured status")):
@@ -837,26 +1046,70 @@ async def create_collection(collection_data: CollectionCreate):
 
 # Payment Routes
 @api_router.post("/checkout/create")
-async def create_checkout_session(request: CheckoutRequest):
-    """Create a Stripe checkout session for purchasing tracks"""
+async def create_checkout_session(
+    request: CheckoutRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Create a Stripe checkout session for purchasing tracks.
+    
+    Retries sent with the same Idempotency-Key return the session created by
+    the first request instead of opening a new one. The key is reserved for
+    IDEMPOTENCY_RESERVATION_TTL; a reservation left by a request that died
+    is taken over by the next retry.
+    """
+    reserved = False
+    reservation_id = str(uuid.uuid4())
+    reservation = {"idempotency_key": idempotency_key, "reservation_id": reservation_id, "payment_status": "reserved"}
     try:
-        # Validate tracks exist and get pricing
-        tracks = []
-        total_amount = 0.0
-        
-        for track_id in request.track_ids:
-            track = await db.tracks.find_one({"id": track_id})
-            if not track:
-                raise HTTPException(status_code=404, detail=f"Track {track_id} not found")
-            tracks.append(track)
-            total_amount += track["price"]
+        fingerprint = {"track_ids": request.track_ids, "user_email": request.user_email or ""}
+        if idempotency_key:
+            # Reserve the key first: the unique index lets exactly one request through
+            now = datetime.now(timezone.utc)
+            reserved_until = (now + IDEMPOTENCY_RESERVATION_TTL).isoformat()
+            try:
+                await db.payment_transactions.insert_one({
+                    "id": str(uuid.uuid4()),
+                    "idempotency_key": idempotency_key,
+                    "request_fingerprint": fingerprint,
+                    "payment_status": "reserved",
+                    "reservation_id": reservation_id,
+                    "reserved_until": reserved_until,
+                    "created_at": now.isoformat()
+                })
+                reserved = True
+            except DuplicateKeyError:
+                taken_over = await db.payment_transactions.find_one_and_update(
+                    {
+                        "idempotency_key": idempotency_key,
+                        "request_fingerprint": fingerprint,
+                        "payment_status": "reserved",
+                        "reserved_until": {"$lt": now.isoformat()}
+                    },
+                    {"$set": {"reservation_id": reservation_id, "reserved_until": reserved_until}},
+                    projection={"_id": 1}
+                )
+                if not taken_over:
+                    return await existing_checkout_for_key(idempotency_key, fingerprint)
+                reserved = True
+        
+        # Validate tracks exist and get pricing in one query
+        tracks = await db.tracks.find(
+            {"id": {"$in": list(set(request.track_ids))}},
+            {"_id": 0, "id": 1, "price": 1}
+        ).to_list(None)
+        prices = {track["id"]: track["price"] for track in tracks}
+        
+        missing = [track_id for track_id in request.track_ids if track_id not in prices]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Track {missing[0]} not found")
+        total_amount = sum(prices[track_id] for track_id in request.track_ids)
         
         if total_amount <= 0:
             raise HTTPException(status_code=400, detail="Invalid total amount")
         
-        # Initialize Stripe checkout
+        # Shared Stripe checkout client for this webhook URL
         webhook_url = f"{request.host_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+        stripe_checkout = get_stripe_checkout(webhook_url)
         
         # Create checkout session request
         success_url = f"{request.host_url}/success?session_id={{CHECKOUT_SESSION_ID}}"
@@ -884,110 +1137,383 @@ async def create_checkout_session(request: CheckoutRequest):
             session_id=session.session_id,
             user_email=request.user_email,
             track_ids=request.track_ids,
+            track_prices=prices,
             amount=total_amount,
             currency="eur",
             payment_status="pending",
             stripe_status="initiated",
-            metadata=metadata
+            metadata=metadata,
+            checkout_url=session.url,
+            idempotency_key=idempotency_key
         )
         
-        await db.payment_transactions.insert_one(prepare_for_mongo(transaction.dict()))
+        if reserved:
+            transaction_doc = prepare_for_mongo(transaction.dict())
+            del transaction_doc["id"]
+            finalized = await db.payment_transactions.update_one(
+                reservation,
+                {"$set": transaction_doc, "$unset": {"reservation_id": "", "reserved_until": ""}}
+            )
+            if finalized.matched_count == 0:
+                # Our reservation expired and a retry took the key over: answer with its session
+                return await existing_checkout_for_key(idempotency_key, fingerprint)
+        else:
+            await db.payment_transactions.insert_one(prepare_for_mongo(transaction.dict()))
         
         return {"checkout_url": session.url, "session_id": session.session_id}
         
+    except HTTPException:
+        if reserved:
+            await db.payment_transactions.delete_one(reservation)
+        raise
     except Exception as e:
+        if reserved:
+            # Free the key so the client can retry
+            await db.payment_transactions.delete_one(reservation)
         logger.error(f"Error creating checkout session: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create checkout session: {str(e)}")
 
+# Longest a checkout request may hold its Idempotency-Key before a retry can take it over
+IDEMPOTENCY_RESERVATION_TTL = timedelta(minutes=2)
+
+async def existing_checkout_for_key(idempotency_key: str, fingerprint: Dict) -> Dict:
+    """Answer a retried checkout request from the transaction its key created"""
+    existing = await db.payment_transactions.find_one(
+        {"idempotency_key": idempotency_key},
+        {"_id": 0, "request_fingerprint": 1, "payment_status": 1, "checkout_url": 1, "session_id": 1}
+    )
+    if not existing:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key was just abandoned, retry")
+    if existing.get("request_fingerprint") != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different checkout")
+    if existing["payment_status"] == "reserved":
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    return {"checkout_url": existing.get("checkout_url"), "session_id": existing["session_id"]}
+
+# Checkout status is served from payment_transactions, kept current by webhooks.
+# Stripe is only asked about sessions still pending after CHECKOUT_STALE_AFTER,
+# at most once per CHECKOUT_UPSTREAM_INTERVAL seconds per session.
+CHECKOUT_STALE_AFTER = timedelta(minutes=1)
+CHECKOUT_UPSTREAM_INTERVAL = 30
+CHECKOUT_STATUS_FIELDS = {
+    "_id": 0, "session_id": 1, "payment_status": 1, "amount": 1, "currency": 1, "created_at": 1, "metadata.sale_id": 1
+}
+checkout_upstream_checks: Dict[str, float] = {}
+
+def checkout_status_response(transaction: Dict) -> Dict:
+    status, payment_status = {
+        "completed": ("complete", "paid"),
+        "cancelled": ("expired", "unpaid"),
+        "failed": ("complete", "failed"),
+        "refunded": ("complete", "refunded")
+    }.get(transaction["payment_status"], ("open", "unpaid"))
+    return {
+        "status": status,
+        "payment_status": payment_status,
+        "amount_total": int(round(transaction["amount"] * 100)),  # Convert to cents
+        "currency": transaction["currency"]
+    }
+
+async def publish_checkout_status(session_id: str, payment_status: str):
+    """Wake up requests long-polling this checkout session"""
+    await realtime_hub.publish(f"checkout:{session_id}", {"type": "checkout.status", "payment_status": payment_status})
+
+async def refresh_stale_checkout(transaction: Dict) -> Dict:
+    """Ask Stripe about a session still pending long after creation (rate limited)"""
+    created_at = datetime.fromisoformat(transaction["created_at"]) if isinstance(transaction.get("created_at"), str) else transaction.get("created_at")
+    if created_at and created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    if created_at and datetime.now(timezone.utc) - created_at < CHECKOUT_STALE_AFTER:
+        return transaction
+    
+    session_id = transaction["session_id"]
+    now = time.monotonic()
+    if now - checkout_upstream_checks.get(session_id, float("-inf")) < CHECKOUT_UPSTREAM_INTERVAL:
+        return transaction
+    if len(checkout_upstream_checks) >= 10000:
+        for key, checked_at in list(checkout_upstream_checks.items()):
+            if now - checked_at >= CHECKOUT_UPSTREAM_INTERVAL:
+                del checkout_upstream_checks[key]
+    checkout_upstream_checks[session_id] = now
+    
+    try:
+        status_response: CheckoutStatusResponse = await get_stripe_checkout().get_checkout_status(session_id)
+    except Exception as e:
+        logger.warning(f"Stripe status lookup failed for {session_id}: {e}")
+        return transaction
+    
+    if status_response.payment_status == "paid":
+        completed = await complete_payment_transaction(session_id, status_response.status)
+        if completed:
+            await apply_completed_payments([completed])
+    elif status_response.status == "expired":
+        cancelled = await db.payment_transactions.update_one(
+            {"session_id": session_id, "payment_status": "pending"},
+            {
+                "$set": {
+                    "payment_status": "cancelled",
+                    "stripe_status": status_response.status,
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }
+            }
+        )
+        if cancelled.modified_count:
+            await publish_checkout_status(session_id, "cancelled")
+            sale_id = (transaction.get("metadata") or {}).get("sale_id")
+            if sale_id:
+                await release_listing_reservations({"reserved_by_sale": sale_id})
+    else:
+        return transaction
+    return await db.payment_transactions.find_one({"session_id": session_id}, CHECKOUT_STATUS_FIELDS)
+
 @api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str):
-    """Get the status of a checkout session"""
+async def get_checkout_status(
+    session_id: str,
+    wait: int = Query(0, ge=0, le=30, description="Seconds to wait for the payment status to change")
+):
+    """Get the status of a checkout session.
+    
+    With `wait`, a pending session is held until a webhook updates it or the
+    timeout expires, so the success page can long-poll instead of looping.
+    """
     try:
         # Get transaction from database
-        transaction = await db.payment_transactions.find_one({"session_id": session_id})
+        transaction = await db.payment_transactions.find_one({"session_id": session_id}, CHECKOUT_STATUS_FIELDS)
         if not transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
         
-        # Check with Stripe if not already completed
-        if transaction["payment_status"] != "completed":
-            stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
-            status_response: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-            
-            # Update transaction status
-            new_payment_status = "completed" if status_response.payment_status == "paid" else "pending"
-            if status_response.status == "expired":
-                new_payment_status = "cancelled"
-            
-            # Update only if status changed
-            if new_payment_status != transaction["payment_status"]:
-                await db.payment_transactions.update_one(
-                    {"session_id": session_id},
-                    {
-                        "$set": {
-                            "payment_status": new_payment_status,
-                            "stripe_status": status_response.status,
-                            "updated_at": datetime.now(timezone.utc).isoformat()
-                        }
-                    }
-                )
-                
-                # If payment completed, increment download counts
-                if new_payment_status == "completed":
-                    for track_id in transaction["track_ids"]:
-                        await db.tracks.update_one(
-                            {"id": track_id},
-                            {"$inc": {"downloads": 1}}
-                        )
-            
-            return {
-                "status": status_response.status,
-                "payment_status": status_response.payment_status,
-                "amount_total": status_response.amount_total,
-                "currency": status_response.currency
-            }
-        
-        return {
-            "status": "complete",
-            "payment_status": "paid",
-            "amount_total": int(transaction["amount"] * 100),  # Convert to cents
-            "currency": transaction["currency"]
-        }
+        if transaction["payment_status"] == "pending" and wait:
+            subscription = realtime_hub.subscribe([f"checkout:{session_id}"], max_queue=4)
+            try:
+                # Re-read once subscribed, so a change in between is not missed
+                transaction = await db.payment_transactions.find_one({"session_id": session_id}, CHECKOUT_STATUS_FIELDS)
+                if transaction["payment_status"] == "pending":
+                    try:
+                        await asyncio.wait_for(subscription.get(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    transaction = await db.payment_transactions.find_one({"session_id": session_id}, CHECKOUT_STATUS_FIELDS)
+            finally:
+                realtime_hub.unsubscribe(subscription)
+        
+        if transaction["payment_status"] == "pending":
+            # Webhook may have been lost: fall back to Stripe for stale sessions only
+            transaction = await refresh_stale_checkout(transaction)
+        
+        return checkout_status_response(transaction)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error checking checkout status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to check status: {str(e)}")
 
+# Fields apply_completed_payments needs from a transaction
+PAYMENT_EFFECT_FIELDS = {
+    "_id": 0, "session_id": 1, "user_id": 1, "user_email": 1, "track_ids": 1, "track_prices": 1, "amount": 1,
+    "metadata": 1, "downloads_applied_at": 1
+}
+# Recent payment sessions already counted in a track's downloads; replays happen
+# within minutes, so only the latest sessions of each track need to be kept
+TRACK_PAYMENT_SESSIONS_KEPT = 100
+
+async def complete_payment_transaction(session_id: str, stripe_status: str) -> Optional[Dict]:
+    """Move a transaction to completed; returns it only to the caller that made the transition.
+    
+    applied_at stays null until apply_completed_payments has run all side effects,
+    so a crash in between is picked up by apply_pending_payment_effects.
+    """
+    transaction = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id, "payment_status": {"$nin": ["completed", "reserved", "refunded"]}},
+        {
+            "$set": {
+                "payment_status": "completed",
+                "stripe_status": stripe_status,
+                "applied_at": None,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }
+        },
+        projection=PAYMENT_EFFECT_FIELDS,
+        return_document=ReturnDocument.AFTER
+    )
+    if transaction:
+        await publish_checkout_status(session_id, "completed")
+    return transaction
+
+async def apply_completed_payments(transactions: List[Dict]):
+    """Count downloads, sales and revenue, grant tracks and settle marketplace sales for completed payments.
+    
+    Every step is idempotent, so the whole function can be replayed for a
+    transaction: download increments are guarded by the session id kept on the
+    track, entitlements are upserts and marketplace sales only complete once.
+    Download increments of the whole batch are written with one bulk_write.
+    Marketplace sales are settled first: a refunded sale grants nothing.
+    Revenue is the amount actually paid, split across the tracks by their
+    price at checkout (evenly for transactions created before prices were kept).
+    """
+    if not transactions:
+        return
+    
+    refunded = set()
+    for transaction in transactions:
+        if (transaction.get("metadata") or {}).get("source") == "marketplace_sale":
+            if not await complete_marketplace_sale(transaction["session_id"]):
+                refunded.add(transaction["session_id"])
+    paid = [transaction for transaction in transactions if transaction["session_id"] not in refunded]
+    
+    downloads = Counter()
+    purchases = Counter()
+    revenue = Counter()
+    increments = []
+    for transaction in paid:
+        is_marketplace_sale = (transaction.get("metadata") or {}).get("source") == "marketplace_sale"
+        if transaction.get("downloads_applied_at"):
+            continue
+        for track_id, count in Counter(transaction["track_ids"]).items():
+            increments.append(UpdateOne(
+                {"id": track_id, "payment_sessions": {"$ne": transaction["session_id"]}},
+                {
+                    "$inc": {"downloads": count},
+                    "$push": {"payment_sessions": {"$each": [transaction["session_id"]], "$slice": -TRACK_PAYMENT_SESSIONS_KEPT}}
+                }
+            ))
+            downloads[track_id] += count
+            if not is_marketplace_sale:
+                purchases[track_id] += count
+        if not is_marketplace_sale:
+            prices = transaction.get("track_prices") or {}
+            weights = [prices.get(track_id, 1) for track_id in transaction["track_ids"]]
+            if sum(weights) > 0:
+                for track_id, weight in zip(transaction["track_ids"], weights):
+                    revenue[track_id] += transaction.get("amount", 0) * weight / sum(weights)
+    
+    if increments:
+        await db.tracks.bulk_write(increments, ordered=False)
+        await db.payment_transactions.update_many(
+            {"session_id": {"$in": [t["session_id"] for t in paid if not t.get("downloads_applied_at")]}},
+            {"$set": {"downloads_applied_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        # Analytics are best effort: a crash before the buffer is flushed loses these metrics,
+        # the flag above keeps a replay from counting them twice
+        tracks = await db.tracks.find(
+            {"id": {"$in": list(downloads)}},
+            {"_id": 0, "id": 1, "user_id": 1}
+        ).to_list(None)
+        for track in tracks:
+            metrics = {"downloads": downloads[track["id"]]}
+            if purchases[track["id"]]:
+                metrics.update(
+                    purchases=purchases[track["id"]],
+                    revenue=round(revenue[track["id"]], 2)
+                )
+            analytics.record_track(track["id"], track.get("user_id"), metrics)
+    
+    await grant_track_entitlements(paid)
+    
+    await db.payment_transactions.update_many(
+        {"session_id": {"$in": [transaction["session_id"] for transaction in transactions]}},
+        {"$set": {"applied_at": datetime.now(timezone.utc).isoformat()}}
+    )
+
+async def apply_pending_payment_effects(batch_size: int = 200, grace_minutes: int = 2):
+    """Replay side effects of completed payments whose processing was interrupted.
+    
+    Only transactions completed with the applied_at flag (explicitly null) are
+    considered, so payments completed before the flag existed are left alone.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=grace_minutes)).isoformat()
+    replayed = 0
+    while True:
+        transactions = await db.payment_transactions.find(
+            {"payment_status": "completed", "applied_at": {"$type": "null"}, "updated_at": {"$lt": cutoff}},
+            PAYMENT_EFFECT_FIELDS
+        ).limit(batch_size).to_list(batch_size)
+        if not transactions:
+            break
+        await apply_completed_payments(transactions)
+        replayed += len(transactions)
+        if len(transactions) < batch_size:
+            break
+    
+    if replayed:
+        logger.warning(f"Replayed side effects of {replayed} completed payments")
+
+async def grant_track_entitlements(transactions: List[Dict]):
+    """Record the purchased tracks in entitlements, one document per (user_id, track_id).
+    
+    Marks the transactions entitlements_granted, so backfill_track_entitlements
+    only ever picks up purchases that were never granted.
+    """
+    emails = [t["user_email"] for t in transactions if not t.get("user_id") and t.get("user_email")]
+    user_ids_by_email = {}
+    if emails:
+        users = await db.users.find({"email": {"$in": emails}}, {"_id": 0, "id": 1, "email": 1}).to_list(None)
+        user_ids_by_email = {user["email"]: user["id"] for user in users}
+    
+    granted_at = datetime.now(timezone.utc).isoformat()
+    grants = []
+    for transaction in transactions:
+        user_id = transaction.get("user_id") or user_ids_by_email.get(transaction.get("user_email"))
+        if not user_id:
+            continue
+        for track_id in set(transaction["track_ids"]):
+            grants.append(UpdateOne(
+                {"user_id": user_id, "track_id": track_id},
+                {"$setOnInsert": {"session_id": transaction["session_id"], "granted_at": granted_at}},
+                upsert=True
+            ))
+    if grants:
+        try:
+            await db.entitlements.bulk_write(grants, ordered=False)
+        except BulkWriteError as e:
+            # Concurrent upserts of the same grant: the other one won
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+    
+    if transactions:
+        await db.payment_transactions.update_many(
+            {"session_id": {"$in": [transaction["session_id"] for transaction in transactions]}},
+            {"$set": {"entitlements_granted": True}}
+        )
+
+COMPLETED_PAYMENT_EVENTS = {"checkout.session.completed", "payment_intent.succeeded"}
+FAILED_PAYMENT_EVENTS = {"checkout.session.async_payment_failed", "payment_intent.payment_failed"}
+
+async def process_payment_events(events: List[Dict]):
+    """Inbox handler for track and marketplace checkout events"""
+    completed = []
+    for event in events:
+        session_id = event["payload"].get("session_id")
+        if event["type"] in COMPLETED_PAYMENT_EVENTS and session_id:
+            transaction = await complete_payment_transaction(session_id, "completed")
+            if transaction:
+                completed.append(transaction)
+        elif event["type"] in FAILED_PAYMENT_EVENTS and session_id:
+            failed = await db.payment_transactions.update_one(
+                {"session_id": session_id, "payment_status": "pending"},
+                {"$set": {"payment_status": "failed", "updated_at": datetime.now(timezone.utc).isoformat()}}
+            )
+            if failed.modified_count:
+                await publish_checkout_status(session_id, "failed")
+    await apply_completed_payments(completed)
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
-    """Handle Stripe webhooks"""
+    """Handle Stripe webhooks: verify and store the event, processing happens in the background"""
     try:
         body = await request.body()
         stripe_signature = request.headers.get("Stripe-Signature")
         
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
+        stripe_checkout = get_stripe_checkout()
         webhook_response = await stripe_checkout.handle_webhook(body, stripe_signature)
         
-        if webhook_response.event_type in ["checkout.session.completed", "payment_intent.succeeded"]:
-            # Update transaction status
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {
-                    "$set": {
-                        "payment_status": "completed",
-                        "stripe_status": "completed",
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }
-                }
-            )
-            
-            # Get transaction to update download counts
-            transaction = await db.payment_transactions.find_one({"session_id": webhook_response.session_id})
-            if transaction:
-                for track_id in transaction["track_ids"]:
-                    await db.tracks.update_one(
-                        {"id": track_id},
-                        {"$inc": {"downloads": 1}}
-                    )
+        event_id = getattr(webhook_response, "event_id", None) or f"{webhook_response.event_type}:{webhook_response.session_id}"
+        await webhook_inbox.receive(
+            "stripe_payment",
+            event_id,
+            webhook_response.event_type,
+            {"session_id": webhook_response.session_id, "payment_status": webhook_response.payment_status}
+        )
         
         return {"status": "success"}
         
@@ -1031,7 +1557,7 @@ async def search_tracks(
     tracks = await db.tracks.find(query).skip(offset).limit(per_page).to_list(per_page)
     
     return SearchResult(
-        tracks=[Track(**parse_from_mongo(track)) for track in tracks],
+        tracks=[Track(**parse_from_mongo(public_track(track))) for track in tracks],
         total=total,
         page=page,
         per_page=per_page
@@ -1210,7 +1736,7 @@ async def create_track_with_files(
             user_id=current_user.id,  # Set owner
             audio_url=audio_url,
             artwork_url=image_url,
-            preview_url=preview_url or audio_url
+            preview_url=preview_url  # full audio is never public
         )
         
         await db.tracks.insert_one(prepare_for_mongo(track.dict()))
@@ -1232,6 +1758,8 @@ async def get_my_tracks(current_user: User = Depends(get_current_user)):
             {"artist": {"$regex": "fifi Ribana", "$options": "i"}}  # Legacy fifi Ribana tracks
         ]
     }).to_list(100)
+    for track in tracks:
+        track["audio_url"] = signed_media_url(track["audio_url"])
     return [Track(**parse_from_mongo(track)) for track in tracks]
 
 @api_router.delete("/admin/tracks/{track_id}")
@@ -1246,6 +1774,7 @@ async def delete_my_track(track_id: str, current_user: User = Depends(get_curren
         raise HTTPException(status_code=403, detail="Not authorized to delete this track")
     
     await db.tracks.delete_one({"id": track_id})
+    await refresh_listings_for_track(track_id)
     return {"message": "Track deleted successfully"}
 
 # ===== MUSICIAN COMMUNITY ENDPOINTS =====
@@ -1269,8 +1798,14 @@ async def create_musician_profile(
                 {"user_id": current_user.id},
                 {"$set": profile_dict}
             )
+            author_cache.invalidate(current_user.id)
             
             updated_profile = await db.musician_profiles.find_one({"user_id": current_user.id})
+            matchmaking.upsert(updated_profile)
+            await db.music_listings.update_many(
+                {"seller_id": current_user.id},
+                {"$set": {"seller.stage_name": updated_profile.get("stage_name")}}
+            )
             return MusicianProfile(**prepare_from_mongo(updated_profile))
         else:
             # Create new profile
@@ -1280,6 +1815,12 @@ async def create_musician_profile(
             )
             
             await db.musician_profiles.insert_one(prepare_for_mongo(profile.dict()))
+            author_cache.invalidate(current_user.id)
+            matchmaking.upsert(profile.dict())
+            await db.music_listings.update_many(
+                {"seller_id": current_user.id},
+                {"$set": {"seller.stage_name": profile.stage_name}}
+            )
             return profile
             
     except Exception as e:
@@ -1302,12 +1843,11 @@ async def search_musicians(
     experience_level: Optional[str] = None,
     looking_for: Optional[str] = None,
     limit: int = Query(20, le=100),
-    skip: int = Query(0, ge=0)
+    skip: int = Query(0, ge=0),
+    author_loader: AuthorLoader = Depends(get_author_loader)
 ):
     """Search musicians by criteria"""
     try:
-        pipeline = []
-        
         # Build match stage
         match_conditions = {"is_active": True}
         
@@ -1321,48 +1861,78 @@ async def search_musicians(
             match_conditions["experience_level"] = experience_level
         if looking_for:
             match_conditions["looking_for"] = {"$in": [looking_for]}
-            
-        pipeline.append({"$match": match_conditions})
-        
-        # Add user info
-        pipeline.extend([
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "user_id",
-                    "foreignField": "id",
-                    "as": "user_info"
-                }
-            },
-            {"$unwind": "$user_info"},
-            {
-                "$project": {
-                    "id": 1,
-                    "stage_name": 1,
-                    "bio": 1,
-                    "instruments": 1,
-                    "genres": 1,
-                    "experience_level": 1,
-                    "region": 1,
-                    "city": 1,
-                    "looking_for": 1,
-                    "profile_image": 1,
-                    "created_at": 1,
-                    "username": "$user_info.username"
-                }
-            },
-            {"$sort": {"created_at": -1}},
-            {"$skip": skip},
-            {"$limit": limit}
-        ])
         
-        musicians = await db.musician_profiles.aggregate(pipeline).to_list(limit)
-        return [prepare_from_mongo(musician) for musician in musicians]
+        projection = {
+            "_id": 0, "id": 1, "user_id": 1, "stage_name": 1, "bio": 1, "instruments": 1,
+            "genres": 1, "experience_level": 1, "region": 1, "city": 1, "looking_for": 1,
+            "profile_image": 1, "created_at": 1
+        }
+        musicians = await db.musician_profiles.find(match_conditions, projection).sort(
+            "created_at", -1
+        ).skip(skip).limit(limit).to_list(limit)
+        
+        authors = await author_loader.load_many(musician["user_id"] for musician in musicians)
+        results = []
+        for musician in musicians:
+            author = authors.get(musician.pop("user_id"))
+            if author:
+                musician["username"] = author["username"]
+                results.append(prepare_from_mongo(musician))
+        return results
         
     except Exception as e:
         logger.error(f"Error searching musicians: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to search musicians")
 
+@api_router.get("/community/musicians/matches")
+async def get_musician_matches(
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(20, le=100),
+    skip: int = Query(0, ge=0, le=1000),
+    author_loader: AuthorLoader = Depends(get_author_loader)
+):
+    """Rank musicians by compatibility with the current user's profile.
+    
+    The score combines complementary instruments, shared genres, matching
+    looking_for intents, city/region proximity and experience level.
+    """
+    try:
+        ranked = await matchmaking.matches(current_user.id, limit, skip)
+        if ranked is None:
+            raise HTTPException(status_code=404, detail="Create a musician profile to get matches")
+        if not ranked:
+            return []
+        
+        user_ids = [user_id for user_id, _, _ in ranked]
+        projection = {
+            "_id": 0, "id": 1, "user_id": 1, "stage_name": 1, "bio": 1, "instruments": 1,
+            "genres": 1, "experience_level": 1, "region": 1, "city": 1, "looking_for": 1,
+            "profile_image": 1, "created_at": 1
+        }
+        profiles, authors = await asyncio.gather(
+            db.musician_profiles.find({"user_id": {"$in": user_ids}, "is_active": True}, projection).to_list(len(user_ids)),
+            author_loader.load_many(user_ids)
+        )
+        profiles_by_user = {profile["user_id"]: profile for profile in profiles}
+        
+        results = []
+        for user_id, score, breakdown in ranked:
+            profile, author = profiles_by_user.get(user_id), authors.get(user_id)
+            if not profile or not author:
+                continue
+            del profile["user_id"]
+            profile["username"] = author["username"]
+            profile["match_score"] = score
+            profile["score_breakdown"] = breakdown
+            results.append(prepare_from_mongo(profile))
+        return results
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting musician matches: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get musician matches")
+
 @api_router.post("/community/posts", response_model=CommunityPost)
 async def create_post(
     post_data: PostCreate,
@@ -1376,23 +1946,41 @@ async def create_post(
         )
         
         await db.community_posts.insert_one(prepare_for_mongo(post.dict()))
+        timeline_service.schedule_fan_out(current_user.id, post.id)
         return post
         
     except Exception as e:
         logger.error(f"Error creating post: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to create post")
 
+FEED_POST_PROJECTION = {
+    "_id": 0, "id": 1, "user_id": 1, "title": 1, "content": 1, "post_type": 1, "tags": 1,
+    "media_urls": 1, "likes_count": 1, "comments_count": 1, "created_at": 1
+}
+
+async def mark_liked_by_me(posts: List[Dict], user: Optional[User]):
+    """Set `liked_by_me` on a page of posts with a single $in over their ids"""
+    liked_ids = set()
+    if user and posts:
+        likes = await db.post_likes.find(
+            {"user_id": user.id, "post_id": {"$in": [post["id"] for post in posts]}},
+            {"_id": 0, "post_id": 1}
+        ).to_list(len(posts))
+        liked_ids = {like["post_id"] for like in likes}
+    for post in posts:
+        post["liked_by_me"] = post["id"] in liked_ids
+
 @api_router.get("/community/posts")
 async def get_community_feed(
     post_type: Optional[str] = None,
     tag: Optional[str] = None,
     limit: int = Query(20, le=100),
-    skip: int = Query(0, ge=0)
+    skip: int = Query(0, ge=0),
+    author_loader: AuthorLoader = Depends(get_author_loader),
+    current_user: Optional[User] = Depends(get_current_user_optional)
 ):
     """Get community feed posts"""
     try:
-        pipeline = []
-        
         # Build match stage
         match_conditions = {"is_active": True}
         
@@ -1400,91 +1988,143 @@ async def get_community_feed(
             match_conditions["post_type"] = post_type
         if tag:
             match_conditions["tags"] = {"$in": [tag]}
-            
-        pipeline.append({"$match": match_conditions})
         
-        # Add user info
-        pipeline.extend([
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "user_id",
-                    "foreignField": "id",
-                    "as": "user_info"
-                }
-            },
-            {"$unwind": "$user_info"},
-            {
-                "$lookup": {
-                    "from": "musician_profiles",
-                    "localField": "user_id",
-                    "foreignField": "user_id",
-                    "as": "musician_info"
-                }
-            },
-            {
-                "$project": {
-                    "id": 1,
-                    "title": 1,
-                    "content": 1,
-                    "post_type": 1,
-                    "tags": 1,
-                    "media_urls": 1,
-                    "likes_count": 1,
-                    "comments_count": 1,
-                    "created_at": 1,
-                    "author": {
-                        "username": "$user_info.username",
-                        "stage_name": {"$arrayElemAt": ["$musician_info.stage_name", 0]},
-                        "profile_image": {"$arrayElemAt": ["$musician_info.profile_image", 0]}
-                    }
-                }
-            },
-            {"$sort": {"created_at": -1}},
-            {"$skip": skip},
-            {"$limit": limit}
-        ])
+        # Paginate on the (is_active, post_type, created_at) index, then
+        # resolve the authors of this page in one batch
+        posts = await db.community_posts.find(match_conditions, FEED_POST_PROJECTION).sort(
+            "created_at", -1
+        ).skip(skip).limit(limit).to_list(limit)
         
-        posts = await db.community_posts.aggregate(pipeline).to_list(limit)
+        posts = await author_loader.attach(posts, "user_id", "author")
+        await mark_liked_by_me(posts, current_user)
+        for post in posts:
+            del post["user_id"]
         return [prepare_from_mongo(post) for post in posts]
         
     except Exception as e:
         logger.error(f"Error getting community feed: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get community feed")
 
+@api_router.get("/community/timeline")
+async def get_home_timeline(
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(20, le=100),
+    skip: int = Query(0, ge=0),
+    author_loader: AuthorLoader = Depends(get_author_loader)
+):
+    """Get the current user's home timeline (posts from followed musicians)"""
+    try:
+        posts = await timeline_service.read(current_user.id, skip, limit, FEED_POST_PROJECTION)
+        posts = await author_loader.attach(posts, "user_id", "author")
+        await mark_liked_by_me(posts, current_user)
+        for post in posts:
+            del post["user_id"]
+        return [prepare_from_mongo(post) for post in posts]
+        
+    except Exception as e:
+        logger.error(f"Error getting home timeline: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get home timeline")
+
+@api_router.post("/community/follow/{user_id}")
+async def follow_user(
+    user_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Follow a user or musician"""
+    try:
+        if user_id == current_user.id:
+            raise HTTPException(status_code=400, detail="You cannot follow yourself")
+        
+        followee = await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1})
+        if not followee:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        created = await timeline_service.follow(current_user.id, user_id)
+        message = "Now following user" if created else "Already following user"
+        return {"message": message, "following": True}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error following user: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to follow user")
+
+@api_router.delete("/community/follow/{user_id}")
+async def unfollow_user(
+    user_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Stop following a user or musician"""
+    try:
+        removed = await timeline_service.unfollow(current_user.id, user_id)
+        message = "User unfollowed" if removed else "Not following user"
+        return {"message": message, "following": False}
+        
+    except Exception as e:
+        logger.error(f"Error unfollowing user: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to unfollow user")
+
+@api_router.get("/community/following")
+async def get_following(
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(50, le=100),
+    skip: int = Query(0, ge=0),
+    author_loader: AuthorLoader = Depends(get_author_loader)
+):
+    """Get the users and musicians the current user follows"""
+    try:
+        edges = await db.follows.find(
+            {"follower_id": current_user.id},
+            {"_id": 0, "followee_id": 1, "created_at": 1}
+        ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+        
+        edges = await author_loader.attach(edges, "followee_id", "user", fields=("id", "username", "stage_name", "profile_image"))
+        return [{"user": edge["user"], "followed_at": edge["created_at"]} for edge in edges]
+        
+    except Exception as e:
+        logger.error(f"Error getting followed users: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get followed users")
+
 @api_router.post("/community/posts/{post_id}/like")
 async def like_post(
     post_id: str,
+    liked: Optional[bool] = Query(None, description="Desired state; toggles when omitted"),
     current_user: User = Depends(get_current_user)
 ):
     """Like or unlike a post"""
     try:
-        # Check if already liked
-        existing_like = await db.post_likes.find_one({
-            "post_id": post_id,
-            "user_id": current_user.id
-        })
+        like_filter = {"post_id": post_id, "user_id": current_user.id}
+        
+        if liked is not False:
+            # The unique (post_id, user_id) index lets exactly one of any
+            # number of racing upserts insert the like
+            like = PostLike(post_id=post_id, user_id=current_user.id)
+            try:
+                result = await db.post_likes.update_one(
+                    like_filter,
+                    {"$setOnInsert": {"id": like.id, "created_at": like.created_at.isoformat()}},
+                    upsert=True
+                )
+                inserted = result.upserted_id is not None
+            except DuplicateKeyError:
+                inserted = False
+            
+            if inserted:
+                await db.community_posts.update_one(
+                    {"id": post_id},
+                    {"$inc": {"likes_count": 1}}
+                )
+            if inserted or liked:
+                return {"message": "Post liked", "liked": True}
         
-        if existing_like:
-            # Unlike
-            await db.post_likes.delete_one({"id": existing_like["id"]})
+        # Unlike: only the request that actually removed the like decrements
+        result = await db.post_likes.delete_one(like_filter)
+        if result.deleted_count == 1:
             await db.community_posts.update_one(
-                {"id": post_id},
+                {"id": post_id, "likes_count": {"$gt": 0}},
                 {"$inc": {"likes_count": -1}}
             )
-            return {"message": "Post unliked", "liked": False}
-        else:
-            # Like
-            like = PostLike(
-                post_id=post_id,
-                user_id=current_user.id
-            )
-            await db.post_likes.insert_one(prepare_for_mongo(like.dict()))
-            await db.community_posts.update_one(
-                {"id": post_id},
-                {"$inc": {"likes_count": 1}}
-            )
-            return {"message": "Post liked", "liked": True}
+        return {"message": "Post unliked", "liked": False}
             
     except Exception as e:
         logger.error(f"Error liking post: {str(e)}")
@@ -1520,53 +2160,66 @@ async def add_comment(
 async def get_post_comments(
     post_id: str,
     limit: int = Query(50, le=100),
-    skip: int = Query(0, ge=0)
+    skip: int = Query(0, ge=0),
+    author_loader: AuthorLoader = Depends(get_author_loader)
 ):
     """Get comments for a post"""
     try:
-        pipeline = [
-            {"$match": {"post_id": post_id}},
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "user_id",
-                    "foreignField": "id",
-                    "as": "user_info"
-                }
-            },
-            {"$unwind": "$user_info"},
-            {
-                "$lookup": {
-                    "from": "musician_profiles",
-                    "localField": "user_id",
-                    "foreignField": "user_id",
-                    "as": "musician_info"
-                }
-            },
-            {
-                "$project": {
-                    "id": 1,
-                    "content": 1,
-                    "created_at": 1,
-                    "author": {
-                        "username": "$user_info.username",
-                        "stage_name": {"$arrayElemAt": ["$musician_info.stage_name", 0]},
-                        "profile_image": {"$arrayElemAt": ["$musician_info.profile_image", 0]}
-                    }
-                }
-            },
-            {"$sort": {"created_at": 1}},
-            {"$skip": skip},
-            {"$limit": limit}
-        ]
-        
-        comments = await db.post_comments.aggregate(pipeline).to_list(limit)
+        comments = await db.post_comments.find(
+            {"post_id": post_id},
+            {"_id": 0, "id": 1, "user_id": 1, "content": 1, "created_at": 1}
+        ).sort("created_at", 1).skip(skip).limit(limit).to_list(limit)
+        
+        comments = await author_loader.attach(comments, "user_id", "author")
+        for comment in comments:
+            del comment["user_id"]
         return [prepare_from_mongo(comment) for comment in comments]
         
     except Exception as e:
         logger.error(f"Error getting comments: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get comments")
 
+def conversation_id_for(user_a: str, user_b: str) -> str:
+    """Deterministic conversation id for a pair of users"""
+    first, second = sorted((user_a, user_b))
+    return f"{first}:{second}"
+
+def inbox_updates_for(message: MusicianMessage) -> List[UpdateOne]:
+    """Inbox summary updates for both participants of a new message.
+    
+    The unread counter and the inbox document are upserted unconditionally;
+    last_message only moves forward, so a slower write of an older message
+    cannot overwrite the summary of a newer one. Must be run as an ordered bulk.
+    """
+    last_message = {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "subject": message.subject,
+        "preview": message.content[:200],
+        "created_at": message.created_at.isoformat()
+    }
+    updated_at = message.created_at.isoformat()
+    updates = []
+    for user_id, other_user_id, unread in (
+        (message.sender_id, message.recipient_id, 0),
+        (message.recipient_id, message.sender_id, 1)
+    ):
+        inbox = {"user_id": user_id, "conversation_id": message.conversation_id}
+        updates.append(UpdateOne(
+            inbox,
+            {"$setOnInsert": {"other_user_id": other_user_id}, "$inc": {"unread_count": unread}},
+            upsert=True
+        ))
+        updates.append(UpdateOne(
+            {**inbox, "$or": [{"updated_at": {"$lt": updated_at}}, {"updated_at": {"$exists": False}}]},
+            {"$set": {"last_message": last_message, "updated_at": updated_at}}
+        ))
+    return updates
+
+def ensure_conversation_participant(conversation_id: str, user: User):
+    if user.id not in conversation_id.split(":"):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
 @api_router.post("/community/messages", response_model=MusicianMessage)
 async def send_message(
     message_data: MessageCreate,
@@ -1574,14 +2227,29 @@ async def send_message(
 ):
     """Send a private message to another musician"""
     try:
+        if message_data.recipient_id == current_user.id:
+            raise HTTPException(status_code=400, detail="You cannot send a message to yourself")
+        
+        recipient = await db.users.find_one({"id": message_data.recipient_id}, {"_id": 0, "id": 1})
+        if not recipient:
+            raise HTTPException(status_code=404, detail="Recipient not found")
+        
         message = MusicianMessage(
             sender_id=current_user.id,
+            conversation_id=conversation_id_for(current_user.id, message_data.recipient_id),
             **message_data.dict()
         )
         
         await db.musician_messages.insert_one(prepare_for_mongo(message.dict()))
+        await db.conversation_inboxes.bulk_write(inbox_updates_for(message))
+        
+        event = {"type": "message.new", "id": message.id, "message": message.dict()}
+        await realtime_hub.publish(f"user:{message.recipient_id}", event)
+        await realtime_hub.publish(f"user:{message.sender_id}", event)
         return message
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to send message")
@@ -1590,78 +2258,306 @@ async def send_message(
 async def get_my_messages(
     current_user: User = Depends(get_current_user),
     limit: int = Query(50, le=100),
-    skip: int = Query(0, ge=0)
+    skip: int = Query(0, ge=0),
+    author_loader: AuthorLoader = Depends(get_author_loader)
 ):
     """Get user's private messages"""
     try:
-        pipeline = [
+        messages = await db.musician_messages.find(
             {
-                "$match": {
-                    "$or": [
-                        {"sender_id": current_user.id},
-                        {"recipient_id": current_user.id}
-                    ]
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "sender_id",
-                    "foreignField": "id",
-                    "as": "sender_info"
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "recipient_id",
-                    "foreignField": "id",
-                    "as": "recipient_info"
-                }
+                "$or": [
+                    {"sender_id": current_user.id},
+                    {"recipient_id": current_user.id}
+                ]
             },
-            {"$unwind": "$sender_info"},
-            {"$unwind": "$recipient_info"},
-            {
-                "$project": {
-                    "id": 1,
-                    "subject": 1,
-                    "content": 1,
-                    "is_read": 1,
-                    "created_at": 1,
-                    "sender": {
-                        "id": "$sender_info.id",
-                        "username": "$sender_info.username"
-                    },
-                    "recipient": {
-                        "id": "$recipient_info.id",
-                        "username": "$recipient_info.username"
-                    }
-                }
-            },
-            {"$sort": {"created_at": -1}},
-            {"$skip": skip},
-            {"$limit": limit}
-        ]
+            {"_id": 0, "id": 1, "sender_id": 1, "recipient_id": 1, "subject": 1, "content": 1, "is_read": 1, "created_at": 1}
+        ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
         
-        messages = await db.musician_messages.aggregate(pipeline).to_list(limit)
+        # Resolve senders and recipients together in a single batch
+        await author_loader.load_many(
+            user_id for message in messages for user_id in (message["sender_id"], message["recipient_id"])
+        )
+        messages = await author_loader.attach(messages, "sender_id", "sender", fields=("id", "username"))
+        messages = await author_loader.attach(messages, "recipient_id", "recipient", fields=("id", "username"))
+        for message in messages:
+            del message["sender_id"], message["recipient_id"]
         return [prepare_from_mongo(message) for message in messages]
         
     except Exception as e:
         logger.error(f"Error getting messages: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get messages")
 
+@api_router.get("/community/conversations")
+async def get_conversations(
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(20, le=100),
+    before: Optional[str] = Query(None, description="updated_at of the last conversation of the previous page"),
+    author_loader: AuthorLoader = Depends(get_author_loader)
+):
+    """Get the current user's inbox, most recently active conversations first"""
+    try:
+        query = {"user_id": current_user.id}
+        if before:
+            query["updated_at"] = {"$lt": before}
+        
+        conversations = await db.conversation_inboxes.find(
+            query,
+            {"_id": 0, "user_id": 0}
+        ).sort("updated_at", -1).limit(limit).to_list(limit)
+        
+        conversations = await author_loader.attach(
+            conversations, "other_user_id", "other_user",
+            fields=("id", "username", "stage_name", "profile_image")
+        )
+        return [prepare_from_mongo(conversation) for conversation in conversations]
+        
+    except Exception as e:
+        logger.error(f"Error getting conversations: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get conversations")
+
+@api_router.get("/community/conversations/{conversation_id}/messages")
+async def get_conversation_messages(
+    conversation_id: str,
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(50, le=100),
+    before: Optional[str] = Query(None, description="created_at of the oldest message already loaded")
+):
+    """Get a page of a conversation thread, newest messages first"""
+    ensure_conversation_participant(conversation_id, current_user)
+    try:
+        query = {"conversation_id": conversation_id}
+        if before:
+            query["created_at"] = {"$lt": before}
+        
+        messages = await db.musician_messages.find(
+            query,
+            {"_id": 0}
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+        return [prepare_from_mongo(message) for message in messages]
+        
+    except Exception as e:
+        logger.error(f"Error getting conversation messages: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get conversation messages")
+
+@api_router.post("/community/conversations/{conversation_id}/read")
+async def mark_conversation_read(
+    conversation_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Mark every message received in a conversation as read"""
+    ensure_conversation_participant(conversation_id, current_user)
+    try:
+        await db.conversation_inboxes.update_one(
+            {"user_id": current_user.id, "conversation_id": conversation_id},
+            {"$set": {"unread_count": 0}}
+        )
+        await db.musician_messages.update_many(
+            {"conversation_id": conversation_id, "recipient_id": current_user.id, "is_read": False},
+            {"$set": {"is_read": True}}
+        )
+        return {"message": "Conversation marked as read"}
+        
+    except Exception as e:
+        logger.error(f"Error marking conversation read: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to mark conversation as read")
+
+# ===== PRESENCE =====
+
+@api_router.post("/community/presence/heartbeat")
+async def presence_heartbeat(current_user: User = Depends(get_current_user)):
+    """Mark the current user online; clients call this about every 30 seconds"""
+    await presence.heartbeat(current_user.id)
+    return {"online": True, "ttl_seconds": presence.ttl_seconds}
+
+@api_router.get("/community/presence")
+async def get_presence(
+    user_ids: str = Query(..., description="Comma separated user ids"),
+    current_user: User = Depends(get_current_user)
+):
+    """Get the online status and last-seen time of up to 200 users"""
+    ids = [user_id.strip() for user_id in user_ids.split(",") if user_id.strip()]
+    if len(ids) > 200:
+        raise HTTPException(status_code=400, detail="At most 200 user ids per request")
+    return await presence.statuses(ids)
+
+# ===== REAL-TIME DELIVERY =====
+
+async def realtime_backlog(user_id: str, group_ids: List[str], last_message_id: str, limit: int = 200) -> List[Dict]:
+    """Message events created after `last_message_id`, oldest first"""
+    anchor = await db.musician_messages.find_one({"id": last_message_id}, {"_id": 0, "created_at": 1})
+    since = anchor["created_at"] if anchor else await group_chat.find_created_at(last_message_id)
+    if not since:
+        return [{"type": "resync"}]
+    
+    direct_messages, group_messages = await asyncio.gather(
+        db.musician_messages.find(
+            {"$or": [{"sender_id": user_id}, {"recipient_id": user_id}], "created_at": {"$gt": since}},
+            {"_id": 0}
+        ).sort("created_at", 1).limit(limit).to_list(limit),
+        group_chat.since(group_ids, since, limit)
+    )
+    
+    events = [
+        {"type": "message.new", "id": message["id"], "message": message}
+        for message in direct_messages
+    ] + [
+        {"type": "group_message.new", "id": message["id"], "group_id": group_id, "message": message}
+        for group_id, message in group_messages
+    ]
+    events.sort(key=lambda event: str(event["message"]["created_at"]))
+    if len(direct_messages) == limit or len(group_messages) == limit:
+        # Too far behind to replay: the client reloads its views over HTTP instead
+        return events[:limit] + [{"type": "resync"}]
+    return events
+
+@api_router.websocket("/ws")
+async def realtime_socket(
+    websocket: WebSocket,
+    token: str = Query(...),
+    last_message_id: Optional[str] = Query(None)
+):
+    """Push new private and group messages to the authenticated user.
+    
+    Reconnecting clients pass the id of the last message they received as
+    `last_message_id` to get the messages they missed first.
+    """
+    user_id = user_id_from_token(token)
+    if not user_id or not await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1}):
+        await websocket.close(code=4401)
+        return
+    await websocket.accept()
+    
+    group_ids = await db.group_members.distinct("group_id", {"user_id": user_id, "is_active": True})
+    # Subscribe before reading the backlog so nothing published in between is lost
+    subscription = realtime_hub.subscribe([f"user:{user_id}"] + [f"group:{group_id}" for group_id in group_ids])
+    await presence.heartbeat(user_id)
+    replayed = set()
+    
+    async def receive():
+        while True:
+            if await websocket.receive_text() == "ping":
+                await presence.heartbeat(user_id)
+                subscription.offer("", {"type": "pong"})
+    
+    async def deliver():
+        while True:
+            _, event = await subscription.get()
+            if subscription.overflowed:
+                # Slow consumer: drop it, the client reconnects with its last message id
+                await websocket.close(code=1013)
+                return
+            if event.get("id") is not None and event["id"] in replayed:
+                continue
+            if event["type"] == "group.joined":
+                realtime_hub.add_channels(subscription, [f"group:{event['group_id']}"])
+            await websocket.send_text(encode_event(event))
+    
+    try:
+        if last_message_id:
+            for event in await realtime_backlog(user_id, group_ids, last_message_id):
+                replayed.add(event.get("id"))
+                await websocket.send_text(encode_event(event))
+        
+        tasks = [asyncio.ensure_future(receive()), asyncio.ensure_future(deliver())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            error = task.exception()
+            if error and not isinstance(error, WebSocketDisconnect):
+                logger.error(f"WebSocket error for user {user_id}: {error}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        realtime_hub.unsubscribe(subscription)
+
 # ===== SUBSCRIPTION SYSTEM ENDPOINTS =====
 
 @api_router.get("/subscriptions/plans")
 async def get_subscription_plans():
     """Get all available subscription plans"""
     try:
-        plans = await db.subscription_plans.find({"is_active": True}).to_list(100)
-        return [prepare_from_mongo(plan) for plan in plans]
+        return [prepare_from_mongo(dict(plan)) for plan in plan_catalog.active_plans()]
     except Exception as e:
         logger.error(f"Error getting subscription plans: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get subscription plans")
 
+def next_period_end(start: datetime, billing_cycle: str) -> datetime:
+    """End of a billing period starting at `start` (day clamped to the month's end)"""
+    if billing_cycle == "yearly":
+        year, month = start.year + 1, start.month
+    else:
+        # Monthly billing
+        year, month = (start.year + 1, 1) if start.month == 12 else (start.year, start.month + 1)
+    days_in_month = ((datetime(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)).day)
+    return start.replace(year=year, month=month, day=min(start.day, days_in_month))
+
+async def invalidate_entitlements(user_ids: List[str]):
+    """Drop cached entitlements here and, through the hub, on every other worker"""
+    for user_id in user_ids:
+        entitlements.invalidate(user_id)
+    await realtime_hub.publish("entitlements", {"type": "entitlements.invalidate", "user_ids": user_ids})
+
+async def listen_for_entitlement_changes():
+    """Apply entitlement invalidations published by any worker"""
+    subscription = realtime_hub.subscribe(["entitlements"], max_queue=1000)
+    try:
+        while True:
+            _, event = await subscription.get()
+            if subscription.overflowed:
+                # Missed events: forget everything rather than serve stale gates
+                entitlements.clear()
+                subscription.overflowed = False
+            for user_id in event.get("user_ids", []):
+                entitlements.invalidate(user_id)
+    finally:
+        realtime_hub.unsubscribe(subscription)
+
+async def run_subscription_lifecycle(batch_size: int = 500) -> int:
+    """Renew or expire subscriptions whose period has ended.
+    
+    - cancel_at_period_end: the subscription ends (status canceled)
+    - otherwise: renewed for another billing cycle
+    Renewals are unconditional: subscriptions are not billed through Stripe,
+    so no payment failure can put one past due.
+    """
+    now = datetime.now(timezone.utc)
+    transitioned = 0
+    
+    while True:
+        due = await db.user_subscriptions.find(
+            {"status": "active", "current_period_end": {"$lte": now.isoformat()}},
+            {"_id": 0, "id": 1, "user_id": 1, "billing_cycle": 1, "current_period_end": 1,
+             "cancel_at_period_end": 1}
+        ).sort("current_period_end", 1).limit(batch_size).to_list(batch_size)
+        if not due:
+            break
+        
+        updates = []
+        for sub in due:
+            # Guard on the period end so a concurrent change wins over this transition
+            guard = {"id": sub["id"], "status": "active", "current_period_end": sub["current_period_end"]}
+            if sub.get("cancel_at_period_end"):
+                changes = {"status": "canceled", "ended_at": now.isoformat()}
+            else:
+                period_end = datetime.fromisoformat(sub["current_period_end"])
+                next_end = next_period_end(period_end, sub.get("billing_cycle", "monthly"))
+                while next_end <= now:
+                    next_end = next_period_end(next_end, sub.get("billing_cycle", "monthly"))
+                changes = {"current_period_start": period_end.isoformat(), "current_period_end": next_end.isoformat()}
+            changes["updated_at"] = now.isoformat()
+            updates.append(UpdateOne(guard, {"$set": changes}))
+        
+        result = await db.user_subscriptions.bulk_write(updates, ordered=False)
+        transitioned += result.modified_count
+        await invalidate_entitlements([sub["user_id"] for sub in due])
+        if len(due) < batch_size:
+            break
+    
+    if transitioned:
+        logger.info(f"Subscription lifecycle: {transitioned} subscriptions transitioned")
+    return transitioned
+
 @api_router.post("/subscriptions/subscribe")
 async def create_subscription(
     subscription_data: SubscriptionCreateRequest,
@@ -1670,29 +2566,21 @@ async def create_subscription(
     """Create a new subscription for user"""
     try:
         # Check if plan exists
-        plan = await db.subscription_plans.find_one({"id": subscription_data.plan_id, "is_active": True})
-        if not plan:
+        plan = plan_catalog.get(subscription_data.plan_id)
+        if not plan or not plan.get("is_active", True):
             raise HTTPException(status_code=404, detail="Subscription plan not found")
         
-        # Check if user already has an active subscription
         existing_sub = await db.user_subscriptions.find_one({
             "user_id": current_user.id,
             "status": "active"
         })
         
         if existing_sub:
-            raise HTTPException(status_code=400, detail="User already has an active subscription")
+            raise HTTPException(status_code=400, detail="User already has a subscription")
         
         # Calculate period dates
         start_date = datetime.now(timezone.utc)
-        if subscription_data.billing_cycle == "yearly":
-            end_date = start_date.replace(year=start_date.year + 1)
-        else:
-            # Monthly billing
-            if start_date.month == 12:
-                end_date = start_date.replace(year=start_date.year + 1, month=1)
-            else:
-                end_date = start_date.replace(month=start_date.month + 1)
+        end_date = next_period_end(start_date, subscription_data.billing_cycle)
         
         # Create subscription
         subscription = UserSubscription(
@@ -1704,6 +2592,7 @@ async def create_subscription(
         )
         
         await db.user_subscriptions.insert_one(prepare_for_mongo(subscription.dict()))
+        await invalidate_entitlements([current_user.id])
         return subscription
         
     except HTTPException:
@@ -1716,42 +2605,70 @@ async def create_subscription(
 async def get_user_subscription(current_user: User = Depends(get_current_user)):
     """Get current user's subscription details"""
     try:
-        pipeline = [
-            {"$match": {"user_id": current_user.id, "status": "active"}},
-            {
-                "$lookup": {
-                    "from": "subscription_plans",
-                    "localField": "plan_id",
-                    "foreignField": "id",
-                    "as": "plan_info"
-                }
-            },
-            {"$unwind": "$plan_info"},
-            {
-                "$project": {
-                    "id": 1,
-                    "status": 1,
-                    "billing_cycle": 1,
-                    "current_period_start": 1,
-                    "current_period_end": 1,
-                    "created_at": 1,
-                    "plan": "$plan_info"
-                }
-            }
-        ]
-        
-        subscription_list = await db.user_subscriptions.aggregate(pipeline).to_list(1)
-        if not subscription_list:
+        snapshot = await entitlements.get(current_user.id)
+        if not snapshot["subscription"] or not snapshot["plan"]:
             return None
         
-        return prepare_from_mongo(subscription_list[0])
+        subscription = {
+            key: value for key, value in snapshot["subscription"].items()
+            if key not in ("plan_id", "stripe_subscription_id")
+        }
+        subscription["plan"] = dict(snapshot["plan"])
+        return prepare_from_mongo(subscription)
         
     except Exception as e:
         logger.error(f"Error getting user subscription: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get user subscription")
 
+@api_router.post("/subscriptions/cancel")
+async def cancel_subscription(current_user: User = Depends(get_current_user)):
+    """Cancel the current subscription at the end of its billing period"""
+    try:
+        result = await db.user_subscriptions.find_one_and_update(
+            {"user_id": current_user.id, "status": "active"},
+            {"$set": {"cancel_at_period_end": True, "updated_at": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0, "current_period_end": 1}
+        )
+        if not result:
+            raise HTTPException(status_code=404, detail="No active subscription")
+        
+        await invalidate_entitlements([current_user.id])
+        return {
+            "message": "Subscription will be canceled at the end of the billing period",
+            "current_period_end": result["current_period_end"]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error canceling subscription: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to cancel subscription")
+
 # ===== MUSIC MARKETPLACE ENDPOINTS =====
 
+LISTING_TRACK_FIELDS = ("id", "title", "style", "region", "duration", "artwork_url", "preview_url")
+
+def listing_track_snapshot(track: Dict) -> Dict:
+    """Track fields copied onto music_listings so listing queries need no join"""
+    return {field: track.get(field) for field in LISTING_TRACK_FIELDS}
+
+def listing_seller_snapshot(author: Optional[Dict]) -> Dict:
+    return {"username": (author or {}).get("username"), "stage_name": (author or {}).get("stage_name")}
+
+async def refresh_listings_for_track(track_id: str):
+    """Re-copy a track onto its listings; listings of a deleted track are suspended"""
+    track = await db.tracks.find_one({"id": track_id}, {"_id": 0})
+    if track:
+        await db.music_listings.update_many(
+            {"track_id": track_id},
+            {"$set": {"track": listing_track_snapshot(track)}}
+        )
+    else:
+        await db.music_listings.update_many(
+            {"track_id": track_id, "status": "active"},
+            {"$set": {"status": "suspended", "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+
 @api_router.post("/marketplace/list", response_model=MusicListing)
 async def create_music_listing(
     listing_data: MusicListingCreate,
@@ -1774,28 +2691,27 @@ async def create_music_listing(
         existing_listing = await db.music_listings.find_one({
             "track_id": listing_data.track_id,
             "seller_id": current_user.id,
-            "status": "active"
+            "status": {"$in": ["active", "reserved"]}
         })
         
         if existing_listing:
             raise HTTPException(status_code=400, detail="Track is already listed in marketplace")
         
         # Check user subscription for selling privileges
-        user_subscription = await db.user_subscriptions.find_one({
-            "user_id": current_user.id,
-            "status": "active"
-        })
+        snapshot = await entitlements.get(current_user.id)
         
-        if user_subscription:
-            plan = await db.subscription_plans.find_one({"id": user_subscription["plan_id"]})
-            if not plan or not plan.get("can_sell_music", False):
+        if snapshot["subscription"]:
+            if not snapshot["limits"]["can_sell_music"]:
                 raise HTTPException(status_code=403, detail="Subscription plan does not allow selling music")
         else:
             raise HTTPException(status_code=403, detail="Active subscription required to sell music")
         
-        # Create listing
+        # Create listing with the track and seller fields the listing views show
+        seller = await AuthorLoader(db, author_cache).load(current_user.id)
         listing = MusicListing(
             seller_id=current_user.id,
+            track=listing_track_snapshot(track),
+            seller=listing_seller_snapshot(seller),
             **listing_data.dict()
         )
         
@@ -1819,108 +2735,71 @@ async def get_marketplace_listings(
 ):
     """Get marketplace listings with filters"""
     try:
-        pipeline = []
-        
         # Build match stage
-        match_conditions = {"status": "active"}
-        
-        if listing_type:
-            match_conditions["listing_type"] = {"$in": [listing_type, "both"]}
+        allowed_types = [listing_type, "both"] if listing_type else ["sale", "license", "both"]
+        match_conditions = {"status": "active", "listing_type": {"$in": allowed_types}}
         
-        pipeline.append({"$match": match_conditions})
-        
-        # Join with tracks and users
-        pipeline.extend([
-            {
-                "$lookup": {
-                    "from": "tracks",
-                    "localField": "track_id",
-                    "foreignField": "id",
-                    "as": "track_info"
-                }
-            },
-            {"$unwind": "$track_info"},
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "seller_id",
-                    "foreignField": "id",
-                    "as": "seller_info"
-                }
-            },
-            {"$unwind": "$seller_info"},
-            {
-                "$lookup": {
-                    "from": "musician_profiles",
-                    "localField": "seller_id",
-                    "foreignField": "user_id",
-                    "as": "musician_info"
-                }
-            }
-        ])
-        
-        # Add genre filter after joining with tracks
-        additional_match = {}
         if genre:
-            additional_match["track_info.style"] = {"$regex": genre, "$options": "i"}
-        if price_min or price_max:
+            match_conditions["track.style"] = {"$regex": genre, "$options": "i"}
+        
+        if price_min is not None or price_max is not None:
             price_conditions = {}
-            if price_min:
+            if price_min is not None:
                 price_conditions["$gte"] = price_min
-            if price_max:
+            if price_max is not None:
                 price_conditions["$lte"] = price_max
             
+            # One branch per price field, each a range scan on
+            # (status, listing_type, <price field>)
             price_or_conditions = []
-            if not listing_type or listing_type == "sale" or listing_type == "both":
-                price_or_conditions.append({"sale_price": price_conditions})
-            if not listing_type or listing_type == "license" or listing_type == "both":
-                price_or_conditions.append({"license_price": price_conditions})
-                
-            if price_or_conditions:
-                additional_match["$or"] = price_or_conditions
-        
-        if additional_match:
-            pipeline.append({"$match": additional_match})
-        
-        # Project final structure
-        pipeline.extend([
-            {
-                "$project": {
-                    "id": 1,
-                    "listing_type": 1,
-                    "sale_price": 1,
-                    "license_price": 1,
-                    "license_terms": 1,
-                    "royalty_percentage": 1,
-                    "is_exclusive": 1,
-                    "created_at": 1,
-                    "track": {
-                        "id": "$track_info.id",
-                        "title": "$track_info.title",
-                        "style": "$track_info.style",
-                        "region": "$track_info.region",
-                        "duration": "$track_info.duration",
-                        "artwork_url": "$track_info.artwork_url",
-                        "preview_url": "$track_info.preview_url"
-                    },
-                    "seller": {
-                        "username": "$seller_info.username",
-                        "stage_name": {"$arrayElemAt": ["$musician_info.stage_name", 0]}
-                    }
-                }
-            },
-            {"$sort": {"created_at": -1}},
-            {"$skip": skip},
-            {"$limit": limit}
-        ])
+            for price_field, field_type in (("sale_price", "sale"), ("license_price", "license")):
+                if listing_type and listing_type not in (field_type, "both"):
+                    continue
+                branch_types = [t for t in allowed_types if t in (field_type, "both")]
+                branch = dict(match_conditions, listing_type={"$in": branch_types})
+                branch[price_field] = price_conditions
+                price_or_conditions.append(branch)
+            
+            match_conditions = {"$or": price_or_conditions}
         
-        listings = await db.music_listings.aggregate(pipeline).to_list(limit)
+        listings = await db.music_listings.find(
+            match_conditions,
+            {
+                "_id": 0, "id": 1, "listing_type": 1, "sale_price": 1, "license_price": 1,
+                "license_terms": 1, "royalty_percentage": 1, "is_exclusive": 1, "created_at": 1,
+                "track": 1, "seller": 1
+            }
+        ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
         return [prepare_from_mongo(listing) for listing in listings]
         
     except Exception as e:
         logger.error(f"Error getting marketplace listings: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get marketplace listings")
 
+@api_router.get("/marketplace/listings/{listing_id}")
+async def get_marketplace_listing(listing_id: str):
+    """Get one marketplace listing (counted as a listing view)"""
+    try:
+        listing = await db.music_listings.find_one(
+            {"id": listing_id, "status": "active"},
+            {
+                "_id": 0, "id": 1, "seller_id": 1, "track_id": 1, "listing_type": 1, "sale_price": 1,
+                "license_price": 1, "license_terms": 1, "royalty_percentage": 1, "is_exclusive": 1,
+                "created_at": 1, "track": 1, "seller": 1
+            }
+        )
+        if not listing:
+            raise HTTPException(status_code=404, detail="Listing not found")
+        
+        analytics.record_track(listing.pop("track_id"), listing.pop("seller_id"), {"listing_views": 1})
+        return prepare_from_mongo(listing)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting marketplace listing: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get marketplace listing")
+
 @api_router.get("/marketplace/my-listings")
 async def get_my_listings(
     current_user: User = Depends(get_current_user),
@@ -1968,6 +2847,376 @@ async def get_my_listings(
         logger.error(f"Error getting user listings: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get user listings")
 
+# Marketplace commission by seller plan; sellers without one of these plans pay the default
+DEFAULT_COMMISSION_RATE = 0.15
+PLAN_COMMISSION_RATES = {"Pro": 0.10, "Premium": 0.05}
+
+def plan_commission_rate(plan: Optional[Dict]) -> float:
+    if not plan:
+        return DEFAULT_COMMISSION_RATE
+    return plan.get("commission_rate") or PLAN_COMMISSION_RATES.get(plan.get("name"), DEFAULT_COMMISSION_RATE)
+
+async def seller_commission_rate(seller_id: str) -> float:
+    subscription = await db.user_subscriptions.find_one(
+        {"user_id": seller_id, "status": "active"},
+        {"_id": 0, "plan_id": 1}
+    )
+    return plan_commission_rate(plan_catalog.get(subscription["plan_id"]) if subscription else None)
+
+# An exclusive listing is held for one buyer until their checkout can no longer be paid:
+# sessions are created without expires_at, so Stripe's default lifetime of 24 hours applies
+# (plus slack for a webhook of a payment made at the last moment). An expired checkout
+# seen by refresh_stale_checkout releases it earlier.
+LISTING_RESERVATION_TTL = timedelta(hours=24, minutes=15)
+
+def available_listing_filter(listing_id: str) -> Dict:
+    """Listings that can be bought: active, or reserved by a checkout that has expired"""
+    return {
+        "id": listing_id,
+        "$or": [
+            {"status": "active"},
+            {"status": "reserved", "reserved_until": {"$lt": datetime.now(timezone.utc).isoformat()}}
+        ]
+    }
+
+@api_router.post("/marketplace/listings/{listing_id}/purchase")
+async def purchase_listing(
+    listing_id: str,
+    purchase: MarketplacePurchaseRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Buy or license a marketplace listing through Stripe checkout"""
+    try:
+        listing = await db.music_listings.find_one(available_listing_filter(listing_id), {"_id": 0})
+        if not listing:
+            raise HTTPException(status_code=404, detail="Listing not found")
+        if listing["seller_id"] == current_user.id:
+            raise HTTPException(status_code=400, detail="You cannot buy your own listing")
+        
+        if purchase.sale_type == "purchase" and listing["listing_type"] in ("sale", "both"):
+            amount = listing.get("sale_price")
+        elif purchase.sale_type == "license" and listing["listing_type"] in ("license", "both"):
+            amount = listing.get("license_price")
+        else:
+            raise HTTPException(status_code=400, detail=f"Listing is not available for {purchase.sale_type}")
+        if not amount or amount <= 0:
+            raise HTTPException(status_code=400, detail="Listing has no valid price")
+        
+        # The split is fixed at the seller's plan rate; settlement totals the sales as recorded
+        commission_rate = await seller_commission_rate(listing["seller_id"])
+        commission_amount = round(amount * commission_rate, 2)
+        sale = MusicSale(
+            listing_id=listing_id,
+            buyer_id=current_user.id,
+            seller_id=listing["seller_id"],
+            sale_type=purchase.sale_type,
+            amount=amount,
+            commission_rate=commission_rate,
+            commission_amount=commission_amount,
+            seller_earnings=round(amount - commission_amount, 2)
+        )
+        
+        if listing.get("is_exclusive"):
+            reserved = await db.music_listings.update_one(
+                available_listing_filter(listing_id),
+                {
+                    "$set": {
+                        "status": "reserved",
+                        "reserved_by_sale": sale.id,
+                        "reserved_until": (datetime.now(timezone.utc) + LISTING_RESERVATION_TTL).isoformat()
+                    }
+                }
+            )
+            if reserved.modified_count == 0:
+                raise HTTPException(status_code=409, detail="Listing is being purchased by another buyer")
+        
+        stripe_checkout = get_stripe_checkout(f"{purchase.host_url}/api/webhook/stripe")
+        metadata = {
+            "source": "marketplace_sale",
+            "sale_id": sale.id,
+            "listing_id": listing_id,
+            "user_email": current_user.email
+        }
+        try:
+            session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(CheckoutSessionRequest(
+                amount=amount,
+                currency="eur",
+                success_url=f"{purchase.host_url}/success?session_id={{CHECKOUT_SESSION_ID}}",
+                cancel_url=f"{purchase.host_url}/cancel",
+                metadata=metadata
+            ))
+        except Exception:
+            await release_listing_reservations({"id": listing_id, "reserved_by_sale": sale.id})
+            raise
+        sale.stripe_session_id = session.session_id
+        
+        # The payment transaction drives the existing status polling and webhook flow
+        transaction = PaymentTransaction(
+            session_id=session.session_id,
+            user_id=current_user.id,
+            user_email=current_user.email,
+            track_ids=[listing["track_id"]],
+            amount=amount,
+            currency="eur",
+            metadata=metadata
+        )
+        await db.music_sales.insert_one(prepare_for_mongo(sale.dict()))
+        await db.payment_transactions.insert_one(prepare_for_mongo(transaction.dict()))
+        
+        return {"checkout_url": session.url, "session_id": session.session_id, "sale_id": sale.id}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error purchasing listing: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to purchase listing")
+
+async def release_listing_reservations(query: Optional[Dict] = None) -> int:
+    """Put reserved exclusive listings back on sale (by default those whose checkout has expired)"""
+    if query is None:
+        query = {"reserved_until": {"$lt": datetime.now(timezone.utc).isoformat()}}
+    result = await db.music_listings.update_many(
+        {"status": "reserved", **query},
+        {"$set": {"status": "active"}, "$unset": {"reserved_by_sale": "", "reserved_until": ""}}
+    )
+    return result.modified_count
+
+async def claim_exclusive_listing(listing_id: str, sale_id: str) -> bool:
+    """Mark an exclusive listing sold to a sale; False when the sale no longer holds it"""
+    claimed = await db.music_listings.update_one(
+        {"id": listing_id, "$or": [{"status": "reserved", "reserved_by_sale": sale_id}, {"sold_to_sale": sale_id}]},
+        {
+            "$set": {"status": "sold", "sold_to_sale": sale_id, "updated_at": datetime.now(timezone.utc).isoformat()},
+            "$unset": {"reserved_by_sale": "", "reserved_until": ""}
+        }
+    )
+    return claimed.matched_count == 1
+
+async def refund_marketplace_sale(session_id: str):
+    """Refund a checkout paid for an exclusive listing that was sold to someone else"""
+    refunded = await db.music_sales.update_one(
+        {"stripe_session_id": session_id, "status": "pending"},
+        {"$set": {"status": "refunded", "refunded_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    if refunded.modified_count == 0:
+        return
+    # Keeps the payment out of entitlement backfills and replays
+    await db.payment_transactions.update_one(
+        {"session_id": session_id},
+        {"$set": {"payment_status": "refunded", "updated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    await publish_checkout_status(session_id, "refunded")
+    try:
+        session = await run_stripe(stripe.checkout.Session.retrieve, session_id, api_key=STRIPE_API_KEY)
+        await run_stripe(
+            stripe.Refund.create,
+            payment_intent=session.payment_intent,
+            api_key=STRIPE_API_KEY,
+            idempotency_key=f"marketplace-refund:{session_id}"
+        )
+        logger.warning(f"Refunded checkout {session_id}: exclusive listing already sold")
+    except Exception as e:
+        logger.error(f"Refund of checkout {session_id} failed, refund it manually: {str(e)}")
+
+async def complete_marketplace_sale(session_id: str) -> bool:
+    """Mark the sale paid through a checkout session as completed (idempotent).
+    
+    An exclusive listing is only sold to the sale holding its reservation; a
+    payment arriving after the reservation was lost is refunded instead, and
+    False is returned so the buyer is not granted the track.
+    """
+    sale = await db.music_sales.find_one(
+        {"stripe_session_id": session_id},
+        {"_id": 0, "id": 1, "listing_id": 1, "status": 1}
+    )
+    if not sale or sale["status"] != "pending":
+        return not sale or sale["status"] != "refunded"
+    listing = await db.music_listings.find_one(
+        {"id": sale["listing_id"]}, {"_id": 0, "track_id": 1, "is_exclusive": 1}
+    )
+    if (listing or {}).get("is_exclusive") and not await claim_exclusive_listing(sale["listing_id"], sale["id"]):
+        await refund_marketplace_sale(session_id)
+        return False
+    
+    sale = await db.music_sales.find_one_and_update(
+        {"stripe_session_id": session_id, "status": "pending"},
+        {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0, "seller_id": 1, "amount": 1}
+    )
+    if sale:
+        analytics.record_track(
+            (listing or {}).get("track_id"), sale["seller_id"], {"purchases": 1, "revenue": sale["amount"]}
+        )
+    return True
+
+async def settle_marketplace_sales(settle_delay_minutes: int = 5) -> int:
+    """Settle completed marketplace sales into one payout ledger entry per seller.
+    
+    Sales are first tagged with a settlement id, then totalled per seller with
+    a single aggregation. An interrupted settlement is resumed on the next run:
+    ledger entries are keyed by settlement and seller, so none is written twice.
+    """
+    in_progress = await db.music_sales.find_one({"status": "settling"}, {"_id": 0, "settlement_id": 1})
+    if in_progress:
+        settlement_id = in_progress["settlement_id"]
+    else:
+        settlement_id = str(uuid.uuid4())
+        cutoff = (datetime.now(timezone.utc) - timedelta(minutes=settle_delay_minutes)).isoformat()
+        tagged = await db.music_sales.update_many(
+            {"status": "completed", "completed_at": {"$lt": cutoff}},
+            {"$set": {"status": "settling", "settlement_id": settlement_id}}
+        )
+        if tagged.modified_count == 0:
+            return 0
+    
+    totals = await db.music_sales.aggregate([
+        {"$match": {"settlement_id": settlement_id}},
+        {
+            "$group": {
+                "_id": "$seller_id",
+                "sales_count": {"$sum": 1},
+                "gross_amount": {"$sum": "$amount"},
+                # Sales recorded with their rate keep it; older sales get the seller's current plan rate
+                "rated_gross": {"$sum": {"$cond": [{"$gt": ["$commission_rate", None]}, "$amount", 0]}},
+                "rated_commission": {
+                    "$sum": {"$cond": [{"$gt": ["$commission_rate", None]}, "$commission_amount", 0]}
+                },
+                "rates": {"$addToSet": {"$ifNull": ["$commission_rate", None]}},
+                "period_start": {"$min": "$completed_at"},
+                "period_end": {"$max": "$completed_at"}
+            }
+        }
+    ], allowDiskUse=True).to_list(None)
+    
+    # Commission rate by each seller's current plan
+    seller_ids = [row["_id"] for row in totals]
+    subscriptions = await db.user_subscriptions.find(
+        {"user_id": {"$in": seller_ids}, "status": "active"},
+        {"_id": 0, "user_id": 1, "plan_id": 1}
+    ).to_list(None)
+    plans_by_seller = {sub["user_id"]: plan_catalog.get(sub["plan_id"]) for sub in subscriptions}
+    
+    entries = []
+    for row in totals:
+        plan = plans_by_seller.get(row["_id"])
+        plan_rate = plan_commission_rate(plan)
+        gross = round(row["gross_amount"], 2)
+        commission = round(row["rated_commission"] + (row["gross_amount"] - row["rated_gross"]) * plan_rate, 2)
+        rates = {plan_rate if rate is None else rate for rate in row["rates"]}
+        rate = rates.pop() if len(rates) == 1 else round(commission / gross, 4) if gross else plan_rate
+        entry = PayoutLedgerEntry(
+            id=f"{settlement_id}:{row['_id']}",
+            settlement_id=settlement_id,
+            seller_id=row["_id"],
+            plan_name=(plan or {}).get("name"),
+            sales_count=row["sales_count"],
+            gross_amount=gross,
+            commission_rate=rate,
+            commission_amount=commission,
+            net_amount=round(gross - commission, 2),
+            period_start=datetime.fromisoformat(row["period_start"]),
+            period_end=datetime.fromisoformat(row["period_end"])
+        )
+        entries.append(prepare_for_mongo(entry.dict()))
+    
+    if entries:
+        try:
+            await db.payout_ledger.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # Entries already written by the interrupted run
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+    
+    await db.music_sales.update_many(
+        {"settlement_id": settlement_id, "status": "settling"},
+        {"$set": {"status": "settled", "settled_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    logger.info(f"Settlement {settlement_id}: {len(entries)} sellers, {sum(r['sales_count'] for r in totals)} sales")
+    return len(entries)
+
+@api_router.get("/marketplace/payouts")
+async def get_my_payouts(
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(20, le=100),
+    skip: int = Query(0, ge=0)
+):
+    """Get the current seller's payout ledger and the balance awaiting settlement"""
+    try:
+        payouts = await db.payout_ledger.find(
+            {"seller_id": current_user.id},
+            {"_id": 0}
+        ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+        
+        unsettled = await db.music_sales.aggregate([
+            {"$match": {"seller_id": current_user.id, "status": {"$in": ["completed", "settling"]}}},
+            {"$group": {"_id": None, "sales_count": {"$sum": 1}, "gross_amount": {"$sum": "$amount"}}}
+        ]).to_list(1)
+        pending = unsettled[0] if unsettled else {"sales_count": 0, "gross_amount": 0.0}
+        pending.pop("_id", None)
+        
+        return {
+            "payouts": [prepare_from_mongo(payout) for payout in payouts],
+            "pending": pending
+        }
+        
+    except Exception as e:
+        logger.error(f"Error getting payouts: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get payouts")
+
+# ===== ANALYTICS ENDPOINTS =====
+
+def analytics_date_range(start: Optional[str], end: Optional[str]) -> tuple:
+    """Parse a from/to query range (default: the last 30 days)"""
+    try:
+        end_date = date.fromisoformat(end) if end else datetime.now(timezone.utc).date()
+        start_date = date.fromisoformat(start) if start else end_date - timedelta(days=29)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must use the YYYY-MM-DD format")
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (end_date - start_date).days > 731:
+        raise HTTPException(status_code=400, detail="Date range cannot exceed two years")
+    return start_date, end_date
+
+async def require_analytics_access(user: User):
+    snapshot = await entitlements.get(user.id)
+    if not snapshot["limits"]["analytics_access"]:
+        raise HTTPException(status_code=403, detail="Analytics require a plan with analytics access")
+
+@api_router.get("/analytics/seller")
+async def get_seller_analytics(
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    current_user: User = Depends(get_current_user)
+):
+    """Get the current seller's likes, downloads, purchases, revenue and listing views"""
+    await require_analytics_access(current_user)
+    start_date, end_date = analytics_date_range(start, end)
+    try:
+        return await analytics.query("seller", current_user.id, start_date, end_date)
+    except Exception as e:
+        logger.error(f"Error getting seller analytics: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get analytics")
+
+@api_router.get("/analytics/tracks/{track_id}")
+async def get_track_analytics(
+    track_id: str,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    current_user: User = Depends(get_current_user)
+):
+    """Get the metrics of one of the current seller's tracks"""
+    await require_analytics_access(current_user)
+    start_date, end_date = analytics_date_range(start, end)
+    track = await db.tracks.find_one({"id": track_id, "user_id": current_user.id}, {"_id": 0, "id": 1})
+    if not track:
+        raise HTTPException(status_code=404, detail="Track not found or not owned by user")
+    try:
+        return await analytics.query("track", track_id, start_date, end_date)
+    except Exception as e:
+        logger.error(f"Error getting track analytics: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get analytics")
+
 # ===== COMMUNITY GROUPS ENDPOINTS =====
 
 @api_router.post("/community/groups", response_model=CommunityGroup)
@@ -1978,34 +3227,17 @@ async def create_group(
     """Create a new community group"""
     try:
         # Check user subscription for group creation limits
-        user_subscription = await db.user_subscriptions.find_one({
-            "user_id": current_user.id,
-            "status": "active"
-        })
-        
-        if user_subscription:
-            plan = await db.subscription_plans.find_one({"id": user_subscription["plan_id"]})
-            if plan:
-                # Check how many groups user has created
-                user_groups_count = await db.community_groups.count_documents({
-                    "admin_id": current_user.id,
-                    "is_active": True
-                })
-                
-                if user_groups_count >= plan.get("max_groups", 3):
-                    raise HTTPException(
-                        status_code=403, 
-                        detail=f"Maximum group limit reached for your plan ({plan.get('max_groups', 3)} groups)"
-                    )
-        else:
+        snapshot = await entitlements.get(current_user.id)
+        max_groups = snapshot["limits"]["max_groups"]
+        
+        if snapshot["usage"]["groups_created"] >= max_groups:
+            if snapshot["subscription"]:
+                raise HTTPException(
+                    status_code=403, 
+                    detail=f"Maximum group limit reached for your plan ({max_groups} groups)"
+                )
             # Free users can create 1 group
-            user_groups_count = await db.community_groups.count_documents({
-                "admin_id": current_user.id,
-                "is_active": True
-            })
-            
-            if user_groups_count >= 1:
-                raise HTTPException(status_code=403, detail="Free users can only create 1 group. Upgrade to create more.")
+            raise HTTPException(status_code=403, detail="Free users can only create 1 group. Upgrade to create more.")
         
         # Create group
         group = CommunityGroup(
@@ -2023,6 +3255,7 @@ async def create_group(
         )
         
         await db.group_members.insert_one(prepare_for_mongo(admin_member.dict()))
+        entitlements.adjust_usage(current_user.id, "groups_created", 1)
         
         return group
         
@@ -2037,12 +3270,11 @@ async def get_groups(
     group_type: Optional[str] = None,
     search: Optional[str] = None,
     limit: int = Query(20, le=100),
-    skip: int = Query(0, ge=0)
+    skip: int = Query(0, ge=0),
+    author_loader: AuthorLoader = Depends(get_author_loader)
 ):
     """Get community groups with filters"""
     try:
-        pipeline = []
-        
         # Build match stage
         match_conditions = {"is_active": True}
         
@@ -2056,54 +3288,25 @@ async def get_groups(
                 {"tags": {"$in": [search]}}
             ]
         
-        pipeline.append({"$match": match_conditions})
-        
-        # Add admin info and member count
-        pipeline.extend([
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "admin_id",
-                    "foreignField": "id",
-                    "as": "admin_info"
-                }
-            },
-            {"$unwind": "$admin_info"},
-            {
-                "$lookup": {
-                    "from": "group_members",
-                    "localField": "id",
-                    "foreignField": "group_id",
-                    "as": "members"
-                }
-            },
-            {
-                "$addFields": {
-                    "member_count": {"$size": "$members"}
-                }
-            },
+        groups = await db.community_groups.find(
+            match_conditions,
             {
-                "$project": {
-                    "id": 1,
-                    "name": 1,
-                    "description": 1,
-                    "group_type": 1,
-                    "max_members": 1,
-                    "tags": 1,
-                    "group_image": 1,
-                    "created_at": 1,
-                    "member_count": 1,
-                    "admin": {
-                        "username": "$admin_info.username"
-                    }
-                }
-            },
-            {"$sort": {"created_at": -1}},
-            {"$skip": skip},
-            {"$limit": limit}
-        ])
-        
-        groups = await db.community_groups.aggregate(pipeline).to_list(limit)
+                "_id": 0,
+                "id": 1,
+                "name": 1,
+                "description": 1,
+                "group_type": 1,
+                "max_members": 1,
+                "tags": 1,
+                "group_image": 1,
+                "created_at": 1,
+                "member_count": 1,
+                "admin_id": 1
+            }
+        ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+        groups = await author_loader.attach(groups, "admin_id", "admin", fields=("username",))
+        for group in groups:
+            del group["admin_id"]
         return [prepare_from_mongo(group) for group in groups]
         
     except Exception as e:
@@ -2117,54 +3320,109 @@ async def join_group(
 ):
     """Join a community group"""
     try:
-        # Check if group exists
-        group = await db.community_groups.find_one({"id": group_id, "is_active": True})
-        if not group:
-            raise HTTPException(status_code=404, detail="Group not found")
-        
         # Check if already a member
         existing_member = await db.group_members.find_one({
             "group_id": group_id,
-            "user_id": current_user.id,
-            "is_active": True
-        })
+            "user_id": current_user.id
+        }, {"_id": 0, "is_active": 1})
+        
+        if existing_member and existing_member.get("is_active"):
+            return {"message": "Already a member of this group", "member": True}
         
+        # Reserve a seat: the capacity check and the increment are one atomic update
+        reserved = await db.community_groups.update_one(
+            {
+                "id": group_id,
+                "is_active": True,
+                "$expr": {"$lt": ["$member_count", "$max_members"]}
+            },
+            {"$inc": {"member_count": 1}}
+        )
+        if reserved.modified_count == 0:
+            group = await db.community_groups.find_one({"id": group_id, "is_active": True}, {"_id": 0, "id": 1})
+            if not group:
+                raise HTTPException(status_code=404, detail="Group not found")
+            raise HTTPException(status_code=400, detail="Group is full")
+        
+        # Admit the member; the unique (group_id, user_id) index settles concurrent joins
         if existing_member:
+            admitted = await db.group_members.update_one(
+                {"group_id": group_id, "user_id": current_user.id, "is_active": False},
+                {"$set": {"is_active": True, "joined_at": datetime.now(timezone.utc).isoformat()}}
+            )
+            joined = admitted.modified_count == 1
+        else:
+            member = GroupMember(
+                group_id=group_id,
+                user_id=current_user.id
+            )
+            try:
+                await db.group_members.insert_one(prepare_for_mongo(member.dict()))
+                joined = True
+            except DuplicateKeyError:
+                joined = False
+        
+        if not joined:
+            # Lost the race against another join of the same user: give the seat back
+            await db.community_groups.update_one({"id": group_id}, {"$inc": {"member_count": -1}})
             return {"message": "Already a member of this group", "member": True}
         
-        # Check if group is full
-        member_count = await db.group_members.count_documents({
+        # Open WebSocket connections of this user start receiving the group's messages
+        await realtime_hub.publish(f"user:{current_user.id}", {"type": "group.joined", "group_id": group_id})
+        
+        return {"message": "Successfully joined the group", "member": True}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error joining group: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to join group")
+
+@api_router.get("/community/groups/{group_id}/members")
+async def get_group_members(
+    group_id: str,
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(50, le=100),
+    skip: int = Query(0, ge=0),
+    author_loader: AuthorLoader = Depends(get_author_loader)
+):
+    """Get the members of a group with their online status (if user is a member)"""
+    try:
+        member = await db.group_members.find_one({
             "group_id": group_id,
+            "user_id": current_user.id,
             "is_active": True
         })
         
-        if member_count >= group["max_members"]:
-            raise HTTPException(status_code=400, detail="Group is full")
-        
-        # Add as member
-        member = GroupMember(
-            group_id=group_id,
-            user_id=current_user.id
-        )
+        if not member:
+            raise HTTPException(status_code=403, detail="You must be a member to view group members")
         
-        await db.group_members.insert_one(prepare_for_mongo(member.dict()))
+        members = await db.group_members.find(
+            {"group_id": group_id, "is_active": True},
+            {"_id": 0, "user_id": 1, "role": 1, "joined_at": 1}
+        ).sort("joined_at", 1).skip(skip).limit(limit).to_list(limit)
         
-        return {"message": "Successfully joined the group", "member": True}
+        members = await author_loader.attach(members, "user_id", "user", fields=("id", "username", "stage_name", "profile_image"))
+        statuses = await presence.statuses(member["user_id"] for member in members)
+        for member in members:
+            member["presence"] = statuses[member.pop("user_id")]
+        return [prepare_from_mongo(member) for member in members]
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error joining group: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to join group")
+        logger.error(f"Error getting group members: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get group members")
 
 @api_router.get("/community/groups/{group_id}/messages")
 async def get_group_messages(
     group_id: str,
     current_user: User = Depends(get_current_user),
     limit: int = Query(50, le=100),
+    before: Optional[str] = Query(None, description="created_at of the oldest message already loaded"),
     skip: int = Query(0, ge=0)
 ):
-    """Get messages from a group (if user is a member)"""
+    """Get messages from a group (if user is a member), newest first"""
     try:
         # Verify user is a member of the group
         member = await db.group_members.find_one({
@@ -2176,48 +3434,8 @@ async def get_group_messages(
         if not member:
             raise HTTPException(status_code=403, detail="You must be a member to view group messages")
         
-        # Get messages with sender info
-        pipeline = [
-            {"$match": {"group_id": group_id, "is_deleted": False}},
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "sender_id",
-                    "foreignField": "id",
-                    "as": "sender_info"
-                }
-            },
-            {"$unwind": "$sender_info"},
-            {
-                "$lookup": {
-                    "from": "musician_profiles",
-                    "localField": "sender_id",
-                    "foreignField": "user_id",
-                    "as": "musician_info"
-                }
-            },
-            {
-                "$project": {
-                    "id": 1,
-                    "content": 1,
-                    "message_type": 1,
-                    "media_url": 1,
-                    "reply_to_message_id": 1,
-                    "created_at": 1,
-                    "edited_at": 1,
-                    "sender": {
-                        "id": "$sender_info.id",
-                        "username": "$sender_info.username",
-                        "stage_name": {"$arrayElemAt": ["$musician_info.stage_name", 0]}
-                    }
-                }
-            },
-            {"$sort": {"created_at": -1}},
-            {"$skip": skip},
-            {"$limit": limit}
-        ]
-        
-        messages = await db.group_messages.aggregate(pipeline).to_list(limit)
+        # Messages carry their sender snapshot, so a page is one or two bucket reads
+        messages = await group_chat.page(group_id, limit, before=before, skip=skip)
         return [prepare_from_mongo(message) for message in messages]
         
     except HTTPException:
@@ -2251,7 +3469,11 @@ async def send_group_message(
             **message_data.dict()
         )
         
-        await db.group_messages.insert_one(prepare_for_mongo(message.dict()))
+        entry = await group_chat.append(group_id, prepare_for_mongo(message.dict()))
+        await realtime_hub.publish(
+            f"group:{group_id}",
+            {"type": "group_message.new", "id": message.id, "group_id": group_id, "message": entry}
+        )
         
         return {"message": "Message sent successfully", "id": message.id}
         
@@ -3062,7 +4284,7 @@ async def execute_ai_enhanced_search(interpretation: Dict, max_results: int = 20
         
         # Execute search
         tracks = await db.tracks.find(final_query).limit(max_results).to_list(max_results)
-        return [prepare_from_mongo(track) for track in tracks]
+        return [prepare_from_mongo(public_track(track)) for track in tracks]
         
     except Exception as e:
         logger.error(f"Error in AI enhanced search: {str(e)}")
@@ -3072,7 +4294,7 @@ async def execute_ai_enhanced_search(interpretation: Dict, max_results: int = 20
             {"artist": {"$regex": " ".join(interpretation.get("search_terms", [])), "$options": "i"}}
         ]}
         tracks = await db.tracks.find(simple_query).limit(max_results).to_list(max_results)
-        return [prepare_from_mongo(track) for track in tracks]
+        return [prepare_from_mongo(public_track(track)) for track in tracks]
 
 @api_router.post("/search/ai-universal")
 async def ai_universal_search(request: UniversalSearchRequest):
@@ -3191,7 +4413,7 @@ async def search_tracks(q: str = Query(...), limit: int = Query(20, le=100)):
         }
         
         tracks = await db.tracks.find(query).limit(limit).to_list(limit)
-        return [prepare_from_mongo(track) for track in tracks]
+        return [prepare_from_mongo(public_track(track)) for track in tracks]
         
     except Exception as e:
         logger.error(f"Error searching tracks: {str(e)}")
@@ -3249,12 +4471,32 @@ async def create_campaign(
         )
         
         await db.musician_campaigns.insert_one(prepare_for_mongo(campaign.dict()))
+        solidarity_stats.mark_dirty()
         return campaign
         
     except Exception as e:
         logger.error(f"Error creating campaign: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to create campaign")
 
+# Legacy campaigns may still embed their updates until migrate_campaign_updates has run
+CAMPAIGN_READ_FIELDS = {"_id": 0, "updates": 0}
+UPDATE_PREVIEW_LENGTH = 200
+
+def campaign_update_preview(update: Dict) -> Dict:
+    """Small denormalized copy of an update, stored on the campaign as latest_update"""
+    content = update.get("content") or ""
+    return {
+        "id": update["id"],
+        "title": update.get("title"),
+        "excerpt": content[:UPDATE_PREVIEW_LENGTH],
+        "created_at": update["created_at"]
+    }
+
+def campaign_progress(campaign: Dict) -> float:
+    """Share of the goal reached, in percent (capped at 100)"""
+    goal = campaign.get("goal_amount", 0)
+    return min(100, (campaign.get("current_amount", 0) / goal) * 100) if goal > 0 else 0
+
 @api_router.get("/solidarity/campaigns")
 async def get_campaigns(
     status: str = Query("active"),
@@ -3274,19 +4516,11 @@ async def get_campaigns(
         if region and region != "all":
             filter_query["region"] = region
             
-        campaigns = await db.musician_campaigns.find(filter_query).sort("created_at", -1).limit(limit).to_list(limit)
+        campaigns = await db.musician_campaigns.find(filter_query, CAMPAIGN_READ_FIELDS).sort("created_at", -1).limit(limit).to_list(limit)
         
-        # Add donation stats for each campaign
+        # Totals are maintained on the campaign by make_donation
         for campaign in campaigns:
-            donations = await db.donations.find({
-                "campaign_id": campaign["id"],
-                "payment_status": "completed"
-            }).to_list(1000)
-            
-            total_amount = sum(d.get("amount", 0) for d in donations)
-            campaign["current_amount"] = total_amount
-            campaign["donors_count"] = len(donations)
-            campaign["progress_percentage"] = min(100, (total_amount / campaign["goal_amount"]) * 100) if campaign["goal_amount"] > 0 else 0
+            campaign["progress_percentage"] = campaign_progress(campaign)
         
         return [prepare_from_mongo(campaign) for campaign in campaigns]
         
@@ -3294,27 +4528,141 @@ async def get_campaigns(
         logger.error(f"Error getting campaigns: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get campaigns")
 
+@api_router.get("/solidarity/campaigns/trending")
+async def get_trending_campaigns(
+    limit: int = Query(20, ge=1, le=50),
+    project_type: Optional[str] = Query(None),
+    region: Optional[str] = Query(None)
+):
+    """Active campaigns ranked by donation momentum, progress and deadline"""
+    return [dict(campaign) for campaign in campaign_ranking.trending(region, project_type, limit)]
+
+async def donation_event_stream(request: Request, channel: str, campaign_id: Optional[str], last_event_id: Optional[str]):
+    """SSE messages: buffered donations first, then live ones, with keep-alive comments"""
+    subscription = realtime_hub.subscribe([channel], max_queue=64)
+    try:
+        yield "retry: 3000\n\n"
+        for event in donation_ticker.backfill(campaign_id, last_event_id):
+            yield sse_message(event)
+        while not subscription.overflowed:
+            try:
+                _, event = await asyncio.wait_for(subscription.get(), timeout=15)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_message(event)
+        # On overflow the stream ends; EventSource reconnects with Last-Event-ID
+    finally:
+        realtime_hub.unsubscribe(subscription)
+
+def sse_response(stream) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/solidarity/donations/stream")
+async def stream_donations(request: Request, last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """Live feed of completed donations (campaigns and platform) over Server-Sent Events"""
+    return sse_response(donation_event_stream(request, GLOBAL_CHANNEL, None, last_event_id))
+
+@api_router.get("/solidarity/campaigns/{campaign_id}/stream")
+async def stream_campaign_donations(
+    campaign_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """Live donations and progress of one campaign over Server-Sent Events"""
+    return sse_response(donation_event_stream(request, campaign_channel(campaign_id), campaign_id, last_event_id))
+
+@api_router.post("/solidarity/campaigns/{campaign_id}/updates", response_model=CampaignUpdate)
+async def create_campaign_update(
+    campaign_id: str,
+    update_data: CampaignUpdateRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Post an update on one of the current user's campaigns"""
+    try:
+        campaign = await db.musician_campaigns.find_one({"id": campaign_id}, {"_id": 0, "creator_id": 1})
+        if not campaign:
+            raise HTTPException(status_code=404, detail="Campaign not found")
+        if campaign["creator_id"] != current_user.id:
+            raise HTTPException(status_code=403, detail="Only the campaign creator can post updates")
+        
+        update = CampaignUpdate(
+            campaign_id=campaign_id,
+            author_id=current_user.id,
+            title=update_data.title,
+            content=update_data.content,
+            image_url=update_data.image_url
+        )
+        update_doc = prepare_for_mongo(update.dict())
+        await db.campaign_updates.insert_one(update_doc)
+        
+        await db.musician_campaigns.update_one(
+            {"id": campaign_id},
+            {
+                "$set": {"latest_update": campaign_update_preview(update_doc), "updated_at": datetime.now(timezone.utc)},
+                "$inc": {"updates_count": 1}
+            }
+        )
+        return update
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating campaign update: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to create campaign update")
+
+@api_router.get("/solidarity/campaigns/{campaign_id}/updates")
+async def get_campaign_updates(
+    campaign_id: str,
+    limit: int = Query(10, ge=1, le=50),
+    before: Optional[str] = Query(None, description="created_at of the oldest update already loaded"),
+    before_id: Optional[str] = Query(None, description="id of the oldest update already loaded")
+):
+    """Get a campaign's updates, newest first.
+    
+    The cursor is the (created_at, id) pair of the oldest update loaded, so
+    updates sharing a timestamp are neither skipped nor repeated.
+    """
+    try:
+        query = {"campaign_id": campaign_id}
+        if before and before_id:
+            query["$or"] = [
+                {"created_at": {"$lt": before}},
+                {"created_at": before, "id": {"$lt": before_id}}
+            ]
+        elif before:
+            query["created_at"] = {"$lt": before}
+        
+        updates = await db.campaign_updates.find(query, {"_id": 0}).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(limit).to_list(limit)
+        return updates
+        
+    except Exception as e:
+        logger.error(f"Error getting campaign updates: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get campaign updates")
+
 @api_router.get("/solidarity/campaigns/{campaign_id}")
 async def get_campaign_details(campaign_id: str):
     """Get detailed campaign information"""
     try:
-        campaign = await db.musician_campaigns.find_one({"id": campaign_id})
+        campaign = await db.musician_campaigns.find_one({"id": campaign_id}, CAMPAIGN_READ_FIELDS)
         if not campaign:
             raise HTTPException(status_code=404, detail="Campaign not found")
         
-        # Get donations for this campaign
-        donations = await db.donations.find({
-            "campaign_id": campaign_id,
-            "payment_status": "completed"
-        }).sort("created_at", -1).to_list(100)
-        
-        # Calculate stats
-        total_amount = sum(d.get("amount", 0) for d in donations)
-        campaign["current_amount"] = total_amount
-        campaign["donors_count"] = len(donations)
-        campaign["progress_percentage"] = min(100, (total_amount / campaign["goal_amount"]) * 100) if campaign["goal_amount"] > 0 else 0
+        campaign["progress_percentage"] = campaign_progress(campaign)
         
         # Get recent donations (non-anonymous)
+        donations = await db.donations.find(
+            {"campaign_id": campaign_id, "payment_status": "completed", "is_anonymous": {"$ne": True}},
+            {"_id": 0, "donor_name": 1, "amount": 1, "message": 1, "created_at": 1}
+        ).sort("created_at", -1).limit(10).to_list(10)
         recent_donations = [
             {
                 "donor_name": d.get("donor_name", "Anonyme"),
@@ -3322,7 +4670,7 @@ async def get_campaign_details(campaign_id: str):
                 "message": d.get("message"),
                 "created_at": d.get("created_at")
             }
-            for d in donations[:10] if not d.get("is_anonymous", False)
+            for d in donations
         ]
         
         campaign["recent_donations"] = recent_donations
@@ -3342,12 +4690,19 @@ async def make_donation(
 ):
     """Make a donation to a campaign"""
     try:
-        # Verify campaign exists
-        campaign = await db.musician_campaigns.find_one({"id": donation_data.campaign_id})
+        # Count the donation on the campaign; the filter also checks it is still active
+        campaign = await db.musician_campaigns.find_one_and_update(
+            {"id": donation_data.campaign_id, "status": "active"},
+            {
+                "$inc": {"current_amount": donation_data.amount, "donors_count": 1},
+                "$set": {"updated_at": datetime.now(timezone.utc)}
+            },
+            projection={"_id": 0, "id": 1, "current_amount": 1, "donors_count": 1, "goal_amount": 1},
+            return_document=ReturnDocument.AFTER
+        )
         if not campaign:
-            raise HTTPException(status_code=404, detail="Campaign not found")
-        
-        if campaign["status"] != "active":
+            if not await db.musician_campaigns.find_one({"id": donation_data.campaign_id}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Campaign not found")
             raise HTTPException(status_code=400, detail="Campaign is not active")
         
         # Create donation record
@@ -3361,27 +4716,26 @@ async def make_donation(
             payment_status="completed"  # Simplified for MVP - in production integrate with payment gateway
         )
         
-        await db.donations.insert_one(prepare_for_mongo(donation.dict()))
-        
-        # Update campaign current amount
-        total_donations = await db.donations.find({
-            "campaign_id": donation_data.campaign_id,
-            "payment_status": "completed"
-        }).to_list(1000)
-        
-        new_total = sum(d.get("amount", 0) for d in total_donations)
-        
-        await db.musician_campaigns.update_one(
-            {"id": donation_data.campaign_id},
-            {
-                "$set": {
-                    "current_amount": new_total,
-                    "updated_at": datetime.now(timezone.utc)
-                }
-            }
-        )
+        donation_doc = prepare_for_mongo(donation.dict())
+        try:
+            await db.donations.insert_one(donation_doc)
+        except Exception:
+            # Undo the campaign totals so they keep matching the donations
+            await db.musician_campaigns.update_one(
+                {"id": donation_data.campaign_id},
+                {"$inc": {"current_amount": -donation_data.amount, "donors_count": -1}}
+            )
+            raise
+        await campaign_ranking.record_donation(donation_data.campaign_id, donation_data.amount)
+        solidarity_stats.mark_dirty()
+        await donation_ticker.publish(donation_doc, "campaign", {
+            "id": campaign["id"],
+            "current_amount": campaign["current_amount"],
+            "donors_count": campaign["donors_count"],
+            "progress_percentage": campaign_progress(campaign)
+        })
         
-        return {"message": "Donation successful", "donation_id": donation.id, "new_total": new_total}
+        return {"message": "Donation successful", "donation_id": donation.id, "new_total": campaign["current_amount"]}
         
     except HTTPException:
         raise
@@ -3397,18 +4751,7 @@ async def get_my_campaigns(
     try:
         campaigns = await db.musician_campaigns.find({
             "creator_id": current_user.id
-        }).sort("created_at", -1).to_list(100)
-        
-        # Add stats for each campaign
-        for campaign in campaigns:
-            donations = await db.donations.find({
-                "campaign_id": campaign["id"],
-                "payment_status": "completed"
-            }).to_list(1000)
-            
-            total_amount = sum(d.get("amount", 0) for d in donations)
-            campaign["current_amount"] = total_amount
-            campaign["donors_count"] = len(donations)
+        }, CAMPAIGN_READ_FIELDS).sort("created_at", -1).to_list(100)
         
         return [prepare_from_mongo(campaign) for campaign in campaigns]
         
@@ -3436,6 +4779,7 @@ async def create_advice(
         )
         
         await db.support_advice.insert_one(prepare_for_mongo(advice.dict()))
+        solidarity_stats.mark_dirty()
         return advice
         
     except Exception as e:
@@ -3447,7 +4791,8 @@ async def get_advice(
     category: Optional[str] = Query(None),
     target_audience: str = Query("all"),
     featured: bool = Query(False),
-    limit: int = Query(20, le=100)
+    limit: int = Query(20, le=100),
+    author_loader: AuthorLoader = Depends(get_author_loader)
 ):
     """Get support advice with filters"""
     try:
@@ -3463,12 +4808,10 @@ async def get_advice(
         advice_list = await db.support_advice.find(filter_query).sort("created_at", -1).limit(limit).to_list(limit)
         
         # Add advisor info
+        advisors = await author_loader.load_many(advice["advisor_id"] for advice in advice_list)
         for advice in advice_list:
-            advisor = await db.users.find_one({"id": advice["advisor_id"]})
-            if advisor:
-                advice["advisor_name"] = advisor.get("username", "Anonyme")
-            else:
-                advice["advisor_name"] = "Anonyme"
+            advisor = advisors.get(advice["advisor_id"])
+            advice["advisor_name"] = (advisor or {}).get("username") or "Anonyme"
         
         return [prepare_from_mongo(advice) for advice in advice_list]
         
@@ -3492,6 +4835,7 @@ async def create_support_request(
         )
         
         await db.support_requests.insert_one(prepare_for_mongo(support_request.dict()))
+        solidarity_stats.mark_dirty()
         return support_request
         
     except Exception as e:
@@ -3503,7 +4847,8 @@ async def get_support_requests(
     category: Optional[str] = Query(None),
     status: str = Query("open"),
     urgency: Optional[str] = Query(None),
-    limit: int = Query(20, le=100)
+    limit: int = Query(20, le=100),
+    author_loader: AuthorLoader = Depends(get_author_loader)
 ):
     """Get support requests with filters"""
     try:
@@ -3517,12 +4862,10 @@ async def get_support_requests(
         requests = await db.support_requests.find(filter_query).sort("created_at", -1).limit(limit).to_list(limit)
         
         # Add requester info (anonymized)
+        requesters = await author_loader.load_many(request["requester_id"] for request in requests)
         for request in requests:
-            requester = await db.users.find_one({"id": request["requester_id"]})
-            if requester:
-                request["requester_name"] = requester.get("username", "Anonyme")
-            else:
-                request["requester_name"] = "Anonyme"
+            requester = requesters.get(request["requester_id"])
+            request["requester_name"] = (requester or {}).get("username") or "Anonyme"
         
         return [prepare_from_mongo(request) for request in requests]
         
@@ -3530,46 +4873,82 @@ async def get_support_requests(
         logger.error(f"Error getting support requests: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get support requests")
 
+def union_tagged(collection: str, kind: str, match: Dict, fields: Dict) -> Dict:
+    """$unionWith stage appending matching documents tagged with `_kind`"""
+    return {
+        "$unionWith": {
+            "coll": collection,
+            "pipeline": [{"$match": match}, {"$project": {"_id": 0, "_kind": kind, **fields}}]
+        }
+    }
+
+async def compute_solidarity_stats() -> Dict:
+    """Solidarity statistics from a single aggregation over campaigns, donations and support content"""
+    result = await db.musician_campaigns.aggregate([
+        {"$project": {"_id": 0, "updates": 0}},
+        union_tagged("donations", "donation", {"payment_status": "completed"}, {"amount": 1, "donor_id": 1}),
+        union_tagged("support_advice", "advice", {}, {}),
+        union_tagged("support_requests", "support_request", {}, {}),
+        {
+            "$facet": {
+                "campaigns": [
+                    {"$match": {"_kind": {"$exists": False}}},
+                    {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+                ],
+                "success_stories": [
+                    {"$match": {"_kind": {"$exists": False}, "status": "completed"}},
+                    {"$limit": 3}
+                ],
+                "donations": [
+                    {"$match": {"_kind": "donation"}},
+                    {"$group": {"_id": "$donor_id", "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+                    {
+                        "$group": {
+                            "_id": None,
+                            "total_amount": {"$sum": "$amount"},
+                            "total_transactions": {"$sum": "$count"},
+                            "total_donors": {"$sum": {"$cond": [{"$ifNull": ["$_id", False]}, 1, 0]}}
+                        }
+                    }
+                ],
+                "community": [
+                    {"$match": {"_kind": {"$in": ["advice", "support_request"]}}},
+                    {"$group": {"_id": "$_kind", "count": {"$sum": 1}}}
+                ]
+            }
+        }
+    ], allowDiskUse=True).to_list(1)
+    facets = result[0]
+    
+    campaigns = {row["_id"]: row["count"] for row in facets["campaigns"]}
+    donations = facets["donations"][0] if facets["donations"] else {}
+    community = {row["_id"]: row["count"] for row in facets["community"]}
+    return {
+        "campaigns": {
+            "total": sum(campaigns.values()),
+            "active": campaigns.get("active", 0),
+            "completed": campaigns.get("completed", 0)
+        },
+        "donations": {
+            "total_amount": round(donations.get("total_amount", 0), 2),
+            "total_donors": donations.get("total_donors", 0),
+            "total_transactions": donations.get("total_transactions", 0)
+        },
+        "community": {
+            "total_advice": community.get("advice", 0),
+            "total_support_requests": community.get("support_request", 0)
+        },
+        "success_stories": facets["success_stories"]
+    }
+
+# Served from memory, never older than 5 minutes; recomputed shortly after changes
+solidarity_stats = StatsSnapshot(db, "solidarity", compute_solidarity_stats, max_age_seconds=300, reload_seconds=15)
+
 @api_router.get("/solidarity/stats")
 async def get_solidarity_stats():
     """Get global solidarity statistics"""
     try:
-        # Campaign stats
-        total_campaigns = await db.musician_campaigns.count_documents({})
-        active_campaigns = await db.musician_campaigns.count_documents({"status": "active"})
-        completed_campaigns = await db.musician_campaigns.count_documents({"status": "completed"})
-        
-        # Donation stats
-        all_donations = await db.donations.find({"payment_status": "completed"}).to_list(10000)
-        total_donated = sum(d.get("amount", 0) for d in all_donations)
-        total_donors = len(set(d.get("donor_id") for d in all_donations if d.get("donor_id")))
-        
-        # Advice stats
-        total_advice = await db.support_advice.count_documents({})
-        total_support_requests = await db.support_requests.count_documents({})
-        
-        # Success stories (completed campaigns)
-        success_campaigns = await db.musician_campaigns.find({
-            "status": "completed"
-        }).limit(3).to_list(3)
-        
-        return {
-            "campaigns": {
-                "total": total_campaigns,
-                "active": active_campaigns,
-                "completed": completed_campaigns
-            },
-            "donations": {
-                "total_amount": total_donated,
-                "total_donors": total_donors,
-                "total_transactions": len(all_donations)
-            },
-            "community": {
-                "total_advice": total_advice,
-                "total_support_requests": total_support_requests
-            },
-            "success_stories": [prepare_from_mongo(story) for story in success_campaigns]
-        }
+        return await solidarity_stats.get()
         
     except Exception as e:
         logger.error(f"Error getting solidarity stats: {str(e)}")
@@ -3741,15 +5120,33 @@ class DonationStats(BaseModel):
     youtube_views: int
     supported_artists: int
 
+# Le SDK Stripe est synchrone : ses appels sont exécutés dans un pool de threads
+# borné, et chaque thread réutilise sa propre session HTTP (connexions persistantes)
+stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+stripe.default_http_client = stripe.RequestsClient(timeout=20)
+stripe_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('STRIPE_SDK_WORKERS', '8')),
+    thread_name_prefix='stripe-sdk'
+)
+
+async def run_stripe(func, *args, **kwargs):
+    """
+    Exécute un appel du SDK Stripe sans bloquer la boucle d'événements
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(stripe_executor, functools.partial(func, *args, **kwargs))
+
+# Statistiques de donations : instantané en mémoire, recalculé au plus une fois par minute
+DONATION_STATS_TTL = 60
+donation_stats_snapshot = {'stats': None, 'expires_at': 0.0}
+donation_stats_lock = asyncio.Lock()
+
 @app.post("/create-donation-session")
 async def create_donation_session(donation: DonationRequest):
     """
     Crée une session de paiement Stripe pour les donations
     """
     try:
-        import stripe
-        stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-        
         # Créer les métadonnées de la donation
         metadata = {
             'purpose': donation.purpose,
@@ -3790,8 +5187,8 @@ async def create_donation_session(donation: DonationRequest):
                 'interval': 'month'
             }
         
-        # Créer la session Stripe
-        session = stripe.checkout.Session.create(**session_params)
+        # Créer la session Stripe (hors de la boucle d'événements)
+        session = await run_stripe(stripe.checkout.Session.create, **session_params)
         
         # Enregistrer la donation dans la base de données
         donation_data = {
@@ -3812,7 +5209,7 @@ async def create_donation_session(donation: DonationRequest):
         }
         
         # Insérer dans MongoDB
-        db.donations.insert_one(donation_data)
+        await db.donations.insert_one(donation_data)
         
         logging.info(f"Donation session created: {session.id} for {donation.donor_email}")
         
@@ -3832,47 +5229,56 @@ async def get_donation_stats():
     Retourne les statistiques de donations pour affichage public
     """
     try:
-        # Récupérer les statistiques depuis MongoDB
-        total_donated = db.donations.aggregate([
-            {'$match': {'status': 'completed'}},
-            {'$group': {'_id': None, 'total': {'$sum': '$amount'}}}
-        ])
-        total_donated = list(total_donated)
-        total_amount = total_donated[0]['total'] if total_donated else 0.0
-        
-        # Nombre de donateurs mensuels actifs
-        monthly_donors = db.donations.count_documents({
-            'type': 'monthly',
-            'status': 'completed',
-            'created_at': {'$gte': datetime.utcnow() - timedelta(days=30)}
-        })
-        
-        # Simuler les vues YouTube (dans une vraie app, intégrer l'API YouTube)
-        youtube_views = 125000 + int(total_amount * 10)  # Simulation basée sur les donations
+        if donation_stats_snapshot['expires_at'] > time.monotonic():
+            return donation_stats_snapshot['stats']
         
-        # Nombre d'artistes soutenus (basé sur les pistes dans la DB)
-        supported_artists = db.tracks.distinct('artist').__len__()
-        
-        return DonationStats(
-            total_donated=total_amount,
-            monthly_donors=monthly_donors,
-            youtube_views=youtube_views,
-            supported_artists=supported_artists
-        )
+        # Une seule requête recalcule l'instantané, les autres attendent son résultat
+        async with donation_stats_lock:
+            if donation_stats_snapshot['expires_at'] <= time.monotonic():
+                donation_stats_snapshot['stats'] = await compute_donation_stats()
+                donation_stats_snapshot['expires_at'] = time.monotonic() + DONATION_STATS_TTL
+        return donation_stats_snapshot['stats']
         
     except Exception as e:
         logging.error(f"Error getting donation stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def compute_donation_stats() -> DonationStats:
+    """
+    Calcule les statistiques de donations depuis MongoDB
+    """
+    total_donated = await db.donations.aggregate([
+        {'$match': {'status': 'completed'}},
+        {'$group': {'_id': None, 'total': {'$sum': '$amount'}}}
+    ]).to_list(1)
+    total_amount = total_donated[0]['total'] if total_donated else 0.0
+    
+    # Nombre de donateurs mensuels actifs
+    monthly_donors = await db.donations.count_documents({
+        'type': 'monthly',
+        'status': 'completed',
+        'created_at': {'$gte': datetime.utcnow() - timedelta(days=30)}
+    })
+    
+    # Simuler les vues YouTube (dans une vraie app, intégrer l'API YouTube)
+    youtube_views = 125000 + int(total_amount * 10)  # Simulation basée sur les donations
+    
+    # Nombre d'artistes soutenus (basé sur les pistes dans la DB)
+    supported_artists = len(await db.tracks.distinct('artist'))
+    
+    return DonationStats(
+        total_donated=total_amount,
+        monthly_donors=monthly_donors,
+        youtube_views=youtube_views,
+        supported_artists=supported_artists
+    )
+
 @app.post("/donation/webhook")
 async def handle_donation_webhook(request: Request):
     """
     Webhook Stripe pour traiter les confirmations de paiement
     """
     try:
-        import stripe
-        stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-        
         payload = await request.body()
         sig_header = request.headers.get('stripe-signature')
         endpoint_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
@@ -3881,44 +5287,15 @@ async def handle_donation_webhook(request: Request):
             raise HTTPException(status_code=400, detail="Webhook secret not configured")
         
         # Vérifier la signature du webhook
-        event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
-        
-        # Traiter les événements de paiement
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            
-            # Mettre à jour le statut de la donation
-            result = db.donations.update_one(
-                {'stripe_session_id': session['id']},
-                {
-                    '$set': {
-                        'status': 'completed',
-                        'stripe_payment_intent': session.get('payment_intent'),
-                        'updated_at': datetime.utcnow()
-                    }
-                }
-            )
-            
-            if result.modified_count > 0:
-                logging.info(f"Donation completed: {session['id']}")
-            
-        elif event['type'] == 'invoice.payment_succeeded':
-            # Pour les abonnements mensuels
-            invoice = event['data']['object']
-            subscription_id = invoice['subscription']
-            
-            # Enregistrer le paiement récurrent
-            db.donation_payments.insert_one({
-                'id': str(uuid.uuid4()),
-                'stripe_invoice_id': invoice['id'],
-                'stripe_subscription_id': subscription_id,
-                'amount': invoice['amount_paid'] / 100,
-                'currency': invoice['currency'],
-                'status': 'completed',
-                'payment_date': datetime.utcnow()
-            })
-            
-            logging.info(f"Monthly donation payment processed: {invoice['id']}")
+        event = await run_stripe(stripe.Webhook.construct_event, payload, sig_header, endpoint_secret)
+        
+        # Stocker l'événement : le traitement se fait en arrière-plan
+        await webhook_inbox.receive(
+            "stripe_donation",
+            event['id'],
+            event['type'],
+            json.loads(payload)['data']['object']
+        )
         
         return {'status': 'success'}
         
@@ -3932,13 +5309,62 @@ async def handle_donation_webhook(request: Request):
         logging.error(f"Error processing donation webhook: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def process_donation_events(events: List[Dict]):
+    """
+    Traite les événements de donation stockés dans la boîte de réception
+    """
+    for event in events:
+        data = event['payload']
+        
+        if event['type'] == 'checkout.session.completed':
+            # Mettre à jour le statut de la donation (une seule fois)
+            completed = await db.donations.find_one_and_update(
+                {'stripe_session_id': data['id'], 'status': 'pending'},
+                {
+                    '$set': {
+                        'status': 'completed',
+                        'stripe_payment_intent': data.get('payment_intent'),
+                        'updated_at': datetime.utcnow()
+                    }
+                },
+                projection={'_id': 0}
+            )
+            
+            if completed:
+                logging.info(f"Donation completed: {data['id']}")
+                # Diffuser la donation sur le fil en direct
+                await donation_ticker.publish(completed, "platform")
+            
+        elif event['type'] == 'invoice.payment_succeeded':
+            # Pour les abonnements mensuels : un paiement par facture
+            await db.donation_payments.update_one(
+                {'stripe_invoice_id': data['id']},
+                {
+                    '$setOnInsert': {
+                        'id': str(uuid.uuid4()),
+                        'stripe_invoice_id': data['id'],
+                        'stripe_subscription_id': data.get('subscription'),
+                        'amount': data['amount_paid'] / 100,
+                        'currency': data['currency'],
+                        'status': 'completed',
+                        'payment_date': datetime.utcnow()
+                    }
+                },
+                upsert=True
+            )
+            
+            logging.info(f"Monthly donation payment processed: {data['id']}")
+
+webhook_inbox.register("stripe_payment", process_payment_events)
+webhook_inbox.register("stripe_donation", process_donation_events)
+
 @app.get("/recent-donors")
 async def get_recent_donors(limit: int = Query(default=10, ge=1, le=50)):
     """
     Retourne la liste des donateurs récents (publics uniquement)
     """
     try:
-        recent_donations = list(db.donations.find(
+        recent_donations = await db.donations.find(
             {
                 'status': 'completed',
                 'is_anonymous': False
@@ -3950,7 +5376,7 @@ async def get_recent_donors(limit: int = Query(default=10, ge=1, le=50)):
                 'created_at': 1,
                 '_id': 0
             }
-        ).sort('created_at', -1).limit(limit))
+        ).sort('created_at', -1).limit(limit).to_list(limit)
         
         # Formatter les données pour l'affichage
         formatted_donors = []
@@ -3959,7 +5385,7 @@ async def get_recent_donors(limit: int = Query(default=10, ge=1, le=50)):
                 'name': donation.get('donor_name', 'Anonyme'),
                 'amount': donation['amount'],
                 'message': donation.get('message', ''),
-                'date': donation['created_at'].isoformat()
+                'date': donation['created_at'].isoformat() if isinstance(donation['created_at'], datetime) else donation['created_at']
             })
         
         return formatted_donors
@@ -3992,6 +5418,445 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# MongoDB indexes backing the paginated listing queries: (collection, keys, options)
+MONGO_INDEXES = [
+    ("users", [("id", 1)], {}),
+    ("musician_profiles", [("user_id", 1)], {}),
+    ("tracks", [("id", 1)], {}),
+    ("community_posts", [("is_active", 1), ("post_type", 1), ("created_at", -1)], {}),
+    ("community_posts", [("is_active", 1), ("tags", 1), ("created_at", -1)], {}),
+    ("community_posts", [("is_active", 1), ("created_at", -1)], {}),
+    ("post_comments", [("post_id", 1), ("created_at", 1)], {}),
+    ("group_messages", [("group_id", 1), ("is_deleted", 1), ("created_at", -1)], {}),
+    # At most one open bucket per group
+    ("group_message_buckets", [("group_id", 1)], {
+        "unique": True, "partialFilterExpression": {"open": True}, "name": "group_id_open_unique"
+    }),
+    ("group_message_buckets", [("group_id", 1), ("first_at", -1)], {}),
+    ("group_message_buckets", [("group_id", 1), ("last_at", -1)], {}),
+    ("group_message_buckets", [("messages.id", 1)], {}),
+    ("group_message_buckets", [("id", 1)], {"unique": True}),
+    ("community_groups", [("is_active", 1), ("group_type", 1), ("created_at", -1)], {}),
+    ("community_groups", [("is_active", 1), ("created_at", -1)], {}),
+    ("community_groups", [("id", 1)], {}),
+    ("community_groups", [("admin_id", 1), ("is_active", 1)], {}),
+    ("user_subscriptions", [("user_id", 1), ("status", 1)], {}),
+    ("user_subscriptions", [("status", 1), ("current_period_end", 1)], {}),
+    ("user_subscriptions", [("id", 1)], {}),
+    ("group_members", [("group_id", 1), ("user_id", 1)], {"unique": True}),
+    ("group_members", [("user_id", 1), ("is_active", 1)], {}),
+    ("group_members", [("group_id", 1), ("is_active", 1), ("joined_at", 1)], {}),
+    ("music_listings", [("status", 1), ("listing_type", 1), ("created_at", -1)], {}),
+    ("music_listings", [("status", 1), ("created_at", -1)], {}),
+    ("music_listings", [("status", 1), ("listing_type", 1), ("sale_price", 1)], {}),
+    ("music_listings", [("status", 1), ("listing_type", 1), ("license_price", 1)], {}),
+    ("music_listings", [("track_id", 1)], {}),
+    ("music_listings", [("seller_id", 1)], {}),
+    ("music_listings", [("status", 1), ("reserved_until", 1)], {}),
+    ("music_sales", [("stripe_session_id", 1)], {}),
+    ("payment_transactions", [("session_id", 1)], {}),
+    ("payment_transactions", [("payment_status", 1), ("applied_at", 1), ("updated_at", 1)], {}),
+    ("payment_transactions", [("user_email", 1), ("payment_status", 1)], {}),
+    ("payment_transactions", [("payment_status", 1), ("entitlements_granted", 1)], {}),
+    ("entitlements", [("user_id", 1), ("track_id", 1)], {"unique": True}),
+    # Keyless checkouts store idempotency_key: null, which a sparse index would still index
+    ("payment_transactions", [("idempotency_key", 1)], {"unique": True, "partialFilterExpression": {"idempotency_key": {"$type": "string"}}}),
+    ("music_sales", [("status", 1), ("completed_at", 1)], {}),
+    ("music_sales", [("settlement_id", 1), ("seller_id", 1)], {}),
+    ("music_sales", [("seller_id", 1), ("status", 1)], {}),
+    ("webhook_inbox", [("event_id", 1)], {"unique": True}),
+    ("webhook_inbox", [("status", 1), ("received_at", 1)], {}),
+    ("webhook_inbox", [("processed_at", 1)], {"expireAfterSeconds": 30 * 86400}),
+    ("donations", [("stripe_session_id", 1)], {}),
+    ("campaign_donation_buckets", [("campaign_id", 1), ("hour", 1)], {"unique": True}),
+    ("campaign_donation_buckets", [("hour_start", 1)], {"expireAfterSeconds": BUCKET_TTL_SECONDS}),
+    ("musician_campaigns", [("status", 1), ("created_at", -1)], {}),
+    ("campaign_updates", [("id", 1)], {"unique": True}),
+    ("campaign_updates", [("campaign_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ("donations", [("campaign_id", 1), ("payment_status", 1), ("created_at", -1)], {}),
+    ("donations", [("status", 1), ("is_anonymous", 1), ("created_at", -1)], {}),
+    ("donation_payments", [("stripe_invoice_id", 1)], {"unique": True}),
+    ("payout_ledger", [("id", 1)], {"unique": True}),
+    ("payout_ledger", [("seller_id", 1), ("created_at", -1)], {}),
+    ("analytics_rollups", [("scope", 1), ("key", 1), ("granularity", 1), ("period", 1)], {"unique": True}),
+    ("analytics_rollups", [("granularity", 1), ("period", 1)], {}),
+    ("follows", [("follower_id", 1), ("followee_id", 1)], {"unique": True}),
+    ("follows", [("followee_id", 1)], {}),
+    ("follows", [("follower_id", 1), ("followee_large", 1)], {}),
+    ("follows", [("follower_id", 1), ("created_at", -1)], {}),
+    ("home_timelines", [("user_id", 1)], {"unique": True}),
+    ("community_posts", [("user_id", 1), ("is_active", 1), ("created_at", -1)], {}),
+    ("community_posts", [("id", 1)], {}),
+    ("post_likes", [("post_id", 1), ("user_id", 1)], {"unique": True}),
+    ("post_likes", [("user_id", 1), ("post_id", 1)], {}),
+    ("musician_messages", [("conversation_id", 1), ("created_at", -1)], {}),
+    ("musician_messages", [("sender_id", 1), ("created_at", -1)], {}),
+    ("musician_messages", [("recipient_id", 1), ("created_at", -1)], {}),
+    ("conversation_inboxes", [("user_id", 1), ("conversation_id", 1)], {"unique": True}),
+    ("conversation_inboxes", [("user_id", 1), ("updated_at", -1)], {}),
+]
+
+# Indexes replaced by a definition with different options: (collection, index name, superseded options)
+SUPERSEDED_INDEXES = [
+    ("payment_transactions", "idempotency_key_1", {"sparse": True}),
+    ("user_subscriptions", "status_1_past_due_since_1", {}),
+    ("campaign_donation_buckets", "hour_start_1", {"expireAfterSeconds": 8 * 86400}),
+]
+
+async def drop_superseded_indexes():
+    for collection_name, index_name, old_options in SUPERSEDED_INDEXES:
+        try:
+            existing = (await db[collection_name].index_information()).get(index_name)
+            if existing and all(existing.get(key) == value for key, value in old_options.items()):
+                await db[collection_name].drop_index(index_name)
+                logger.info(f"Dropped superseded index {index_name} on {collection_name}")
+        except Exception as e:
+            logger.warning(f"Could not drop index {index_name} on {collection_name}: {e}")
+
+# Unique indexes the write paths rely on for correctness (collection, index name)
+REQUIRED_UNIQUE_INDEXES = [
+    ("payment_transactions", "idempotency_key_1"),
+    ("post_likes", "post_id_1_user_id_1"),
+    ("group_members", "group_id_1_user_id_1"),
+    ("group_message_buckets", "group_id_open_unique"),
+    ("webhook_inbox", "event_id_1"),
+    ("entitlements", "user_id_1_track_id_1"),
+    ("analytics_rollups", "scope_1_key_1_granularity_1_period_1"),
+]
+
+async def remove_duplicates(collection_name: str, keys: List[str], keep_sort: List) -> List[Dict]:
+    """Delete documents sharing the same `keys`, keeping the first one by `keep_sort`.
+    
+    Run before building a unique index over `keys`; returns the key values
+    that had duplicates so dependent counters can be recomputed.
+    """
+    collection = db[collection_name]
+    groups = await collection.aggregate([
+        {"$group": {"_id": {key: f"${key}" for key in keys}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True).to_list(None)
+    
+    removed = 0
+    for group in groups:
+        documents = await collection.find(group["_id"], {"_id": 1}).sort(keep_sort).to_list(None)
+        result = await collection.delete_many({"_id": {"$in": [document["_id"] for document in documents[1:]]}})
+        removed += result.deleted_count
+    if removed:
+        logger.warning(f"Removed {removed} duplicate {collection_name} documents")
+    return [group["_id"] for group in groups]
+
+async def dedupe_post_likes():
+    """Drop repeated likes left by racing requests and recount the affected posts"""
+    duplicates = await remove_duplicates("post_likes", ["post_id", "user_id"], [("created_at", 1)])
+    for post_id in {duplicate["post_id"] for duplicate in duplicates}:
+        await db.community_posts.update_one(
+            {"id": post_id},
+            {"$set": {"likes_count": await db.post_likes.count_documents({"post_id": post_id})}}
+        )
+
+async def dedupe_group_members():
+    """Keep one membership per (group_id, user_id), preferring the active one"""
+    duplicates = await remove_duplicates(
+        "group_members", ["group_id", "user_id"], [("is_active", -1), ("joined_at", 1)]
+    )
+    if duplicates:
+        # member_count of the affected groups is corrected by reconcile_group_member_counts
+        logger.warning(f"Merged duplicate memberships in {len({d['group_id'] for d in duplicates})} groups")
+
+async def verify_unique_indexes():
+    """Refuse to start when a unique index the write paths rely on could not be built"""
+    for collection_name, index_name in REQUIRED_UNIQUE_INDEXES:
+        index = (await db[collection_name].index_information()).get(index_name)
+        if not index or not index.get("unique"):
+            raise RuntimeError(f"Missing unique index {index_name} on {collection_name}")
+
+async def ensure_indexes():
+    """Create the MongoDB indexes used by the API queries"""
+    await drop_superseded_indexes()
+    for collection_name, keys, options in MONGO_INDEXES:
+        try:
+            await db[collection_name].create_index(keys, **options)
+        except Exception as e:
+            logger.warning(f"Could not create index {keys} on {collection_name}: {e}")
+
+async def reconcile_group_member_counts(batch_size: int = 500):
+    """Recompute community_groups.member_count from group_members and fix drift.
+    
+    Counters are read before the members are counted and each correction only
+    applies if the counter is still the one read: a group joined or left while
+    the job runs keeps its live counter and is checked again on the next run.
+    """
+    observed = {}
+    async for group in db.community_groups.find({}, {"_id": 0, "id": 1, "member_count": 1}):
+        observed[group["id"]] = group.get("member_count")
+    
+    counts = {}
+    async for row in db.group_members.aggregate([
+        {"$match": {"is_active": True}},
+        {"$group": {"_id": "$group_id", "count": {"$sum": 1}}}
+    ]):
+        counts[row["_id"]] = row["count"]
+    
+    corrections = []
+    fixed = 0
+    for group_id, member_count in observed.items():
+        actual = counts.get(group_id, 0)
+        if member_count != actual:
+            corrections.append(UpdateOne(
+                {"id": group_id, "member_count": member_count},
+                {"$set": {"member_count": actual}}
+            ))
+        if len(corrections) >= batch_size:
+            await db.community_groups.bulk_write(corrections, ordered=False)
+            fixed += len(corrections)
+            corrections = []
+    if corrections:
+        await db.community_groups.bulk_write(corrections, ordered=False)
+        fixed += len(corrections)
+    
+    if fixed:
+        logger.info(f"Corrected member_count on {fixed} groups")
+
+async def migrate_campaign_updates(batch_size: int = 100):
+    """Move updates embedded in musician_campaigns into the campaign_updates collection.
+    
+    Entries without an id get one derived from the campaign and their position,
+    so an interrupted migration can be re-run without duplicating updates.
+    """
+    migrated = 0
+    while True:
+        campaigns = await db.musician_campaigns.find(
+            {"updates": {"$exists": True}},
+            {"_id": 0, "id": 1, "creator_id": 1, "updates": 1, "created_at": 1, "updates_count": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not campaigns:
+            break
+        
+        for campaign in campaigns:
+            updates = []
+            for position, entry in enumerate(campaign.get("updates") or []):
+                created_at = entry.get("created_at") or campaign.get("created_at")
+                updates.append({
+                    "id": entry.get("id") or str(uuid.uuid5(uuid.NAMESPACE_URL, f"campaign-update:{campaign['id']}:{position}")),
+                    "campaign_id": campaign["id"],
+                    "author_id": entry.get("author_id") or campaign["creator_id"],
+                    "title": entry.get("title") or "",
+                    "content": entry.get("content") or entry.get("message") or "",
+                    "image_url": entry.get("image_url"),
+                    "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at
+                })
+            
+            if updates:
+                try:
+                    await db.campaign_updates.insert_many(updates, ordered=False)
+                except BulkWriteError as e:
+                    # Updates copied by an interrupted run are already there
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+            
+            # Guarded on the embedded array so a re-run never counts the same updates twice;
+            # updates posted since the deploy already set latest_update, which is newer
+            latest = max(updates, key=lambda update: update["created_at"] or "") if updates else None
+            moved = {"$inc": {"updates_count": len(updates)}, "$unset": {"updates": ""}}
+            result = None
+            if not campaign.get("updates_count"):
+                result = await db.musician_campaigns.update_one(
+                    {"id": campaign["id"], "updates": {"$exists": True}, "updates_count": {"$in": [0, None]}},
+                    {**moved, "$set": {"latest_update": campaign_update_preview(latest) if latest else None}}
+                )
+            if not result or result.modified_count == 0:
+                await db.musician_campaigns.update_one(
+                    {"id": campaign["id"], "updates": {"$exists": True}},
+                    moved
+                )
+            migrated += 1
+    
+    if migrated:
+        logger.info(f"Moved embedded updates of {migrated} campaigns to campaign_updates")
+
+async def reconcile_campaign_totals(batch_size: int = 500, settle_seconds: int = 60):
+    """Recompute musician_campaigns current_amount and donors_count from donations and fix drift.
+    
+    Campaigns that received a donation shortly before the aggregation are
+    skipped (their counter may be incremented before the donation is inserted),
+    and each correction only applies if the totals are still the ones read.
+    """
+    started = datetime.now(timezone.utc)
+    totals = {}
+    async for row in db.donations.aggregate([
+        {"$match": {"campaign_id": {"$exists": True}, "payment_status": "completed"}},
+        {"$group": {"_id": "$campaign_id", "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+    ]):
+        totals[row["_id"]] = (row["amount"], row["count"])
+    
+    corrections = []
+    fixed = 0
+    async for campaign in db.musician_campaigns.find(
+        {}, {"_id": 0, "id": 1, "current_amount": 1, "donors_count": 1, "updated_at": 1}
+    ):
+        updated_at = campaign.get("updated_at")
+        if isinstance(updated_at, str):
+            updated_at = datetime.fromisoformat(updated_at)
+        if isinstance(updated_at, datetime):
+            if updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            if updated_at >= started - timedelta(seconds=settle_seconds):
+                continue
+        amount, count = totals.get(campaign["id"], (0, 0))
+        if abs(campaign.get("current_amount", 0) - amount) > 0.005 or campaign.get("donors_count") != count:
+            corrections.append(UpdateOne(
+                {
+                    "id": campaign["id"],
+                    "current_amount": campaign.get("current_amount"),
+                    "donors_count": campaign.get("donors_count")
+                },
+                {"$set": {"current_amount": round(amount, 2), "donors_count": count}}
+            ))
+        if len(corrections) >= batch_size:
+            await db.musician_campaigns.bulk_write(corrections, ordered=False)
+            fixed += len(corrections)
+            corrections = []
+    if corrections:
+        await db.musician_campaigns.bulk_write(corrections, ordered=False)
+        fixed += len(corrections)
+    
+    if fixed:
+        logger.info(f"Corrected donation totals on {fixed} campaigns")
+
+async def backfill_track_entitlements(batch_size: int = 500):
+    """Grant entitlements for tracks bought before purchases were recorded there"""
+    granted = 0
+    while True:
+        transactions = await db.payment_transactions.find(
+            {"payment_status": "completed", "entitlements_granted": {"$ne": True}},
+            {"_id": 0, "session_id": 1, "user_id": 1, "user_email": 1, "track_ids": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not transactions:
+            break
+        await grant_track_entitlements(transactions)
+        granted += len(transactions)
+    
+    if granted:
+        logger.info(f"Granted entitlements for {granted} past purchases")
+
+async def drop_full_length_previews():
+    """Remove previews that point at the full audio file.
+    
+    Tracks uploaded before previews were generated used their audio as preview,
+    which now sits behind signed URLs: they have no preview until one is uploaded.
+    """
+    tracks = await db.tracks.update_many(
+        {"preview_url": {"$type": "string"}, "$expr": {"$eq": ["$preview_url", "$audio_url"]}},
+        {"$unset": {"preview_url": ""}}
+    )
+    # Listing snapshots copied the same URL
+    listings = await db.music_listings.update_many(
+        {"track.preview_url": {"$regex": f"^/uploads/audio/(?!{PUBLIC_AUDIO_PREFIX})"}},
+        {"$unset": {"track.preview_url": ""}}
+    )
+    if tracks.modified_count or listings.modified_count:
+        logger.warning(
+            f"Dropped full-length previews of {tracks.modified_count} tracks and {listings.modified_count} listings"
+        )
+
+async def backfill_listing_snapshots(batch_size: int = 500):
+    """Copy track and seller fields onto listings created before they were denormalized"""
+    loader = AuthorLoader(db, author_cache)
+    backfilled = 0
+    while True:
+        listings = await db.music_listings.find(
+            {"track": {"$exists": False}},
+            {"_id": 0, "id": 1, "track_id": 1, "seller_id": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not listings:
+            break
+        
+        tracks = await db.tracks.find(
+            {"id": {"$in": list({listing["track_id"] for listing in listings})}},
+            {"_id": 0}
+        ).to_list(None)
+        tracks_by_id = {track["id"]: track for track in tracks}
+        sellers = await loader.load_many(listing["seller_id"] for listing in listings)
+        
+        updates = []
+        for listing in listings:
+            track = tracks_by_id.get(listing["track_id"])
+            fields = {
+                "track": listing_track_snapshot(track) if track else None,
+                "seller": listing_seller_snapshot(sellers.get(listing["seller_id"]))
+            }
+            if not track:
+                # Listings whose track is gone were never shown; keep it that way
+                fields["status"] = "suspended"
+            updates.append(UpdateOne({"id": listing["id"]}, {"$set": fields}))
+        await db.music_listings.bulk_write(updates, ordered=False)
+        backfilled += len(updates)
+    
+    if backfilled:
+        logger.info(f"Backfilled track and seller fields on {backfilled} listings")
+
+async def backfill_conversations(batch_size: int = 1000):
+    """Assign conversation ids to legacy private messages and build their inboxes"""
+    migrated = 0
+    while True:
+        legacy = await db.musician_messages.find(
+            {"conversation_id": {"$exists": False}},
+            {"_id": 0, "id": 1, "sender_id": 1, "recipient_id": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not legacy:
+            break
+        
+        await db.musician_messages.bulk_write([
+            UpdateOne(
+                {"id": message["id"]},
+                {"$set": {"conversation_id": conversation_id_for(message["sender_id"], message["recipient_id"])}}
+            )
+            for message in legacy
+        ], ordered=False)
+        migrated += len(legacy)
+        
+        touched = list({conversation_id_for(m["sender_id"], m["recipient_id"]) for m in legacy})
+        summaries = await db.musician_messages.aggregate([
+            {"$match": {"conversation_id": {"$in": touched}}},
+            {"$sort": {"created_at": -1}},
+            {
+                "$group": {
+                    "_id": "$conversation_id",
+                    "last": {"$first": "$$ROOT"},
+                    "unread_recipients": {
+                        "$push": {"$cond": [{"$eq": ["$is_read", False]}, "$recipient_id", "$$REMOVE"]}
+                    }
+                }
+            }
+        ]).to_list(None)
+        
+        inbox_writes = []
+        for summary in summaries:
+            last = MusicianMessage(**parse_from_mongo(summary["last"]))
+            for user_id in summary["_id"].split(":"):
+                other_user_id = last.recipient_id if user_id == last.sender_id else last.sender_id
+                inbox_writes.append(UpdateOne(
+                    {"user_id": user_id, "conversation_id": summary["_id"]},
+                    {"$set": {
+                        "other_user_id": other_user_id,
+                        "last_message": {
+                            "id": last.id,
+                            "sender_id": last.sender_id,
+                            "subject": last.subject,
+                            "preview": last.content[:200],
+                            "created_at": last.created_at.isoformat()
+                        },
+                        "unread_count": summary["unread_recipients"].count(user_id),
+                        "updated_at": last.created_at.isoformat()
+                    }},
+                    upsert=True
+                ))
+        if inbox_writes:
+            await db.conversation_inboxes.bulk_write(inbox_writes, ordered=False)
+    
+    if migrated:
+        logger.info(f"Backfilled conversations for {migrated} private messages")
+
 # Startup event to initialize sample data
 @app.on_event("startup")
 async def startup_event():
@@ -4007,6 +5872,61 @@ async def startup_event():
     redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
     await translation_service.initialize_redis(redis_url)
     
+    await dedupe_post_likes()
+    await dedupe_group_members()
+    await ensure_indexes()
+    await verify_unique_indexes()
+    logger.info("MongoDB indexes ensured")
+    
+    await backfill_conversations()
+    await backfill_listing_snapshots()
+    await drop_full_length_previews()
+    
+    # Group messages still stored one document per message are moved in the background
+    app.state.group_chat_migration = asyncio.ensure_future(group_chat.run_migration(periodic_jobs.leases))
+    app.state.campaign_updates_migration = asyncio.ensure_future(migrate_campaign_updates())
+    
+    # Groups created before member_count existed get it on the first run
+    periodic_jobs.schedule(
+        "group_member_counts", 3600, reconcile_group_member_counts, run_immediately=True, lease_seconds=3500
+    )
+    periodic_jobs.schedule(
+        "campaign_totals", 3600, reconcile_campaign_totals, run_immediately=True, lease_seconds=3500
+    )
+    periodic_jobs.schedule("solidarity_stats", 60, solidarity_stats.refresh, run_immediately=True, lease_seconds=55)
+    periodic_jobs.schedule("solidarity_stats_changes", 5, solidarity_stats.refresh_if_dirty)
+    periodic_jobs.schedule("campaign_ranking", 60, campaign_ranking.rebuild, run_immediately=True)
+    periodic_jobs.schedule("timeline_large_accounts", 3600, timeline_service.reconcile_large_accounts, lease_seconds=3500)
+    # Purchases never granted (made before entitlements existed, or interrupted) are granted on the next run
+    periodic_jobs.schedule(
+        "track_entitlements", 3600, backfill_track_entitlements, run_immediately=True, lease_seconds=3500
+    )
+    try:
+        await donation_ticker.warm(db)
+    except Exception as e:
+        logger.warning(f"Could not preload the donation ticker: {e}")
+    donation_ticker.start()
+    # Full rebuilds pick up profiles saved on other workers and compact removed ones
+    periodic_jobs.schedule("matchmaking_index", 900, matchmaking.rebuild, run_immediately=True)
+    
+    # Home timelines live in MongoDB unless Redis is explicitly selected
+    if os.getenv('TIMELINE_BACKEND', 'mongo') == 'redis':
+        timeline_redis = await create_async_redis(redis_url)
+        if timeline_redis:
+            timeline_service.use_redis(timeline_redis)
+    
+    # Presence is per worker unless shared through Redis
+    if os.getenv('PRESENCE_BACKEND', 'memory') == 'redis':
+        presence_redis = await create_async_redis(redis_url)
+        if presence_redis:
+            presence.use_redis(presence_redis)
+    
+    # Multi-worker deployments relay real-time events through Redis pub/sub
+    if os.getenv('REALTIME_BACKPLANE', 'local') == 'redis':
+        realtime_redis = await create_async_redis(redis_url)
+        if realtime_redis:
+            await realtime_hub.use_redis(realtime_redis)
+    
     # Check if we already have sample data
     track_count = await db.tracks.count_documents({})
     if track_count < 10:  # Add more sample data
@@ -4324,6 +6244,7 @@ async def startup_event():
                 ],
                 max_uploads_per_month=25,
                 max_groups=10,
+                commission_rate=0.10,
                 can_sell_music=True,
                 can_create_events=True,
                 priority_support=True,
@@ -4347,6 +6268,7 @@ async def startup_event():
                 ],
                 max_uploads_per_month=999999,  # Unlimited
                 max_groups=999999,  # Unlimited
+                commission_rate=0.05,
                 can_sell_music=True,
                 can_create_events=True,
                 priority_support=True,
@@ -4360,9 +6282,34 @@ async def startup_event():
         
         logger.info(f"Initialized {len(subscription_plans)} subscription plans")
     
+    await plan_catalog.refresh()
+    periodic_jobs.schedule("plan_catalog", 300, plan_catalog.refresh)
+    periodic_jobs.schedule("marketplace_settlement", 86400, settle_marketplace_sales, lease_seconds=86000)
+    periodic_jobs.schedule("listing_reservations", 60, release_listing_reservations, lease_seconds=55)
+    periodic_jobs.schedule("subscription_lifecycle", 300, run_subscription_lifecycle, run_immediately=True, lease_seconds=290)
+    periodic_jobs.schedule("analytics_flush", 5, analytics.flush)
+    periodic_jobs.schedule("analytics_compaction", 86400, analytics.compact, run_immediately=True, lease_seconds=86000)
+    # Runs immediately to replay events left pending by a restart
+    periodic_jobs.schedule("webhook_inbox", 1, webhook_inbox.process_pending, run_immediately=True, lease_seconds=30)
+    periodic_jobs.schedule("payment_effects", 60, apply_pending_payment_effects, run_immediately=True, lease_seconds=55)
+    app.state.entitlement_listener = asyncio.ensure_future(listen_for_entitlement_changes())
+    
     logger.info("US EXPLO API fully initialized and ready! 🎵🌍")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await periodic_jobs.stop()
+    for task in (app.state.entitlement_listener, app.state.group_chat_migration, app.state.campaign_updates_migration):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Background task ended with an error: {e}")
+    await donation_ticker.stop()
+    await analytics.flush()
+    await realtime_hub.close()
+    stripe_executor.shutdown(wait=False)
     client.close()
     logger.info("Database connection closed")
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Precomputed statistics snapshots with a staleness bound.
+
+Expensive statistics are computed by one aggregation and stored as a document
+in `stats_snapshots` ({_id: name, data, computed_at}), shared by all workers.
+Each worker serves the snapshot from memory and re-reads the document every
+`reload_seconds`; a snapshot older than `max_age_seconds` is never served, it
+is recomputed first. Writes that change the figures mark the snapshot dirty
+so the next `refresh_if_dirty()` run recomputes it.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StatsSnapshot:
+    """One named statistics snapshot, cached in memory and in MongoDB"""
+
+    def __init__(
+        self,
+        db,
+        name: str,
+        compute: Callable[[], Awaitable[Dict]],
+        max_age_seconds: float = 300,
+        reload_seconds: float = 15
+    ):
+        self.collection = db.stats_snapshots
+        self.name = name
+        self.compute = compute
+        self.max_age_seconds = max_age_seconds
+        self.reload_seconds = reload_seconds
+        self.dirty = False
+        self._data: Optional[Dict] = None
+        self._computed_at = 0.0
+        self._loaded_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    async def get(self) -> Dict:
+        if time.monotonic() - self._loaded_at < self.reload_seconds and self._fresh():
+            return self._data
+        async with self._lock:
+            if time.monotonic() - self._loaded_at >= self.reload_seconds or not self._fresh():
+                await self._load()
+                if not self._fresh():
+                    await self._refresh_locked()
+        return self._data
+
+    async def refresh(self):
+        async with self._lock:
+            await self._refresh_locked()
+
+    async def refresh_if_dirty(self):
+        if self.dirty:
+            await self.refresh()
+
+    def _fresh(self) -> bool:
+        return self._data is not None and time.time() - self._computed_at <= self.max_age_seconds
+
+    async def _load(self):
+        document = await self.collection.find_one({"_id": self.name})
+        self._loaded_at = time.monotonic()
+        if document:
+            computed_at = document["computed_at"]
+            if computed_at.tzinfo is None:
+                computed_at = computed_at.replace(tzinfo=timezone.utc)
+            self._data = document["data"]
+            self._computed_at = computed_at.timestamp()
+
+    async def _refresh_locked(self):
+        self.dirty = False
+        started = time.perf_counter()
+        try:
+            data = await self.compute()
+        except Exception:
+            self.dirty = True
+            raise
+        computed_at = datetime.now(timezone.utc)
+        await self.collection.replace_one(
+            {"_id": self.name},
+            {"data": data, "computed_at": computed_at},
+            upsert=True
+        )
+        self._data = data
+        self._computed_at = computed_at.timestamp()
+        self._loaded_at = time.monotonic()
+        logger.debug(f"Stats snapshot {self.name} computed in {time.perf_counter() - started:.3f}s")
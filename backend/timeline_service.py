@@ -0,0 +1,288 @@
+"""
+Follow graph and per-user home timelines for the community feed.
+
+Posts are fanned out on write: when a post is created, its id is pushed onto
+the capped timeline of every follower of the author (and the author). Accounts
+with more than `fanout_limit` followers are not fanned out; their posts are
+merged into the timeline at read time instead (fan-out on read). A new
+follow backfills the followee's latest posts into the follower's timeline.
+
+Timelines are capped lists of post ids, newest first, stored either in MongoDB
+(`home_timelines`) or in Redis lists.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class MongoTimelineStore:
+    """Capped timelines stored as one document per user"""
+
+    def __init__(self, db, capacity: int):
+        self.db = db
+        self.capacity = capacity
+
+    async def push_many(self, user_ids: List[str], post_id: str):
+        await self.db.home_timelines.bulk_write([
+            UpdateOne(
+                {"user_id": user_id},
+                {"$push": {"post_ids": {"$each": [post_id], "$position": 0, "$slice": self.capacity}}},
+                upsert=True
+            )
+            for user_id in user_ids
+        ], ordered=False)
+
+    async def range(self, user_id: str, start: int, stop: int) -> List[str]:
+        if stop <= start:
+            return []
+        timeline = await self.db.home_timelines.find_one(
+            {"user_id": user_id},
+            {"_id": 0, "post_ids": {"$slice": [start, stop - start]}}
+        )
+        return timeline["post_ids"] if timeline else []
+
+    async def merge(self, user_id: str, merged: Callable[[List[str]], Awaitable[List[str]]], attempts: int = 3):
+        """Replace a timeline with `merged(current ids)`, unless a push happened meanwhile (then retry)"""
+        for _ in range(attempts):
+            timeline = await self.db.home_timelines.find_one({"user_id": user_id}, {"_id": 0, "post_ids": 1})
+            current = timeline["post_ids"] if timeline else []
+            post_ids = await merged(current)
+            if not timeline:
+                try:
+                    await self.db.home_timelines.insert_one({"user_id": user_id, "post_ids": post_ids})
+                    return
+                except DuplicateKeyError:
+                    # Created by a concurrent push
+                    continue
+            result = await self.db.home_timelines.update_one(
+                {"user_id": user_id, "post_ids": current},
+                {"$set": {"post_ids": post_ids}}
+            )
+            if result.matched_count:
+                return
+        logger.warning(f"Timeline of {user_id} kept changing, backfill skipped")
+
+
+class RedisTimelineStore:
+    """Capped timelines stored as Redis lists (newest first)"""
+
+    def __init__(self, redis_client, capacity: int):
+        self.redis = redis_client
+        self.capacity = capacity
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"timeline:{user_id}"
+
+    async def push_many(self, user_ids: List[str], post_id: str):
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.lpush(self._key(user_id), post_id)
+            pipe.ltrim(self._key(user_id), 0, self.capacity - 1)
+        await pipe.execute()
+
+    async def range(self, user_id: str, start: int, stop: int) -> List[str]:
+        if stop <= start:
+            return []
+        post_ids = await self.redis.lrange(self._key(user_id), start, stop - 1)
+        return [p.decode() if isinstance(p, bytes) else p for p in post_ids]
+
+    async def merge(self, user_id: str, merged: Callable[[List[str]], Awaitable[List[str]]], attempts: int = 3):
+        """Replace a timeline with `merged(current ids)`, unless a push happened meanwhile (then retry)"""
+        from redis.exceptions import WatchError
+
+        key = self._key(user_id)
+        for _ in range(attempts):
+            async with self.redis.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(key)
+                    current = [p.decode() if isinstance(p, bytes) else p for p in await pipe.lrange(key, 0, -1)]
+                    post_ids = await merged(current)
+                    pipe.multi()
+                    pipe.delete(key)
+                    if post_ids:
+                        pipe.rpush(key, *post_ids)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    continue
+        logger.warning(f"Timeline of {user_id} kept changing, backfill skipped")
+
+
+class TimelineService:
+    """Follow relationships and home timeline materialization"""
+
+    def __init__(
+        self,
+        db,
+        capacity: int = 800,
+        fanout_limit: int = 10000,
+        batch_size: int = 1000,
+        backfill_size: int = 20
+    ):
+        self.db = db
+        self.capacity = capacity
+        self.fanout_limit = fanout_limit
+        self.batch_size = batch_size
+        self.backfill_size = backfill_size
+        self.store = MongoTimelineStore(db, capacity)
+        self._tasks = set()
+
+    def use_redis(self, redis_client):
+        """Keep timelines in Redis lists instead of MongoDB"""
+        self.store = RedisTimelineStore(redis_client, self.capacity)
+        logger.info("Home timelines stored in Redis")
+
+    # ----- Follow graph -----
+
+    async def follow(self, follower_id: str, followee_id: str) -> bool:
+        """Create the follow edge. Returns False if it already existed."""
+        try:
+            await self.db.follows.insert_one({
+                "follower_id": follower_id,
+                "followee_id": followee_id,
+                "followee_large": False,
+                "created_at": datetime.now(timezone.utc).isoformat()
+            })
+        except DuplicateKeyError:
+            return False
+
+        await self.db.users.update_one({"id": follower_id}, {"$inc": {"following_count": 1}})
+        followee = await self.db.users.find_one_and_update(
+            {"id": followee_id},
+            {"$inc": {"followers_count": 1}},
+            projection={"_id": 0, "followers_count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        followers_count = (followee or {}).get("followers_count", 0)
+        if followers_count > self.fanout_limit:
+            # Covers both the account crossing the limit and this new edge
+            await self.db.follows.update_many(
+                {"followee_id": followee_id, "followee_large": False},
+                {"$set": {"followee_large": True}}
+            )
+        else:
+            # Posts of large accounts are merged at read time and need no backfill
+            self._spawn(self.backfill(follower_id, followee_id))
+        return True
+
+    async def unfollow(self, follower_id: str, followee_id: str) -> bool:
+        result = await self.db.follows.delete_one({"follower_id": follower_id, "followee_id": followee_id})
+        if result.deleted_count == 0:
+            return False
+        await self.db.users.update_one({"id": follower_id}, {"$inc": {"following_count": -1}})
+        await self.db.users.update_one(
+            {"id": followee_id, "followers_count": {"$gt": 0}},
+            {"$inc": {"followers_count": -1}}
+        )
+        return True
+
+    async def is_large_account(self, user_id: str) -> bool:
+        user = await self.db.users.find_one({"id": user_id}, {"_id": 0, "followers_count": 1})
+        return (user or {}).get("followers_count", 0) > self.fanout_limit
+
+    async def reconcile_large_accounts(self):
+        """Flag the follow edges of every account over the fan-out limit as followee_large.
+
+        Catches edges created while their followee crossed the limit. Flags are
+        never cleared: posts made while the account was large were not fanned
+        out, so its followers keep merging them at read time.
+        """
+        large = await self.db.follows.aggregate([
+            {"$group": {"_id": "$followee_id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": self.fanout_limit}}}
+        ], allowDiskUse=True).to_list(None)
+        for row in large:
+            result = await self.db.follows.update_many(
+                {"followee_id": row["_id"], "followee_large": False},
+                {"$set": {"followee_large": True}}
+            )
+            if result.modified_count:
+                logger.info(f"Flagged {result.modified_count} follow edges of large account {row['_id']}")
+
+    async def backfill(self, follower_id: str, followee_id: str):
+        """Merge the followee's latest posts into the follower's timeline, in created_at order"""
+        try:
+            recent = await self.db.community_posts.find(
+                {"user_id": followee_id, "is_active": True}, {"_id": 0, "id": 1, "created_at": 1}
+            ).sort("created_at", -1).limit(self.backfill_size).to_list(self.backfill_size)
+            if not recent:
+                return
+
+            async def merged(current: List[str]) -> List[str]:
+                posts = {post["id"]: str(post["created_at"]) for post in recent}
+                missing = [post_id for post_id in current if post_id not in posts]
+                async for post in self.db.community_posts.find(
+                    {"id": {"$in": missing}}, {"_id": 0, "id": 1, "created_at": 1}
+                ):
+                    posts[post["id"]] = str(post["created_at"])
+                # Ids of deleted posts sort last and are the first to fall off the cap
+                ordered = sorted(set(current) | set(posts), key=lambda post_id: posts.get(post_id, ""), reverse=True)
+                return ordered[:self.capacity]
+
+            await self.store.merge(follower_id, merged)
+        except Exception as e:
+            logger.error(f"Error backfilling timeline of {follower_id}: {e}")
+
+    # ----- Fan-out on write -----
+
+    def schedule_fan_out(self, author_id: str, post_id: str):
+        """Fan a new post out in the background so post creation stays fast"""
+        self._spawn(self.fan_out(author_id, post_id))
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def fan_out(self, author_id: str, post_id: str):
+        try:
+            await self.store.push_many([author_id], post_id)
+            if await self.is_large_account(author_id):
+                return
+
+            batch = []
+            cursor = self.db.follows.find({"followee_id": author_id}, {"_id": 0, "follower_id": 1})
+            async for edge in cursor:
+                batch.append(edge["follower_id"])
+                if len(batch) >= self.batch_size:
+                    await self.store.push_many(batch, post_id)
+                    batch = []
+            if batch:
+                await self.store.push_many(batch, post_id)
+        except Exception as e:
+            logger.error(f"Error fanning out post {post_id}: {e}")
+
+    # ----- Reads -----
+
+    async def read(self, user_id: str, skip: int, limit: int, projection: Dict) -> List[Dict]:
+        """Return a page of the user's home timeline as post documents"""
+        window = skip + limit
+        post_ids = await self.store.range(user_id, 0, window)
+
+        posts = []
+        if post_ids:
+            posts = await self.db.community_posts.find(
+                {"id": {"$in": post_ids}, "is_active": True}, projection
+            ).to_list(len(post_ids))
+
+        # Fan-out on read for followed accounts too large to fan out on write
+        large_followees = await self.db.follows.distinct(
+            "followee_id", {"follower_id": user_id, "followee_large": True}
+        )
+        if large_followees:
+            seen = {post["id"] for post in posts}
+            recent = await self.db.community_posts.find(
+                {"user_id": {"$in": large_followees}, "is_active": True}, projection
+            ).sort("created_at", -1).limit(window).to_list(window)
+            posts.extend(post for post in recent if post["id"] not in seen)
+
+        posts.sort(key=lambda post: str(post.get("created_at", "")), reverse=True)
+        return posts[skip:window]
@@ -0,0 +1,105 @@
+"""
+Durable inbox for incoming webhook events.
+
+Webhook endpoints verify the event, store it here with one insert and return
+right away. A unique index on `event_id` turns provider retries into no-ops.
+A background worker (scheduled under a job lease, so one worker at a time)
+hands pending events to the handler registered for their source, in batches,
+and marks them processed. Events left pending by a crash or restart are
+simply picked up by the next run.
+
+    {event_id, source, type, payload, status: "pending" | "processed" | "failed",
+     attempts, received_at, processed_at, last_error}
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[List[Dict]], Awaitable]
+
+
+class WebhookInbox:
+    """Deduplicated store of webhook events with batched processing"""
+
+    def __init__(self, db, batch_size: int = 200, max_attempts: int = 5):
+        self.collection = db.webhook_inbox
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.handlers: Dict[str, EventHandler] = {}
+
+    def register(self, source: str, handler: EventHandler):
+        """`handler(events)` must be idempotent: an event may be handed over more than once"""
+        self.handlers[source] = handler
+
+    async def receive(self, source: str, event_id: str, event_type: str, payload: Dict) -> bool:
+        """Store an event; False if it was already received"""
+        try:
+            await self.collection.insert_one({
+                "event_id": event_id,
+                "source": source,
+                "type": event_type,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "received_at": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            logger.info(f"Duplicate {source} webhook event {event_id} ignored")
+            return False
+        return True
+
+    async def process_pending(self) -> int:
+        """Process pending events in batches until none are left"""
+        processed = 0
+        while True:
+            events = await self.collection.find(
+                {"status": "pending"}, {"payload": 1, "event_id": 1, "source": 1, "type": 1, "attempts": 1}
+            ).sort("received_at", 1).limit(self.batch_size).to_list(self.batch_size)
+            if not events:
+                return processed
+
+            by_source = defaultdict(list)
+            for event in events:
+                by_source[event["source"]].append(event)
+            for source, source_events in by_source.items():
+                processed += await self._dispatch(source, source_events)
+
+            if len(events) < self.batch_size:
+                return processed
+
+    async def _dispatch(self, source: str, events: List[Dict]) -> int:
+        handler = self.handlers.get(source)
+        if handler is None:
+            await self._failed(events, f"No handler for source {source}", final=True)
+            return 0
+        try:
+            await handler(events)
+        except Exception as e:
+            if len(events) == 1:
+                await self._failed(events, str(e))
+                return 0
+            # Isolate the failing event(s) so the rest of the batch goes through
+            logger.warning(f"Batch of {len(events)} {source} events failed, retrying one by one: {e}")
+            return sum([await self._dispatch(source, [event]) for event in events])
+
+        await self.collection.update_many(
+            {"_id": {"$in": [event["_id"] for event in events]}},
+            {"$set": {"status": "processed", "processed_at": datetime.now(timezone.utc)}}
+        )
+        return len(events)
+
+    async def _failed(self, events: List[Dict], error: str, final: bool = False):
+        for event in events:
+            attempts = event.get("attempts", 0) + 1
+            status = "failed" if final or attempts >= self.max_attempts else "pending"
+            logger.error(f"Webhook event {event['event_id']} failed (attempt {attempts}): {error}")
+            await self.collection.update_one(
+                {"_id": event["_id"]},
+                {"$set": {"status": status, "attempts": attempts, "last_error": error[:500]}}
+            )
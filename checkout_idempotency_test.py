@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Live check of checkout creation with and without an Idempotency-Key.
+
+- Two checkouts in a row without the header must both succeed, with two
+  different sessions (keyless transactions store idempotency_key: null and
+  must not collide on the unique index).
+- Two checkouts with the same key must return the same session.
+- Reusing a key for a different cart must be rejected (422).
+
+Usage:
+    python checkout_idempotency_test.py --base-url http://localhost:8001/api
+"""
+
+import argparse
+import sys
+import uuid
+
+import requests
+
+
+class CheckoutIdempotencyTester:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.tests_run = 0
+        self.tests_passed = 0
+
+    def check(self, name, condition, detail=""):
+        self.tests_run += 1
+        if condition:
+            self.tests_passed += 1
+            print(f"   ✅ {name}")
+        else:
+            print(f"   ❌ {name} {detail}")
+        return condition
+
+    def checkout(self, track_ids, key=None):
+        headers = {"Idempotency-Key": key} if key else {}
+        return requests.post(
+            f"{self.base_url}/checkout/create",
+            json={"host_url": "http://localhost:3000", "track_ids": track_ids, "user_email": "idempotency@test.local"},
+            headers=headers,
+            timeout=30
+        )
+
+    def run(self):
+        tracks = requests.get(f"{self.base_url}/tracks", timeout=10).json()
+        priced = [track["id"] for track in tracks if track.get("price", 0) > 0]
+        if len(priced) < 2:
+            print("❌ Need at least two priced tracks")
+            return False
+
+        print("\n🔍 Keyless checkouts")
+        first, second = self.checkout(priced[:1]), self.checkout(priced[:1])
+        self.check("first keyless checkout succeeds", first.status_code == 200, first.text[:200])
+        self.check("second keyless checkout succeeds", second.status_code == 200, second.text[:200])
+        if first.status_code == second.status_code == 200:
+            self.check("keyless checkouts open distinct sessions",
+                       first.json()["session_id"] != second.json()["session_id"])
+
+        print("\n🔍 Checkouts with an Idempotency-Key")
+        key = str(uuid.uuid4())
+        first, retry = self.checkout(priced[:1], key), self.checkout(priced[:1], key)
+        self.check("keyed checkout succeeds", first.status_code == 200, first.text[:200])
+        self.check("retry returns the same session",
+                   retry.status_code == 200 and retry.json().get("session_id") == first.json().get("session_id"),
+                   retry.text[:200])
+        conflict = self.checkout(priced[:2], key)
+        self.check("key reused for another cart is rejected", conflict.status_code == 422, conflict.text[:200])
+
+        print(f"\n📊 {self.tests_passed}/{self.tests_run} checks passed")
+        return self.tests_passed == self.tests_run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8001/api")
+    args = parser.parse_args()
+    return 0 if CheckoutIdempotencyTester(args.base_url).run() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
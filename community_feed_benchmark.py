@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the paginated community endpoints.
+
+Seeds the community_posts collection in steps (10k, 100k, 1M posts by default)
+and measures the latency of GET /api/community/posts after every step. Because
+the feed pipeline now matches, sorts and limits on an index before joining
+authors, the latency should stay flat while the collection grows.
+
+Usage:
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=test_database \\
+        python community_feed_benchmark.py --base-url http://localhost:8001/api
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import requests
+from pymongo import MongoClient
+
+POST_TYPES = ["idea", "collaboration", "question", "event", "showcase"]
+TAGS = ["afrobeat", "bikutsi", "makossa", "jazz", "jam", "studio", "live", "mix"]
+BENCHMARK_MARKER = "community_feed_benchmark"
+
+
+class CommunityFeedBenchmark:
+    def __init__(self, base_url, mongo_url, db_name, authors=200, requests_per_step=50):
+        self.base_url = base_url
+        self.db = MongoClient(mongo_url)[db_name]
+        self.requests_per_step = requests_per_step
+        self.author_ids = [str(uuid.uuid4()) for _ in range(authors)]
+        self.seeded = 0
+        self.results = []
+
+    def seed_authors(self):
+        """Insert the users and musician profiles the seeded posts point to"""
+        now = datetime.now(timezone.utc).isoformat()
+        self.db.users.insert_many([
+            {
+                "id": author_id,
+                "email": f"bench_{i}_{author_id[:8]}@example.com",
+                "username": f"bench_{i}_{author_id[:8]}",
+                "hashed_password": "",
+                "created_at": now,
+                "is_active": True,
+                "benchmark": BENCHMARK_MARKER
+            }
+            for i, author_id in enumerate(self.author_ids)
+        ])
+        self.db.musician_profiles.insert_many([
+            {
+                "id": str(uuid.uuid4()),
+                "user_id": author_id,
+                "stage_name": f"Bench Artist {i}",
+                "is_active": True,
+                "created_at": now,
+                "benchmark": BENCHMARK_MARKER
+            }
+            for i, author_id in enumerate(self.author_ids)
+        ])
+
+    def seed_posts(self, target, batch_size=10000):
+        """Grow the seeded post count up to target"""
+        base_time = datetime.now(timezone.utc) - timedelta(days=365)
+        started = time.time()
+        while self.seeded < target:
+            count = min(batch_size, target - self.seeded)
+            batch = []
+            for i in range(count):
+                n = self.seeded + i
+                batch.append({
+                    "id": str(uuid.uuid4()),
+                    "user_id": self.author_ids[n % len(self.author_ids)],
+                    "title": f"Benchmark post {n}",
+                    "content": "Lorem ipsum " * 10,
+                    "post_type": POST_TYPES[n % len(POST_TYPES)],
+                    "tags": [TAGS[n % len(TAGS)], TAGS[(n * 7) % len(TAGS)]],
+                    "media_urls": [],
+                    "likes_count": 0,
+                    "comments_count": 0,
+                    "created_at": (base_time + timedelta(seconds=n)).isoformat(),
+                    "updated_at": (base_time + timedelta(seconds=n)).isoformat(),
+                    "is_active": n % 20 != 0,
+                    "benchmark": BENCHMARK_MARKER
+                })
+            self.db.community_posts.insert_many(batch, ordered=False)
+            self.seeded += count
+        print(f"   Seeded {self.seeded:,} posts ({time.time() - started:.1f}s for this step)")
+
+    def measure(self, label, params):
+        """Time requests_per_step feed requests and return latency percentiles in ms"""
+        timings = []
+        for _ in range(self.requests_per_step):
+            started = time.perf_counter()
+            response = requests.get(f"{self.base_url}/community/posts", params=params)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"{label}: HTTP {response.status_code} - {response.text[:200]}")
+        timings.sort()
+        return {
+            "p50": statistics.median(timings),
+            "p95": timings[int(len(timings) * 0.95) - 1]
+        }
+
+    def explain_feed(self, post_type=None):
+        """Return the winning plan stage of the feed's match/sort/limit prefix"""
+        match = {"is_active": True}
+        if post_type:
+            match["post_type"] = post_type
+        plan = self.db.community_posts.find(match).sort("created_at", -1).limit(20).explain()
+        winning = plan.get("queryPlanner", {}).get("winningPlan", {})
+        stages = []
+        while winning:
+            stages.append(winning.get("stage"))
+            winning = winning.get("inputStage")
+        return " <- ".join(s for s in stages if s)
+
+    def run_step(self, size):
+        print(f"\n🔍 Step: {size:,} posts")
+        self.seed_posts(size)
+        scenarios = {
+            "first page": {"limit": 20},
+            "post_type filter": {"limit": 20, "post_type": "collaboration"},
+            "tag filter": {"limit": 20, "tag": "bikutsi"},
+            "page 10": {"limit": 20, "skip": 200}
+        }
+        step = {"size": size}
+        for label, params in scenarios.items():
+            latency = self.measure(label, params)
+            step[label] = latency
+            print(f"   {label:<18} p50={latency['p50']:7.1f}ms  p95={latency['p95']:7.1f}ms")
+        print(f"   plan: {self.explain_feed('collaboration')}")
+        self.results.append(step)
+
+    def cleanup(self):
+        for collection in ("community_posts", "users", "musician_profiles"):
+            self.db[collection].delete_many({"benchmark": BENCHMARK_MARKER})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Community feed latency benchmark")
+    parser.add_argument("--base-url", default="http://localhost:8001/api")
+    parser.add_argument("--steps", default="10000,100000,1000000",
+                        help="Comma separated cumulative post counts")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario and step")
+    parser.add_argument("--max-growth", type=float, default=3.0,
+                        help="Allowed p50 growth factor between the smallest and largest step")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded documents")
+    args = parser.parse_args()
+
+    benchmark = CommunityFeedBenchmark(
+        base_url=args.base_url,
+        mongo_url=os.environ.get("MONGO_URL", "mongodb://localhost:27017"),
+        db_name=os.environ.get("DB_NAME", "test_database"),
+        requests_per_step=args.requests
+    )
+
+    print("🚀 Community feed benchmark")
+    print("=" * 80)
+    steps = [int(step) for step in args.steps.split(",")]
+    flat = True
+    try:
+        benchmark.seed_authors()
+        for size in steps:
+            benchmark.run_step(size)
+
+        print("\n" + "=" * 80)
+        print("📊 LATENCY GROWTH (p50, largest step vs smallest step)")
+        print("=" * 80)
+        first, last = benchmark.results[0], benchmark.results[-1]
+        for label in ("first page", "post_type filter", "tag filter", "page 10"):
+            growth = last[label]["p50"] / max(first[label]["p50"], 0.001)
+            ok = growth <= args.max_growth
+            flat = flat and ok
+            print(f"   {label:<18} x{growth:5.2f}  {'✅' if ok else '❌'}")
+    finally:
+        if not args.keep:
+            benchmark.cleanup()
+
+    if flat:
+        print("\n🎉 Feed latency stays flat as the collection grows")
+        sys.exit(0)
+    print("\n⚠️  Feed latency grows with the collection size")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
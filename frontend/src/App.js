@@ -159,17 +159,34 @@ export { useAuth };
 // Audio Player Context
 const AudioContext = createContext();
 
+// Uploaded media is served by the backend, not by the frontend host
+const mediaUrl = (url) => (url && url.startsWith('/uploads') ? `${BACKEND_URL}${url}` : url);
+
+// Full audio of an uploaded track is only served to its owner and buyers, through a signed URL
+const fetchDownloadUrl = async (trackId) => {
+  const response = await axios.get(`${API}/tracks/${trackId}/download`);
+  return mediaUrl(response.data.download_url);
+};
+
 const AudioProvider = ({ children }) => {
   const [currentTrack, setCurrentTrack] = useState(null);
   const [isPlaying, setIsPlaying] = useState(false);
   const [audio, setAudio] = useState(null);
 
-  const playTrack = (track) => {
+  const playTrack = async (track) => {
     if (audio) {
       audio.pause();
     }
     
-    const audioUrl = track.preview_url || track.audio_url;
+    // Public tracks only expose their preview; without one, owners and buyers get the signed full track
+    let audioUrl = mediaUrl(track.preview_url);
+    if (!audioUrl && axios.defaults.headers.common['Authorization']) {
+      try {
+        audioUrl = await fetchDownloadUrl(track.id);
+      } catch (error) {
+        audioUrl = null;
+      }
+    }
     
     // Skip if no valid audio URL or if it's a placeholder
     if (!audioUrl || audioUrl.includes('example.com')) {
@@ -688,6 +705,23 @@ const TrackCard = ({ track }) => {
     toast.music(`🎧 Lecture: ${track.title} - ${track.artist}`, 2000);
   };
 
+  const handleDownload = async () => {
+    if (!axios.defaults.headers.common['Authorization']) {
+      toast.info('Connectez-vous pour télécharger vos morceaux', 3000);
+      return;
+    }
+    try {
+      window.location.href = await fetchDownloadUrl(track.id);
+    } catch (error) {
+      if (error.response?.status === 403) {
+        toast.info('🛒 Achetez ce morceau pour le télécharger', 3000);
+      } else {
+        console.error('Error getting download URL:', error);
+        toast.error('❌ Erreur lors du téléchargement');
+      }
+    }
+  };
+
   const isCurrentlyPlaying = currentTrack?.id === track.id && isPlaying;
 
   return (
@@ -786,10 +820,14 @@ const TrackCard = ({ track }) => {
               <Heart className={`w-4 h-4 transition-transform group-hover:scale-110 ${isLiked ? 'fill-current' : ''}`} />
               <span className="text-sm font-medium">{track.likes}</span>
             </button>
-            <div className="flex items-center space-x-1 text-charcoal/60">
+            <button
+              onClick={handleDownload}
+              title="Télécharger (morceaux achetés)"
+              className="flex items-center space-x-1 text-charcoal/60 hover:text-terracotta transition-all"
+            >
               <Download className="w-4 h-4" />
               <span className="text-sm font-medium">{track.downloads}</span>
-            </div>
+            </button>
             <div className="flex items-center space-x-1 text-charcoal/60">
               <Headphones className="w-4 h-4" />
               <span className="text-sm font-medium">HD</span>
@@ -1363,6 +1401,26 @@ const Footer = () => {
   );
 };
 
+// Final checkout outcomes other than success, shown by the success page
+const PAYMENT_ISSUES = {
+  refunded: {
+    title: 'Paiement remboursé',
+    message: "Ce morceau exclusif a déjà été vendu. Votre paiement vous a été remboursé."
+  },
+  failed: {
+    title: 'Paiement refusé',
+    message: "Le paiement n'a pas abouti. Aucun montant n'a été débité."
+  },
+  expired: {
+    title: 'Session expirée',
+    message: "La session de paiement a expiré. Vous pouvez relancer votre achat."
+  },
+  timeout: {
+    title: 'Paiement en cours de traitement',
+    message: "La confirmation prend plus de temps que prévu. Vos morceaux apparaîtront dès réception du paiement."
+  }
+};
+
 // Success Page Component
 const SuccessPage = () => {
   const [sessionId, setSessionId] = useState(null);
@@ -1379,21 +1437,28 @@ const SuccessPage = () => {
   }, []);
 
   const checkPaymentStatus = async (sessionId, attempts = 0) => {
-    const maxAttempts = 5;
+    // ~3 minutes in all: longer than the server's 1 minute before it asks Stripe directly
+    const maxAttempts = 9;
     if (attempts >= maxAttempts) {
       setPaymentStatus('timeout');
       return;
     }
 
     try {
-      const response = await axios.get(`${API}/checkout/status/${sessionId}`);
+      // Long-poll: the server answers as soon as the payment status changes
+      const startedAt = Date.now();
+      const response = await axios.get(`${API}/checkout/status/${sessionId}`, { params: { wait: 20 } });
       
       if (response.data.payment_status === 'paid') {
         setPaymentStatus('success');
+      } else if (['refunded', 'failed'].includes(response.data.payment_status)) {
+        setPaymentStatus(response.data.payment_status);
       } else if (response.data.status === 'expired') {
         setPaymentStatus('expired');
       } else {
-        setTimeout(() => checkPaymentStatus(sessionId, attempts + 1), 2000);
+        // An early answer without a final status: pause before polling again
+        const delay = Math.max(0, 2000 - (Date.now() - startedAt));
+        setTimeout(() => checkPaymentStatus(sessionId, attempts + 1), delay);
       }
     } catch (error) {
       console.error('Error checking payment status:', error);
@@ -1430,6 +1495,22 @@ const SuccessPage = () => {
           </div>
         )}
 
+        {PAYMENT_ISSUES[paymentStatus] && (
+          <div>
+            <div className="w-16 h-16 bg-red-500 rounded-full flex items-center justify-center mx-auto mb-4">
+              <X className="w-8 h-8 text-white" />
+            </div>
+            <h2 className="text-2xl font-bold text-charcoal mb-2">{PAYMENT_ISSUES[paymentStatus].title}</h2>
+            <p className="text-charcoal/70 mb-6">{PAYMENT_ISSUES[paymentStatus].message}</p>
+            <button 
+              onClick={() => window.location.href = '/'}
+              className="bg-terracotta hover:bg-terracotta/90 text-white px-6 py-3 rounded-lg font-semibold"
+            >
+              Retour à l'accueil
+            </button>
+          </div>
+        )}
+
         {paymentStatus === 'error' && (
           <div>
             <div className="w-16 h-16 bg-red-500 rounded-full flex items-center justify-center mx-auto mb-4">
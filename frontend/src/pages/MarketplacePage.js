@@ -220,7 +220,9 @@ const MarketplacePage = () => {
     }
 
     try {
-      const audio = new Audio(track.preview_url || track.audio_url);
+      // Own tracks come with a signed audio_url, served by the backend
+      const url = track.preview_url || track.audio_url;
+      const audio = new Audio(url && url.startsWith('/uploads') ? `${BACKEND_URL}${url}` : url);
       audio.play();
       setCurrentAudio(audio);
       setPlayingTrack(track.id);
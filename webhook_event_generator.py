@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Local generator of fake Stripe webhook events.
+
+Builds checkout.session.completed events, signs them like Stripe does (with
+the local STRIPE_WEBHOOK_SECRET) and posts them to the payment and donation
+webhooks, sending every event several times and in bursts to exercise the
+webhook inbox deduplication. With --mongo-url it then checks that every event
+was stored once and eventually processed.
+
+Usage:
+    STRIPE_WEBHOOK_SECRET=whsec_test \\
+        python webhook_event_generator.py --base-url http://localhost:8001 \\
+        --session-id cs_test_123 --events 50 --duplicates 3 --mongo-url mongodb://localhost:27017
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def sign(payload, secret, timestamp=None):
+    """Stripe-Signature header value for a payload"""
+    timestamp = timestamp or int(time.time())
+    signed = f"{timestamp}.{payload}".encode()
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def checkout_completed_event(session_id, amount_cents=500, metadata=None):
+    return {
+        "id": f"evt_fake_{uuid.uuid4().hex[:24]}",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "created": int(time.time()),
+        "data": {
+            "object": {
+                "id": session_id,
+                "object": "checkout.session",
+                "payment_status": "paid",
+                "status": "complete",
+                "amount_total": amount_cents,
+                "currency": "eur",
+                "payment_intent": f"pi_fake_{uuid.uuid4().hex[:24]}",
+                "metadata": metadata or {}
+            }
+        }
+    }
+
+
+class WebhookEventGenerator:
+    def __init__(self, base_url, secret, concurrency=8):
+        self.base_url = base_url.rstrip("/")
+        self.secret = secret
+        self.concurrency = concurrency
+        self.statuses = {}
+
+    def post(self, path, event):
+        payload = json.dumps(event)
+        response = requests.post(
+            f"{self.base_url}{path}",
+            data=payload,
+            headers={"Content-Type": "application/json", "Stripe-Signature": sign(payload, self.secret)},
+            timeout=10
+        )
+        self.statuses[response.status_code] = self.statuses.get(response.status_code, 0) + 1
+        return response.status_code
+
+    def burst(self, path, events, duplicates):
+        """Send every event `duplicates` times, concurrently"""
+        deliveries = [event for event in events for _ in range(duplicates)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(lambda event: self.post(path, event), deliveries))
+        elapsed = time.perf_counter() - started
+        print(f"   {len(deliveries)} deliveries to {path} in {elapsed:.2f}s "
+              f"({elapsed / max(len(deliveries), 1) * 1000:.1f} ms each), statuses: {self.statuses}")
+
+
+def check_inbox(mongo_url, db_name, event_ids, timeout=30):
+    from pymongo import MongoClient
+    inbox = MongoClient(mongo_url)[db_name].webhook_inbox
+    stored = inbox.count_documents({"event_id": {"$in": event_ids}})
+    print(f"   Stored events: {stored} (expected {len(event_ids)})")
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        pending = inbox.count_documents({"event_id": {"$in": event_ids}, "status": "pending"})
+        if pending == 0:
+            break
+        time.sleep(1)
+    processed = inbox.count_documents({"event_id": {"$in": event_ids}, "status": "processed"})
+    failed = inbox.count_documents({"event_id": {"$in": event_ids}, "status": "failed"})
+    print(f"   Processed: {processed}, failed: {failed}")
+    return stored == len(event_ids) and processed == len(event_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--secret", default=os.getenv("STRIPE_WEBHOOK_SECRET"))
+    parser.add_argument("--session-id", action="append", default=[], help="Checkout session to complete (repeatable)")
+    parser.add_argument("--events", type=int, default=20, help="Donation events to generate")
+    parser.add_argument("--duplicates", type=int, default=3, help="Deliveries per event")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mongo-url", default=os.getenv("MONGO_URL"))
+    parser.add_argument("--db-name", default=os.getenv("DB_NAME", "test_database"))
+    args = parser.parse_args()
+
+    if not args.secret:
+        print("❌ STRIPE_WEBHOOK_SECRET (or --secret) is required to sign events")
+        return 1
+
+    generator = WebhookEventGenerator(args.base_url, args.secret, args.concurrency)
+
+    print("🔁 Track checkout events")
+    payment_events = [checkout_completed_event(session_id) for session_id in args.session_id]
+    if payment_events:
+        generator.burst("/api/webhook/stripe", payment_events, args.duplicates)
+
+    print("🔁 Donation events")
+    donation_events = [
+        checkout_completed_event(f"cs_fake_{uuid.uuid4().hex[:24]}", metadata={"purpose": "youtube_maintenance"})
+        for _ in range(args.events)
+    ]
+    generator.burst("/donation/webhook", donation_events, args.duplicates)
+
+    if args.mongo_url:
+        print("🔍 Checking the webhook inbox")
+        event_ids = [event["id"] for event in payment_events + donation_events]
+        if not check_inbox(args.mongo_url, args.db_name, event_ids):
+            print("❌ Inbox check failed")
+            return 1
+        print("✅ Every event stored once and processed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())